@@ -3,13 +3,23 @@
 import os
 import time
 import json
+import logging
+import threading
 import requests
 import httpx
+from collections import deque
+from typing import Dict, List, Tuple
 from dotenv import load_dotenv
-from openai import OpenAI
+from openai import OpenAI, APIConnectionError, APITimeoutError, InternalServerError
+
+from app.config import settings
+from app.logger import get_logger, log_event
+from app.profiling import profiled, span
 
 load_dotenv()
 
+logger = get_logger("agent")
+
 # -------------------------------------------------------------------------
 #  网络连接配置 (直连模式 - 无代理)
 # -------------------------------------------------------------------------
@@ -30,7 +40,157 @@ client = OpenAI(
 BACKEND_URL = "http://127.0.0.1:8000/api/create-plan"
 
 
+# -------------------------------------------------------------------------
+#  模型分档路由
+# -------------------------------------------------------------------------
+
+# 路由 -> 默认档位
+ROUTE_TIERS = {
+    "greeting": "fast",     # 40 字以内的问候语
+    "chat": "fast",         # 多轮对话中的追问
+    "chat_plan": "strong",  # 对话信息齐全后的最终计划 JSON
+    "plan": "strong",       # [Legacy] 单次生成计划
+}
+
+# 每个模型保留的最近延迟样本数（用于 p50 / p95）
+LATENCY_WINDOW = 200
+
+
+class ModelRouter:
+    """
+    按路由选择快 / 强两档模型
+
+    - 每档有独立超时，调用时关闭 SDK 自带重试，超时或服务端错误直接切到另一档
+    - 按路由记录每个模型的延迟、超时、错误，以及调用方上报的输出质量（JSON 是否可用）
+    """
+
+    def __init__(self, client: OpenAI, tiers: Dict[str, Tuple[str, float]], enabled: bool = True):
+        """
+        Args:
+            client: OpenAI 兼容客户端
+            tiers: {"fast": (模型名, 超时秒), "strong": (模型名, 超时秒)}
+            enabled: False 时所有路由都先用强模型（等同于旧行为，仍保留超时切换）
+        """
+        self.client = client
+        self.tiers = tiers
+        self.enabled = enabled
+        self._stats: Dict[str, dict] = {}
+        self._lock = threading.Lock()
+
+    def _route_stats(self, route: str) -> dict:
+        stats = self._stats.get(route)
+        if stats is None:
+            stats = {"calls": 0, "fallbacks": 0, "escalations": 0,
+                     "quality_ok": 0, "quality_bad": 0, "models": {}}
+            self._stats[route] = stats
+        return stats
+
+    def _record_call(self, route: str, model: str, latency: float, outcome: str):
+        with self._lock:
+            models = self._route_stats(route)["models"]
+            entry = models.get(model)
+            if entry is None:
+                entry = {"ok": 0, "timeout": 0, "error": 0, "latencies": deque(maxlen=LATENCY_WINDOW)}
+                models[model] = entry
+            entry[outcome] += 1
+            entry["latencies"].append(latency)
+
+    def record_quality(self, route: str, ok: bool):
+        """记录一次输出质量（例如 JSON 能否解析、计划字段是否齐全）"""
+        with self._lock:
+            self._route_stats(route)["quality_ok" if ok else "quality_bad"] += 1
+
+    def record_escalation(self, route: str):
+        """记录一次快模型结果被强模型重做"""
+        with self._lock:
+            self._route_stats(route)["escalations"] += 1
+
+    def tier_for(self, route: str) -> str:
+        return ROUTE_TIERS.get(route, "strong") if self.enabled else "strong"
+
+    def complete(self, route: str, messages: List[dict], **kwargs) -> Tuple[str, str]:
+        """
+        按路由调用模型，超时 / 连接失败 / 5xx 时切到另一档重试一次
+
+        Args:
+            route: 路由名（见 ROUTE_TIERS）
+            messages: 对话消息
+            **kwargs: 透传给 chat.completions.create 的参数
+
+        Returns:
+            (回复文本, 实际使用的档位)
+
+        Raises:
+            两档都失败时抛出最后一次的异常
+        """
+        primary = self.tier_for(route)
+        order = [primary, "strong" if primary == "fast" else "fast"]
+        with self._lock:
+            self._route_stats(route)["calls"] += 1
+
+        last_error = None
+        for attempt, tier in enumerate(order):
+            model, timeout = self.tiers[tier]
+            start = time.perf_counter()
+            try:
+                with span("llm", route=route, model=model):
+                    resp = self.client.with_options(timeout=timeout, max_retries=0).chat.completions.create(
+                        model=model, messages=messages, **kwargs
+                    )
+            except (APIConnectionError, InternalServerError) as e:
+                outcome = "timeout" if isinstance(e, APITimeoutError) else "error"
+                self._record_call(route, model, time.perf_counter() - start, outcome)
+                log_event(logger, logging.WARNING, "model_call_failed",
+                          route=route, model=model, outcome=outcome, error=str(e))
+                last_error = e
+                if attempt == 0:
+                    with self._lock:
+                        self._route_stats(route)["fallbacks"] += 1
+                continue
+
+            self._record_call(route, model, time.perf_counter() - start, "ok")
+            return resp.choices[0].message.content, tier
+
+        raise last_error
+
+    def stats(self) -> Dict[str, dict]:
+        """按路由汇总的统计（延迟单位毫秒）"""
+        with self._lock:
+            result = {}
+            for route, stats in self._stats.items():
+                models = {}
+                for model, entry in stats["models"].items():
+                    samples = sorted(entry["latencies"])
+                    models[model] = {
+                        "ok": entry["ok"],
+                        "timeout": entry["timeout"],
+                        "error": entry["error"],
+                        "p50_ms": round(samples[len(samples) // 2] * 1000, 1) if samples else None,
+                        "p95_ms": round(samples[int(len(samples) * 0.95)] * 1000, 1) if samples else None,
+                    }
+                result[route] = {**{k: v for k, v in stats.items() if k != "models"}, "models": models}
+            return result
+
+
+model_router = ModelRouter(
+    client,
+    {
+        "fast": (settings.QWEN_FAST_MODEL, settings.QWEN_FAST_TIMEOUT),
+        "strong": (settings.QWEN_STRONG_MODEL, settings.QWEN_STRONG_TIMEOUT),
+    },
+    enabled=settings.MODEL_ROUTING_ENABLED
+)
+
+# 最终计划必须包含的字段
+PLAN_FIELDS = ("savings_goal", "token_address", "amount_per_cycle", "cycle_frequency_seconds", "risk_strategy")
+
+
+def _is_complete_plan(data: dict) -> bool:
+    return isinstance(data, dict) and all(data.get(field) not in (None, "") for field in PLAN_FIELDS)
+
+
 # --- 1. 旧功能：单次生成 (保留以兼容) ---
+@profiled("agent")
 def generate_savings_plan(user_input: str) -> dict:
     """
     [Legacy] 调用 Qwen 生成个性化储蓄计划（JSON）
@@ -64,18 +224,18 @@ def generate_savings_plan(user_input: str) -> dict:
 """
 
     try:
-        resp = client.chat.completions.create(
-            model="qwen-plus",
-            messages=[
+        content, _tier = model_router.complete(
+            "plan",
+            [
                 {"role": "system", "content": system_prompt},
                 {"role": "user", "content": user_input}
             ],
             response_format={"type": "json_object"}
         )
 
-        content = resp.choices[0].message.content
         print("✨ Qwen 原始输出:", content)
         data = json.loads(content)
+        model_router.record_quality("plan", _is_complete_plan(data))
         return data
     except Exception as e:
         print("❌ 生成计划失败:", e)
@@ -194,6 +354,7 @@ GREETING_PROMPT_TEMPLATE = """
 
 
 # [修改] 增加了 chain_data 参数
+@profiled("agent")
 def chat_with_ai(user_input: str, history: list = [], chain_data: dict = None) -> dict:
     """
     处理多轮对话，返回 {"type": "question" | "plan", "content": "...", "data": ...}
@@ -215,23 +376,45 @@ def chat_with_ai(user_input: str, history: list = [], chain_data: dict = None) -
     
     user_prompt = f"【对话历史】:\n{history_text}\n\n【用户当前输入】:\n{user_input}"
 
+    messages = [
+        {"role": "system", "content": final_system_prompt},
+        {"role": "user", "content": user_prompt}
+    ]
+
     try:
-        resp = client.chat.completions.create(
-            model="qwen-plus",
-            messages=[
-                {"role": "system", "content": final_system_prompt},
-                {"role": "user", "content": user_prompt}
-            ],
-            response_format={"type": "json_object"}
-        )
-        content = resp.choices[0].message.content
-        return json.loads(content)
+        content, tier = model_router.complete("chat", messages, response_format={"type": "json_object"})
+        try:
+            result = json.loads(content)
+        except json.JSONDecodeError:
+            result = None
+        model_router.record_quality("chat", isinstance(result, dict))
+
+        # 快模型只负责追问：一旦判断信息齐全（或输出无法解析），由强模型生成最终计划
+        if tier == "fast" and (not isinstance(result, dict) or result.get("type") == "plan"):
+            model_router.record_escalation("chat")
+            try:
+                content, _tier = model_router.complete("chat_plan", messages, response_format={"type": "json_object"})
+                escalated = json.loads(content)
+            except Exception as e:
+                log_event(logger, logging.WARNING, "chat_escalation_failed", error=str(e))
+                escalated = None
+            ok = isinstance(escalated, dict) and (
+                escalated.get("type") != "plan" or _is_complete_plan(escalated.get("data"))
+            )
+            model_router.record_quality("chat_plan", ok)
+            # 强模型失败或输出无法解析时，退回快模型已经给出的有效结果
+            if isinstance(escalated, dict):
+                result = escalated
+            elif not isinstance(result, dict):
+                raise ValueError("快模型和强模型的输出都无法解析")
+        return result
     except Exception as e:
-        print("Chat Error:", e)
+        log_event(logger, logging.ERROR, "chat_failed", error=str(e))
         return {"type": "question", "content": "Master Wayne，似乎通讯线路受到了干扰... (请检查后端日志)"}
 
 
 # --- 新增：生成问候语函数 ---
+@profiled("agent")
 def generate_greeting(goal: str, progress: float) -> str:
     """
     根据目标和进度，生成首页的随机管家问候
@@ -240,18 +423,21 @@ def generate_greeting(goal: str, progress: float) -> str:
     prompt = GREETING_PROMPT_TEMPLATE.replace("{goal}", goal).replace("{progress}", str(progress))
     
     try:
-        resp = client.chat.completions.create(
-            model="qwen-plus",
-            messages=[
+        content, _tier = model_router.complete(
+            "greeting",
+            [
                 {"role": "system", "content": "你是 Alfred Pennyworth。"},
                 {"role": "user", "content": prompt}
             ],
             # 增加随机性，让每次刷新都不一样
             temperature=0.9
         )
-        return resp.choices[0].message.content.strip()
+        greeting = content.strip()
+        # 问候语要求 40 字以内，超长视为质量不达标
+        model_router.record_quality("greeting", 0 < len(greeting) <= 40)
+        return greeting
     except Exception as e:
-        print("Greeting Error:", e)
+        log_event(logger, logging.ERROR, "greeting_failed", error=str(e))
         return "欢迎回来，Master Wayne。今天的哥谭市依然平静。"
 
 
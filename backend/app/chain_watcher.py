@@ -0,0 +1,171 @@
+# chain_watcher.py
+# 链头追踪 - 订阅 newHeads（WebSocket，失败时回退 eth_blockNumber 轮询），
+# 逐块解析合约事件，只让受影响钱包的缓存失效
+
+import asyncio
+import json
+import logging
+from typing import Callable, Dict, List, Optional
+
+from app.logger import get_logger, log_event
+
+logger = get_logger("chain_watcher")
+
+# 会改变用户计划 / NFT 列表的事件（Transfer 同时影响 from 和 to 的 NFT 列表）
+WATCHED_EVENTS = ("DepositMade", "WithdrawalMade", "PlanCompleted", "MilestoneReached", "PlanCreated", "Transfer")
+
+# 单次 eth_getLogs 最多覆盖的区块数（落后太多时分段追赶）
+MAX_BLOCK_RANGE = 2000
+# 重启时最多从上次处理的区块追赶多少块，更久则直接清空所有钱包缓存
+MAX_CATCHUP_BLOCKS = 20 * MAX_BLOCK_RANGE
+
+# 事件监听回调参数: [{"event", "user", "block_number", "timestamp"}, ...]
+EventListener = Callable[[List[Dict]], None]
+
+
+class ChainHeadWatcher:
+    """
+    链头追踪器
+
+    每出现新区块，就读取 (上次处理区块, 新链头] 范围内的合约事件，
+    调用 Web3Service.invalidate_wallet 清除相关钱包的缓存，再通知其他监听者（如 nudge 调度器）。
+    因此计划 / NFT 列表的缓存可以长期有效，最多落后一个区块。
+
+    已处理到的区块记录在共享缓存中，重启后从该区块追赶，停机期间的事件同样会让缓存失效；
+    没有记录或落后太多时清空所有钱包缓存。
+    """
+
+    def __init__(self, web3_service, ws_url: Optional[str] = None, poll_seconds: float = 3.0,
+                 reconnect_seconds: float = 5.0, cache=None):
+        """
+        Args:
+            web3_service: Web3Service 实例
+            ws_url: WebSocket RPC 地址（None 表示只用轮询）
+            poll_seconds: 轮询间隔（秒）
+            reconnect_seconds: WebSocket 断开后的重连间隔（秒）
+            cache: SharedCache 实例，用于记录已处理区块（None 表示不记录）
+        """
+        self.web3_service = web3_service
+        self.cache = cache
+        self.head_key = f"{web3_service.CACHE_KEY_PREFIX}chain_head"
+        self.ws_url = ws_url
+        self.poll_seconds = poll_seconds
+        self.reconnect_seconds = reconnect_seconds
+        self.head: Optional[int] = None
+        self.listeners: List[EventListener] = []
+
+    def add_listener(self, listener: EventListener):
+        """注册事件监听回调"""
+        self.listeners.append(listener)
+
+    def _resume_from(self, head: int) -> int:
+        """首次处理时确定起点：上次记录的区块，或清空钱包缓存后从 head 开始"""
+        saved = None
+        if self.cache is not None:
+            try:
+                _hit, saved = self.cache.get(self.head_key)
+            except Exception as e:
+                log_event(logger, logging.WARNING, "chain_head_load_failed", error=str(e))
+
+        if isinstance(saved, int) and 0 <= head - saved <= MAX_CATCHUP_BLOCKS:
+            log_event(logger, logging.INFO, "chain_watch_resumed", from_block=saved + 1, head=head)
+            return saved
+
+        self.web3_service.invalidate_all_wallets()
+        log_event(logger, logging.INFO, "chain_watch_cache_flushed", saved=saved, head=head)
+        return head
+
+    def _save_head(self):
+        if self.cache is None:
+            return
+        try:
+            self.cache.set(self.head_key, self.head)
+        except Exception as e:
+            log_event(logger, logging.WARNING, "chain_head_save_failed", error=str(e))
+
+    def process_to(self, head: int) -> int:
+        """
+        处理到 head 为止的新区块（同步方法，在线程池中调用）
+
+        Returns:
+            int: 本次处理的事件数
+        """
+        if self.head is None:
+            self.head = self._resume_from(head)
+
+        processed = 0
+        while self.head < head:
+            from_block = self.head + 1
+            to_block = min(head, from_block + MAX_BLOCK_RANGE - 1)
+            events = self.web3_service.get_wallet_events(from_block, to_block, WATCHED_EVENTS)
+
+            for wallet in {event["user"] for event in events}:
+                self.web3_service.invalidate_wallet(wallet)
+
+            if events:
+                for listener in self.listeners:
+                    try:
+                        listener(events)
+                    except Exception as e:
+                        log_event(logger, logging.ERROR, "chain_listener_failed", error=str(e))
+
+            processed += len(events)
+            self.head = to_block
+            self._save_head()
+        return processed
+
+    async def _on_head(self, head: int):
+        try:
+            processed = await asyncio.to_thread(self.process_to, head)
+            if processed:
+                log_event(logger, logging.DEBUG, "chain_events_processed", head=head, events=processed)
+        except Exception as e:
+            # 本轮失败不推进 self.head，下一个区块到来时会重试这段范围
+            log_event(logger, logging.WARNING, "chain_events_failed", head=head, error=str(e))
+
+    async def _subscribe(self):
+        """newHeads 订阅，连接断开时抛出异常"""
+        import websockets
+
+        async with websockets.connect(self.ws_url) as ws:
+            await ws.send(json.dumps({
+                "jsonrpc": "2.0", "id": 1, "method": "eth_subscribe", "params": ["newHeads"]
+            }))
+            reply = json.loads(await ws.recv())
+            if "error" in reply:
+                raise ConnectionError(f"newHeads 订阅失败: {reply['error']}")
+            log_event(logger, logging.INFO, "chain_subscribed", transport="websocket")
+
+            async for message in ws:
+                data = json.loads(message)
+                header = data.get("params", {}).get("result")
+                if header and "number" in header:
+                    await self._on_head(int(header["number"], 16))
+
+    async def _poll(self, duration: Optional[float] = None):
+        """eth_blockNumber 轮询；duration 为 None 时一直轮询"""
+        loop = asyncio.get_running_loop()
+        deadline = None if duration is None else loop.time() + duration
+        while deadline is None or loop.time() < deadline:
+            try:
+                head = await asyncio.to_thread(self.web3_service.get_block_number)
+                if self.head is None or head > self.head:
+                    await self._on_head(head)
+            except Exception as e:
+                log_event(logger, logging.WARNING, "chain_poll_failed", error=str(e))
+            await asyncio.sleep(self.poll_seconds)
+
+    async def run(self):
+        """后台循环：优先 WebSocket 订阅，断线期间用轮询补上，之后再尝试重连"""
+        if not self.ws_url:
+            await self._poll()
+            return
+
+        while True:
+            try:
+                await self._subscribe()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                log_event(logger, logging.WARNING, "chain_subscription_lost", error=str(e))
+            await self._poll(duration=self.reconnect_seconds)
@@ -1,8 +1,11 @@
 # config.py
 # 配置管理模块
 
+import getpass
 import os
+import tempfile
 from pathlib import Path
+from typing import Optional
 from dotenv import load_dotenv
 
 # 加载环境变量
@@ -26,6 +29,126 @@ class Settings:
     WEB3_TIMEOUT: int = int(os.getenv("WEB3_TIMEOUT", "30"))
     WEB3_RETRY_ATTEMPTS: int = int(os.getenv("WEB3_RETRY_ATTEMPTS", "3"))
 
+    # 跨进程共享缓存（同机多个 uvicorn worker 共用一个 SQLite 文件）
+    # 默认放在按用户区分的私有目录（0700）下；目录必须属于运行服务的用户且其他用户不可写
+    CACHE_ENABLED: bool = os.getenv("CACHE_ENABLED", "true").lower() == "true"
+    CACHE_PATH: str = os.getenv(
+        "CACHE_PATH",
+        os.path.join(tempfile.gettempdir(), f"zetasave-{getpass.getuser()}", "cache.sqlite3")
+    )
+    CACHE_MAX_ENTRIES: int = int(os.getenv("CACHE_MAX_ENTRIES", "100000"))
+    # 链上可变数据（计划、NFT 列表、余额）的缓存时间；NFT 元数据不可变，永久缓存
+    CACHE_TTL_SECONDS: int = int(os.getenv("CACHE_TTL_SECONDS", "15"))
+    GREETING_CACHE_TTL_SECONDS: int = int(os.getenv("GREETING_CACHE_TTL_SECONDS", "60"))
+
+    # 准入控制（每个 worker 独立计数）
+    RATE_LIMIT_ENABLED: bool = os.getenv("RATE_LIMIT_ENABLED", "true").lower() == "true"
+    # LLM 路由: /api/ai/chat, /api/ai/greeting
+    RATE_LIMIT_LLM_WALLET_PER_MIN: float = float(os.getenv("RATE_LIMIT_LLM_WALLET_PER_MIN", "10"))
+    RATE_LIMIT_LLM_IP_PER_MIN: float = float(os.getenv("RATE_LIMIT_LLM_IP_PER_MIN", "30"))
+    RATE_LIMIT_LLM_CONCURRENCY: int = int(os.getenv("RATE_LIMIT_LLM_CONCURRENCY", "4"))
+    RATE_LIMIT_LLM_QUEUE_TIMEOUT: float = float(os.getenv("RATE_LIMIT_LLM_QUEUE_TIMEOUT", "10"))
+    # RPC / 计算路由: /api/user-nfts, /api/plan-progress, /api/plan-projection, /api/nft, /api/projections
+    RATE_LIMIT_RPC_WALLET_PER_MIN: float = float(os.getenv("RATE_LIMIT_RPC_WALLET_PER_MIN", "60"))
+    RATE_LIMIT_RPC_IP_PER_MIN: float = float(os.getenv("RATE_LIMIT_RPC_IP_PER_MIN", "120"))
+    RATE_LIMIT_RPC_CONCURRENCY: int = int(os.getenv("RATE_LIMIT_RPC_CONCURRENCY", "16"))
+    RATE_LIMIT_RPC_QUEUE_TIMEOUT: float = float(os.getenv("RATE_LIMIT_RPC_QUEUE_TIMEOUT", "2"))
+
+    # 存款提醒调度器（默认关闭；开启后多个 worker 中只有拿到文件锁的一个运行，
+    # 各 worker 收到的 create-plan 写入共享登记队列 NUDGE_INBOX_PATH，由该 worker 应用）
+    NUDGE_SCHEDULER_ENABLED: bool = os.getenv("NUDGE_SCHEDULER_ENABLED", "false").lower() == "true"
+    NUDGE_STATE_PATH: str = os.getenv(
+        "NUDGE_STATE_PATH",
+        os.path.join(tempfile.gettempdir(), "zetasave_nudges.json")
+    )
+    NUDGE_INBOX_PATH: str = os.getenv(
+        "NUDGE_INBOX_PATH",
+        os.path.join(tempfile.gettempdir(), "zetasave_nudge_inbox.sqlite3")
+    )
+    NUDGE_TICK_SECONDS: float = float(os.getenv("NUDGE_TICK_SECONDS", "5"))
+    NUDGE_BATCH_SIZE: int = int(os.getenv("NUDGE_BATCH_SIZE", "1000"))
+
+    # 存款历史曲线（由 DepositMade / WithdrawalMade 日志预聚合）
+    # 多 worker 时只有拿到文件锁的一个导入并写状态文件，其他 worker 跟随该文件
+    HISTORY_ENABLED: bool = os.getenv("HISTORY_ENABLED", "true").lower() == "true"
+    # 首次导入的起始区块，应设为合约部署区块；未设置时首次同步用 eth_getCode 二分查找（需要归档节点），
+    # 查找失败则不导入（不会从创世区块开始扫描）
+    HISTORY_START_BLOCK: Optional[int] = (
+        int(os.environ["HISTORY_START_BLOCK"]) if os.getenv("HISTORY_START_BLOCK") else None
+    )
+    HISTORY_BLOCK_CHUNK: int = int(os.getenv("HISTORY_BLOCK_CHUNK", "5000"))
+    HISTORY_POLL_SECONDS: float = float(os.getenv("HISTORY_POLL_SECONDS", "15"))
+    HISTORY_STATE_PATH: str = os.getenv(
+        "HISTORY_STATE_PATH",
+        os.path.join(tempfile.gettempdir(), "zetasave_history.json")
+    )
+
+    # 跨链交易追踪
+    TX_TRACKER_ENABLED: bool = os.getenv("TX_TRACKER_ENABLED", "true").lower() == "true"
+    # ZetaChain 上的 ZetaSaveCrossChain 合约（Gateway onCall / onRevert / onAbort 的接收方）
+    CROSSCHAIN_CONTRACT_ADDRESS: str = os.getenv(
+        "CROSSCHAIN_CONTRACT_ADDRESS",
+        "0x9BE8A2541A047E9A48d0626d64CF73d8f17D95DD"
+    )
+    # 源链 RPC，格式 "链ID=URL,链ID=URL"；ZetaChain (7001) 默认使用 ZETA_RPC_URL
+    SOURCE_CHAIN_RPC_URLS: str = os.getenv(
+        "SOURCE_CHAIN_RPC_URLS",
+        "11155111=https://ethereum-sepolia-rpc.publicnode.com,84532=https://sepolia.base.org"
+    )
+    # 交易状态共享存储（所有 worker 共用；轮询只在拿到文件锁的 worker 上运行）
+    TX_TRACKER_DB_PATH: str = os.getenv(
+        "TX_TRACKER_DB_PATH",
+        os.path.join(tempfile.gettempdir(), "zetasave_txs.sqlite3")
+    )
+    TX_TRACKER_POLL_SECONDS: float = float(os.getenv("TX_TRACKER_POLL_SECONDS", "5"))
+    TX_TRACKER_TIMEOUT_SECONDS: float = float(os.getenv("TX_TRACKER_TIMEOUT_SECONDS", "1800"))
+    TX_TRACKER_OUTBOUND_GRACE_SECONDS: float = float(os.getenv("TX_TRACKER_OUTBOUND_GRACE_SECONDS", "600"))
+    TX_TRACKER_RETENTION_SECONDS: float = float(os.getenv("TX_TRACKER_RETENTION_SECONDS", "3600"))
+
+    # 链头追踪：按新区块的合约事件精确失效缓存
+    CHAIN_WATCH_ENABLED: bool = os.getenv("CHAIN_WATCH_ENABLED", "true").lower() == "true"
+    # WebSocket RPC（支持 eth_subscribe newHeads）；为空则只用 eth_blockNumber 轮询
+    ZETA_WS_URL: str = os.getenv("ZETA_WS_URL", "")
+    CHAIN_WATCH_POLL_SECONDS: float = float(os.getenv("CHAIN_WATCH_POLL_SECONDS", "3"))
+    # 开启链头追踪后计划 / NFT 列表的缓存时间，只作为追踪中断时的兜底
+    CHAIN_WATCH_CACHE_TTL_SECONDS: int = int(os.getenv("CHAIN_WATCH_CACHE_TTL_SECONDS", "3600"))
+
+    # NFT 渲染缓存：tokenURI 元数据和图片按内容哈希存盘
+    NFT_RENDER_CACHE_DIR: str = os.getenv(
+        "NFT_RENDER_CACHE_DIR",
+        os.path.join(tempfile.gettempdir(), "zetasave_nft_cache")
+    )
+    NFT_IPFS_GATEWAY: str = os.getenv("NFT_IPFS_GATEWAY", "https://ipfs.io/ipfs/")
+    NFT_FETCH_TIMEOUT: int = int(os.getenv("NFT_FETCH_TIMEOUT", "15"))
+
+    # Alfred 模型分档：问候 / 追问走快模型，最终计划 JSON 走强模型；超时后切到另一档
+    MODEL_ROUTING_ENABLED: bool = os.getenv("MODEL_ROUTING_ENABLED", "true").lower() == "true"
+    QWEN_FAST_MODEL: str = os.getenv("QWEN_FAST_MODEL", "qwen-turbo")
+    QWEN_STRONG_MODEL: str = os.getenv("QWEN_STRONG_MODEL", "qwen-plus")
+    QWEN_FAST_TIMEOUT: float = float(os.getenv("QWEN_FAST_TIMEOUT", "8"))
+    QWEN_STRONG_TIMEOUT: float = float(os.getenv("QWEN_STRONG_TIMEOUT", "30"))
+
+    # 按需请求剖析：带 X-Profile-Token 头（值等于 PROFILE_TOKEN）的请求，或 PROFILE_ALL_REQUESTS 时的所有请求
+    # 两者都未配置时不挂载剖析中间件
+    PROFILE_TOKEN: str = os.getenv("PROFILE_TOKEN", "")
+    PROFILE_ALL_REQUESTS: bool = os.getenv("PROFILE_ALL_REQUESTS", "false").lower() == "true"
+    # 栈采样间隔（毫秒），0 表示只记录 span
+    PROFILE_SAMPLE_INTERVAL_MS: float = float(os.getenv("PROFILE_SAMPLE_INTERVAL_MS", "5"))
+    PROFILE_DIR: str = os.getenv("PROFILE_DIR", os.path.join(tempfile.gettempdir(), "zetasave_profiles"))
+    PROFILE_MAX_FILES: int = int(os.getenv("PROFILE_MAX_FILES", "200"))
+
+    # 快速序列化：链上数据跳过 Pydantic response_model 校验，直接用 orjson 输出
+    # 关闭时 user-nfts / plan-progress 走 FastAPI 原有的校验 + 序列化流程
+    FAST_SERIALIZATION: bool = os.getenv("FAST_SERIALIZATION", "true").lower() == "true"
+
+    # 日志配置
+    LOG_LEVEL: str = os.getenv("LOG_LEVEL", "INFO")
+    LOG_QUEUE_SIZE: int = int(os.getenv("LOG_QUEUE_SIZE", "10000"))
+    LOG_RATE_LIMIT_PER_SEC: float = float(os.getenv("LOG_RATE_LIMIT_PER_SEC", "20"))
+    # 按事件采样，例如 "chat_request=0.1,contract_retry=0.5"
+    LOG_SAMPLE_RATES: str = os.getenv("LOG_SAMPLE_RATES", "")
+    LOG_REDACT: bool = os.getenv("LOG_REDACT", "true").lower() == "true"
+
     # ABI 文件路径
     ABI_FILE_PATH: str = os.path.join(
         Path(__file__).parent,
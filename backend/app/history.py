@@ -0,0 +1,297 @@
+# history.py
+# 存款历史时间序列 - 由 DepositMade / WithdrawalMade 日志预聚合为小时 / 天 / 周三档，查询时按点数降采样
+
+import asyncio
+import json
+import logging
+import os
+import threading
+import time
+from bisect import bisect_right
+from typing import Dict, List, Optional, Tuple
+
+from app.logger import get_logger, log_event
+
+logger = get_logger("history")
+
+HOUR = 3600
+DAY = 86400
+WEEK = 604800
+RESOLUTIONS = (HOUR, DAY, WEEK)
+
+MAX_POINTS = 1000
+
+# 回填时没有新事件的区块段也要定期保存进度（秒），避免重启后从头扫描
+SAVE_INTERVAL = 10.0
+
+
+class _Series:
+    """单条累计曲线：每档分辨率一组 (桶起点, 桶结束时的累计值)，桶起点升序"""
+
+    __slots__ = ("buckets",)
+
+    def __init__(self):
+        self.buckets: Dict[int, Tuple[List[int], List[int]]] = {r: ([], []) for r in RESOLUTIONS}
+
+    def record(self, timestamp: int, value: int):
+        for resolution, (starts, values) in self.buckets.items():
+            bucket = timestamp - timestamp % resolution
+            if starts and starts[-1] == bucket:
+                values[-1] = value
+            elif not starts or starts[-1] < bucket:
+                starts.append(bucket)
+                values.append(value)
+            # 早于最后一个桶的乱序日志不会出现（日志按区块顺序导入）
+
+    def first_timestamp(self) -> Optional[int]:
+        starts = self.buckets[HOUR][0]
+        return starts[0] if starts else None
+
+
+class DepositHistory:
+    """
+    按计划 / 按钱包的累计存款曲线
+
+    - 计划曲线取 DepositMade.newTotal，WithdrawalMade 时减去取出金额（含手续费，与合约一致）
+    - 钱包曲线为该钱包所有计划余额之和
+    导入时更新三档预聚合；查询时在最合适的一档上二分取点，耗时只和点数有关。
+    """
+
+    def __init__(self):
+        self.last_block = -1
+        self._plans: Dict[str, _Series] = {}
+        self._wallets: Dict[str, _Series] = {}
+        self._plan_totals: Dict[str, int] = {}
+        self._wallet_totals: Dict[str, int] = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _plan_key(wallet: str, plan_id: int) -> str:
+        return f"{wallet.lower()}:{plan_id}"
+
+    def ingest(self, wallet: str, plan_id: int, new_total: int, timestamp: int):
+        """
+        导入一条 DepositMade 事件
+
+        Args:
+            wallet: 用户地址
+            plan_id: 计划 ID
+            new_total: 存款后的计划累计金额（Wei）
+            timestamp: 区块时间戳
+        """
+        self._apply(wallet, plan_id, timestamp, lambda previous: new_total)
+
+    def ingest_withdrawal(self, wallet: str, plan_id: int, amount: int, timestamp: int):
+        """
+        导入一条 WithdrawalMade 事件
+
+        Args:
+            wallet: 用户地址
+            plan_id: 计划 ID
+            amount: 从计划余额中扣除的金额（Wei）
+            timestamp: 区块时间戳
+        """
+        self._apply(wallet, plan_id, timestamp, lambda previous: max(previous - amount, 0))
+
+    def _apply(self, wallet: str, plan_id: int, timestamp: int, update):
+        """按 update(旧余额) -> 新余额 更新计划和钱包曲线"""
+        wallet = wallet.lower()
+        plan_key = self._plan_key(wallet, plan_id)
+        with self._lock:
+            previous = self._plan_totals.get(plan_key, 0)
+            new_total = update(previous)
+            self._plan_totals[plan_key] = new_total
+            wallet_total = self._wallet_totals.get(wallet, 0) + new_total - previous
+            self._wallet_totals[wallet] = wallet_total
+
+            self._plans.setdefault(plan_key, _Series()).record(timestamp, new_total)
+            self._wallets.setdefault(wallet, _Series()).record(timestamp, wallet_total)
+
+    def query(self, wallet: str, plan_id: Optional[int] = None, points: int = 100,
+              start: Optional[int] = None, end: Optional[int] = None) -> Dict:
+        """
+        查询累计曲线并降采样到 points 个点
+
+        Args:
+            wallet: 用户地址
+            plan_id: 计划 ID（None 表示钱包所有计划之和）
+            points: 返回点数
+            start: 起始时间戳（默认第一笔存款所在小时）
+            end: 结束时间戳（默认最后一笔存款所在小时之后）
+
+        Returns:
+            Dict: {"resolution": 秒, "points": [[时间戳, 累计金额字符串], ...]}
+        """
+        key = self._plan_key(wallet, plan_id) if plan_id is not None else wallet.lower()
+        table = self._plans if plan_id is not None else self._wallets
+
+        with self._lock:
+            series = table.get(key)
+            if series is None:
+                return {"resolution": HOUR, "points": []}
+
+            if start is None:
+                start = series.first_timestamp()
+            if end is None:
+                end = series.buckets[HOUR][0][-1] + HOUR
+            if end <= start:
+                return {"resolution": HOUR, "points": []}
+
+            width = (end - start) / points
+            # 选不超过点间距的最粗一档
+            resolution = max((r for r in RESOLUTIONS if r <= width), default=HOUR)
+            starts, values = series.buckets[resolution]
+
+            result = []
+            for i in range(1, points + 1):
+                ts = int(start + i * width)
+                # 取 ts 所在（或之前最近）的桶，误差不超过一个桶宽，而桶宽不超过点间距
+                idx = bisect_right(starts, ts) - 1
+                result.append([ts, str(values[idx]) if idx >= 0 else "0"])
+
+        return {"resolution": resolution, "points": result}
+
+    def save(self, path: str):
+        """保存预聚合结果和已处理区块（锁内只做快照，序列化和写文件在锁外，不阻塞 query）"""
+        def snapshot(table: Dict[str, _Series]) -> Dict:
+            return {k: {str(r): (list(v[0]), list(v[1])) for r, v in s.buckets.items()} for k, s in table.items()}
+
+        with self._lock:
+            state = {
+                "last_block": self.last_block,
+                "plan_totals": dict(self._plan_totals),
+                "wallet_totals": dict(self._wallet_totals),
+                "plans": snapshot(self._plans),
+                "wallets": snapshot(self._wallets),
+            }
+
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        try:
+            with open(tmp_path, "w") as f:
+                json.dump(state, f, separators=(",", ":"))
+            os.replace(tmp_path, path)
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+
+    def load(self, path: str):
+        """从状态文件恢复"""
+        if not os.path.exists(path):
+            return
+        try:
+            with open(path, "r") as f:
+                state = json.load(f)
+        except (OSError, json.JSONDecodeError) as e:
+            log_event(logger, logging.WARNING, "history_load_failed", path=path, error=str(e))
+            return
+
+        def restore(raw: Dict) -> Dict[str, _Series]:
+            table = {}
+            for key, buckets in raw.items():
+                series = _Series()
+                series.buckets = {int(r): (v[0], v[1]) for r, v in buckets.items()}
+                table[key] = series
+            return table
+
+        plans = restore(state["plans"])
+        wallets = restore(state["wallets"])
+        with self._lock:
+            self.last_block = state["last_block"]
+            self._plan_totals = state["plan_totals"]
+            self._wallet_totals = state["wallet_totals"]
+            self._plans = plans
+            self._wallets = wallets
+        log_event(logger, logging.INFO, "history_loaded", last_block=self.last_block, plans=len(self._plans))
+
+
+class HistoryIndexer:
+    """从合约 DepositMade / WithdrawalMade 日志增量导入 DepositHistory"""
+
+    def __init__(self, web3_service, history: DepositHistory, start_block: Optional[int] = None,
+                 block_chunk: int = 5000, state_path: Optional[str] = None):
+        """
+        Args:
+            web3_service: Web3Service 实例
+            history: 导入目标
+            start_block: 首次导入的起始区块（合约部署区块）；None 表示首次同步时用 eth_getCode 查找
+            block_chunk: 单次 eth_getLogs 的区块跨度
+            state_path: 状态文件路径（None 表示不持久化）
+        """
+        self.web3_service = web3_service
+        self.history = history
+        self.start_block = start_block
+        self.block_chunk = block_chunk
+        self.state_path = state_path
+
+    def sync_once(self) -> int:
+        """
+        导入到最新区块为止的所有新日志
+
+        Returns:
+            int: 本次导入的事件数
+        """
+        if self.history.last_block < 0 and self.start_block is None:
+            self.start_block = self.web3_service.find_deployment_block()
+            log_event(logger, logging.INFO, "history_start_block_found", start_block=self.start_block)
+
+        latest = self.web3_service.get_block_number()
+        from_block = max(self.history.last_block + 1, self.start_block or 0)
+        imported = 0
+        last_save = time.monotonic()
+        unsaved = False
+
+        while from_block <= latest:
+            to_block = min(from_block + self.block_chunk - 1, latest)
+            events = self.web3_service.get_balance_events(from_block, to_block)
+            for event in events:
+                if event["event"] == "WithdrawalMade":
+                    self.history.ingest_withdrawal(event["user"], event["plan_id"], event["amount"], event["timestamp"])
+                else:
+                    self.history.ingest(event["user"], event["plan_id"], event["new_total"], event["timestamp"])
+            imported += len(events)
+            self.history.last_block = to_block
+            from_block = to_block + 1
+            unsaved = True
+
+            # 有新事件或距上次保存超过 SAVE_INTERVAL 时保存进度，空区块段的扫描也不会在重启后重做
+            if self.state_path and (events or time.monotonic() - last_save >= SAVE_INTERVAL):
+                self.history.save(self.state_path)
+                last_save = time.monotonic()
+                unsaved = False
+
+        if unsaved and self.state_path:
+            self.history.save(self.state_path)
+        return imported
+
+    async def run(self, poll_seconds: float = 15.0):
+        """后台循环：在线程池中同步日志，避免阻塞事件循环"""
+        while True:
+            try:
+                imported = await asyncio.to_thread(self.sync_once)
+                if imported:
+                    log_event(logger, logging.INFO, "history_synced",
+                              events=imported, last_block=self.history.last_block)
+            except Exception as e:
+                log_event(logger, logging.WARNING, "history_sync_failed", error=str(e))
+            await asyncio.sleep(poll_seconds)
+
+
+async def follow_state_file(history: DepositHistory, path: str, poll_seconds: float = 15.0):
+    """
+    非导入 worker 的后台循环：状态文件更新后重新加载
+
+    多 worker 部署时只有持有文件锁的 worker 运行 HistoryIndexer，
+    其他 worker 从它写出的状态文件读取曲线，避免各自从头回填、争写同一文件。
+    """
+    last_mtime = None
+    while True:
+        try:
+            mtime = os.stat(path).st_mtime_ns
+            if mtime != last_mtime:
+                await asyncio.to_thread(history.load, path)
+                last_mtime = mtime
+        except FileNotFoundError:
+            pass
+        except Exception as e:
+            log_event(logger, logging.WARNING, "history_reload_failed", error=str(e))
+        await asyncio.sleep(poll_seconds)
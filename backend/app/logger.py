@@ -0,0 +1,273 @@
+# logger.py
+# 结构化日志模块 - 队列异步输出 / 采样限流 / 请求 ID 关联 / 敏感信息脱敏
+
+import json
+import logging
+import logging.handlers
+import queue
+import random
+import re
+import sys
+import threading
+import time
+import uuid
+from contextvars import ContextVar
+from typing import Any, Dict, Optional
+
+# 当前请求 ID（由 main.py 中间件设置，Web3 / AI 调用的日志自动带上）
+request_id_var: ContextVar[str] = ContextVar("request_id", default="-")
+
+# 需要整体隐藏内容的字段（聊天内容 / 用户输入的目标等）
+REDACTED_FIELDS = {"message", "content", "history", "user_input", "savings_goal", "greeting"}
+
+_ADDRESS_RE = re.compile(r"0x[a-fA-F0-9]{40}")
+
+# 允许沿用的客户端请求 ID（十六进制 / UUID，最长 64 字符）
+_REQUEST_ID_RE = re.compile(r"[0-9a-fA-F][0-9a-fA-F-]{0,63}")
+
+ROOT_LOGGER_NAME = "zetasave"
+
+_listener: Optional[logging.handlers.QueueListener] = None
+
+
+def new_request_id() -> str:
+    """生成新的请求 ID"""
+    return uuid.uuid4().hex[:16]
+
+
+def is_valid_request_id(value: Optional[str]) -> bool:
+    """请求 ID 是否为十六进制 / UUID 形式（可安全写入日志、响应头和文件名）"""
+    return bool(value) and _REQUEST_ID_RE.fullmatch(value) is not None
+
+
+def get_request_id() -> str:
+    """获取当前上下文的请求 ID"""
+    return request_id_var.get()
+
+
+def redact_address(address: str) -> str:
+    """钱包地址脱敏: 0x1234...abcd"""
+    return f"{address[:6]}...{address[-4:]}"
+
+
+def redact_value(key: str, value: Any) -> Any:
+    """
+    递归脱敏日志字段
+
+    Args:
+        key: 字段名
+        value: 字段值
+
+    Returns:
+        脱敏后的值
+    """
+    if key in REDACTED_FIELDS and value is not None:
+        return f"<redacted len={len(str(value))}>"
+    if isinstance(value, str):
+        return _ADDRESS_RE.sub(lambda m: redact_address(m.group(0)), value)
+    if isinstance(value, dict):
+        return {k: redact_value(k, v) for k, v in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [redact_value(key, v) for v in value]
+    return value
+
+
+class RequestContextFilter(logging.Filter):
+    """把当前请求 ID 写入日志记录（必须在调用线程中执行）"""
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        record.request_id = request_id_var.get()
+        return True
+
+
+class SamplingFilter(logging.Filter):
+    """
+    按事件采样 + 令牌桶限流
+
+    - sample_rates: {event: 采样率(0~1)}，未配置的事件不采样
+    - rate_per_sec: 每个事件每秒最多输出的条数（突发上限同值）
+    - ERROR 及以上级别永不丢弃
+    被丢弃的条数会累积，并附在该事件下一条输出的日志上（dropped 字段）
+    """
+
+    def __init__(self, sample_rates: Dict[str, float], rate_per_sec: float):
+        super().__init__()
+        self.sample_rates = sample_rates
+        self.rate_per_sec = rate_per_sec
+        self._buckets: Dict[str, list] = {}   # event -> [tokens, last_refill]
+        self._dropped: Dict[str, int] = {}
+        self._lock = threading.Lock()
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if record.levelno >= logging.ERROR:
+            return True
+
+        event = getattr(record, "event", record.getMessage())
+
+        rate = self.sample_rates.get(event, 1.0)
+        if rate < 1.0 and random.random() >= rate:
+            self._count_drop(event)
+            return False
+
+        if self.rate_per_sec > 0:
+            now = time.monotonic()
+            with self._lock:
+                bucket = self._buckets.get(event)
+                if bucket is None:
+                    bucket = self._buckets[event] = [self.rate_per_sec, now]
+                bucket[0] = min(self.rate_per_sec, bucket[0] + (now - bucket[1]) * self.rate_per_sec)
+                bucket[1] = now
+                if bucket[0] < 1:
+                    self._dropped[event] = self._dropped.get(event, 0) + 1
+                    return False
+                bucket[0] -= 1
+
+        with self._lock:
+            record.dropped = self._dropped.pop(event, 0)
+        return True
+
+    def _count_drop(self, event: str):
+        with self._lock:
+            self._dropped[event] = self._dropped.get(event, 0) + 1
+
+
+class NonBlockingQueueHandler(logging.handlers.QueueHandler):
+    """
+    非阻塞队列 Handler
+
+    请求线程只做入队；格式化、脱敏和写 stdout 都在 QueueListener 线程完成。
+    队列满时直接丢弃，不阻塞请求；丢弃的条数附在下一条成功入队的日志上（queue_dropped 字段）。
+    """
+
+    def __init__(self, log_queue: queue.Queue):
+        super().__init__(log_queue)
+        self.overflow_count = 0      # 累计丢弃条数
+        self._pending_overflow = 0   # 尚未报告的丢弃条数
+        self._overflow_lock = threading.Lock()
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        # 只处理不能跨线程传递的部分，其余格式化工作留给监听线程
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+    def enqueue(self, record: logging.LogRecord):
+        with self._overflow_lock:
+            pending, self._pending_overflow = self._pending_overflow, 0
+        record.queue_dropped = pending
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            with self._overflow_lock:
+                self.overflow_count += 1
+                self._pending_overflow += pending + 1
+
+
+class JSONFormatter(logging.Formatter):
+    """单行 JSON 格式化（可选脱敏）"""
+
+    def __init__(self, redact: bool = True):
+        super().__init__()
+        self.redact = redact
+
+    def format(self, record: logging.LogRecord) -> str:
+        fields = getattr(record, "fields", None) or {}
+        if self.redact:
+            fields = redact_value("", fields)
+
+        entry = {
+            "ts": round(record.created, 3),
+            "level": record.levelname,
+            "logger": record.name,
+            "event": getattr(record, "event", None) or record.getMessage(),
+            "request_id": getattr(record, "request_id", "-"),
+        }
+        entry.update(fields)
+        if getattr(record, "dropped", 0):
+            entry["dropped"] = record.dropped
+        if getattr(record, "queue_dropped", 0):
+            entry["queue_dropped"] = record.queue_dropped
+        if record.exc_text:
+            entry["exc"] = record.exc_text
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+
+def parse_sample_rates(spec: str) -> Dict[str, float]:
+    """解析采样配置，例如 "chat_request=0.1,contract_retry=0.5" """
+    rates = {}
+    for item in spec.split(","):
+        if "=" not in item:
+            continue
+        event, rate = item.split("=", 1)
+        try:
+            rates[event.strip()] = max(0.0, min(1.0, float(rate)))
+        except ValueError:
+            continue
+    return rates
+
+
+def setup_logging(level: str = "INFO", queue_size: int = 10000, rate_per_sec: float = 20.0,
+                  sample_rates: str = "", redact: bool = True) -> logging.Logger:
+    """
+    初始化结构化日志（应用启动时调用一次）
+
+    Args:
+        level: 日志级别
+        queue_size: 日志队列长度，满了直接丢弃
+        rate_per_sec: 每个事件每秒最多输出条数（0 表示不限）
+        sample_rates: 按事件采样配置
+        redact: 是否脱敏钱包地址和聊天内容
+
+    Returns:
+        logging.Logger: 根日志对象
+    """
+    global _listener
+
+    root = logging.getLogger(ROOT_LOGGER_NAME)
+    if _listener is not None:
+        return root
+
+    log_queue: queue.Queue = queue.Queue(maxsize=queue_size)
+
+    handler = NonBlockingQueueHandler(log_queue)
+    handler.addFilter(RequestContextFilter())
+    handler.addFilter(SamplingFilter(parse_sample_rates(sample_rates), rate_per_sec))
+
+    stream_handler = logging.StreamHandler(sys.stdout)
+    stream_handler.setFormatter(JSONFormatter(redact=redact))
+
+    _listener = logging.handlers.QueueListener(log_queue, stream_handler, respect_handler_level=True)
+    _listener.start()
+
+    root.handlers = [handler]
+    root.setLevel(level.upper())
+    root.propagate = False
+    return root
+
+
+def shutdown_logging():
+    """停止日志监听线程并刷出剩余日志"""
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
+
+
+def get_logger(name: str) -> logging.Logger:
+    """获取模块日志对象"""
+    return logging.getLogger(f"{ROOT_LOGGER_NAME}.{name}")
+
+
+def log_event(logger: logging.Logger, level: int, event: str, **fields):
+    """
+    输出一条结构化日志
+
+    Args:
+        logger: 日志对象
+        level: 日志级别 (logging.INFO 等)
+        event: 事件名（采样 / 限流按事件名统计）
+        **fields: 附加字段
+    """
+    if logger.isEnabledFor(level):
+        logger.log(level, event, extra={"event": event, "fields": fields})
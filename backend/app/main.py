@@ -1,12 +1,18 @@
 # backend/app/main.py
 # 安装依赖: pip install fastapi uvicorn pydantic web3
 
-from fastapi import FastAPI, HTTPException
+from fastapi import FastAPI, HTTPException, Request, Response
 from fastapi.middleware.cors import CORSMiddleware
 from pydantic import BaseModel
 from typing import Optional, List, Dict, Any
 from contextlib import asynccontextmanager
+from concurrent.futures import ThreadPoolExecutor
+import asyncio
 import datetime
+import logging
+import re
+
+import requests
 
 # 导入 Web3 相关模块
 from app.web3_service import (
@@ -14,18 +20,113 @@ from app.web3_service import (
     Web3ConnectionError,
     InvalidAddressError,
     ContractCallError,
-    PlanNotFoundError
+    PlanNotFoundError,
+    NFTNotFoundError
 )
 from app.config import settings
-from app.models import UserNFTsResponse, UserPlanResponse, NFTMetadata
+from app.shared_cache import SharedCache
+from app.rate_limit import AdmissionControlMiddleware, default_route_limits
+from app.scheduler import NudgeScheduler, NudgeInbox
+from app.worker_lock import try_acquire as try_acquire_worker_lock
+from app.history import DepositHistory, HistoryIndexer, follow_state_file, MAX_POINTS
+from app.tx_tracker import TxTracker, parse_rpc_urls, ZETACHAIN_CHAIN_ID
+from app.chain_watcher import ChainHeadWatcher
+from app.nft_render import NFTRenderCache, THUMBNAIL_SIZES
+from app.profiling import ProfilingMiddleware
+from app.models import (
+    UserNFTsResponse,
+    UserPlanResponse,
+    ProjectionInput,
+    ProjectionRequest,
+    ProjectionResponse,
+    PlanProjection
+)
+from app.projection import project_plans, to_response, parse_amount
+from app.serialization import FastJSONResponse
+from app.logger import (
+    setup_logging,
+    shutdown_logging,
+    get_logger,
+    log_event,
+    new_request_id,
+    is_valid_request_id,
+    request_id_var
+)
+
+logger = get_logger("api")
 
 # 全局 Web3 服务实例
 web3_service: Optional[Web3Service] = None
 
+# 全局共享缓存（同机多 worker 共用）
+shared_cache: Optional[SharedCache] = None
+
+# 全局存款提醒调度器
+nudge_scheduler: Optional[NudgeScheduler] = None
+# 提醒登记队列（所有 worker 写入，运行调度器的 worker 读取）
+nudge_inbox: Optional[NudgeInbox] = None
+
+# 全局存款历史曲线（预聚合）
+deposit_history = DepositHistory()
+
+# 全局跨链交易追踪器
+tx_tracker: Optional[TxTracker] = None
+
+# 全局 NFT 渲染缓存
+nft_render_cache: Optional[NFTRenderCache] = None
+
+# tokenURI 内容不可变，浏览器 / CDN 可以永久缓存
+IMMUTABLE_CACHE_CONTROL = "public, max-age=31536000, immutable"
+# 缓存内容来自链上 / IPFS，不可信：禁止嗅探类型，SVG 内的脚本和外链资源一律不执行
+BLOB_SECURITY_HEADERS = {
+    "X-Content-Type-Options": "nosniff",
+    "Content-Security-Policy": "default-src 'none'; style-src 'unsafe-inline'; sandbox",
+}
+
+def log_nudge_batch(batch: List[Dict[str, Any]]):
+    """默认的 nudge 回调：记录到期的计划（推送渠道接入后在此替换 / 追加回调）"""
+    log_event(logger, logging.INFO, "nudge_batch", count=len(batch),
+              wallets=[item["wallet"] for item in batch[:20]])
+
+def reschedule_on_deposit(events: List[Dict[str, Any]]):
+    """
+    链上出现存款时，按存款所在区块的时间重新调度该钱包的提醒
+
+    在链头追踪的工作线程中调用，NudgeScheduler 内部加锁，可与事件循环上的 tick / schedule 并发。
+    """
+    if nudge_scheduler is None:
+        return
+    for event in events:
+        if event["event"] == "DepositMade":
+            nudge_scheduler.record_deposit(event["user"], event["timestamp"])
+
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     """应用生命周期管理"""
-    global web3_service
+    global web3_service, shared_cache, nudge_scheduler, nudge_inbox, tx_tracker, nft_render_cache
+
+    # 启动结构化日志（队列异步输出）
+    setup_logging(
+        level=settings.LOG_LEVEL,
+        queue_size=settings.LOG_QUEUE_SIZE,
+        rate_per_sec=settings.LOG_RATE_LIMIT_PER_SEC,
+        sample_rates=settings.LOG_SAMPLE_RATES,
+        redact=settings.LOG_REDACT
+    )
+
+    # 线程池容量覆盖各路由类别的并发上限（默认线程池只有 CPU 数 + 4 个线程），
+    # 否则请求会在线程池里排队，准入控制看不到
+    asyncio.get_running_loop().set_default_executor(ThreadPoolExecutor(
+        max_workers=settings.RATE_LIMIT_LLM_CONCURRENCY + settings.RATE_LIMIT_RPC_CONCURRENCY + 8,
+        thread_name_prefix="zetasave"
+    ))
+
+    # 初始化共享缓存（失败则退化为不缓存）
+    if settings.CACHE_ENABLED:
+        try:
+            shared_cache = SharedCache(settings.CACHE_PATH, max_entries=settings.CACHE_MAX_ENTRIES)
+        except Exception as e:
+            print(f"⚠️ 共享缓存初始化失败，将不使用缓存: {e}")
 
     # 启动时初始化 Web3
     print("🚀 正在初始化 Web3 服务...")
@@ -36,20 +137,123 @@ async def lifespan(app: FastAPI):
             contract_address=settings.ZETA_CONTRACT_ADDRESS,
             abi_path=settings.ABI_FILE_PATH,
             timeout=settings.WEB3_TIMEOUT,
-            max_retries=settings.WEB3_RETRY_ATTEMPTS
+            max_retries=settings.WEB3_RETRY_ATTEMPTS,
+            cache=shared_cache,
+            cache_ttl=settings.CACHE_TTL_SECONDS,
+            state_cache_ttl=(settings.CHAIN_WATCH_CACHE_TTL_SECONDS
+                             if settings.CHAIN_WATCH_ENABLED else settings.CACHE_TTL_SECONDS)
         )
         print("✅ Web3 服务初始化成功")
     except Exception as e:
         print(f"❌ Web3 服务初始化失败: {e}")
         print("⚠️ 服务器将继续运行，但 Web3 功能不可用")
 
+    # 初始化 NFT 渲染缓存
+    if web3_service is not None:
+        try:
+            nft_render_cache = NFTRenderCache(
+                settings.NFT_RENDER_CACHE_DIR,
+                web3_service,
+                ipfs_gateway=settings.NFT_IPFS_GATEWAY,
+                fetch_timeout=settings.NFT_FETCH_TIMEOUT
+            )
+        except Exception as e:
+            print(f"⚠️ NFT 渲染缓存初始化失败: {e}")
+
+    # 启动存款提醒调度器
+    # 所有 worker 都把登记写入共享队列，只有持有文件锁的 worker 运行调度器并应用队列
+    scheduler_task = None
+    if settings.NUDGE_SCHEDULER_ENABLED:
+        nudge_inbox = NudgeInbox(settings.NUDGE_INBOX_PATH)
+        if try_acquire_worker_lock(f"{settings.NUDGE_STATE_PATH}.lock"):
+            nudge_scheduler = NudgeScheduler(
+                settings.NUDGE_STATE_PATH,
+                batch_size=settings.NUDGE_BATCH_SIZE,
+                inbox=nudge_inbox
+            )
+            nudge_scheduler.load()
+            nudge_scheduler.add_callback(log_nudge_batch)
+            scheduler_task = asyncio.create_task(nudge_scheduler.run(tick_seconds=settings.NUDGE_TICK_SECONDS))
+        else:
+            log_event(logger, logging.INFO, "scheduler_skipped", reason="another worker runs the scheduler")
+
+    # 启动存款历史导入
+    history_task = None
+    if settings.HISTORY_ENABLED and not try_acquire_worker_lock(f"{settings.HISTORY_STATE_PATH}.lock"):
+        # 其他 worker 负责导入，这里只跟随它写出的状态文件
+        history_task = asyncio.create_task(
+            follow_state_file(deposit_history, settings.HISTORY_STATE_PATH, poll_seconds=settings.HISTORY_POLL_SECONDS)
+        )
+    elif settings.HISTORY_ENABLED and web3_service is not None:
+        deposit_history.load(settings.HISTORY_STATE_PATH)
+        indexer = HistoryIndexer(
+            web3_service,
+            deposit_history,
+            start_block=settings.HISTORY_START_BLOCK,
+            block_chunk=settings.HISTORY_BLOCK_CHUNK,
+            state_path=settings.HISTORY_STATE_PATH
+        )
+        history_task = asyncio.create_task(indexer.run(poll_seconds=settings.HISTORY_POLL_SECONDS))
+
+    # 启动跨链交易追踪
+    tracker_task = None
+    if settings.TX_TRACKER_ENABLED:
+        rpc_urls = parse_rpc_urls(settings.SOURCE_CHAIN_RPC_URLS)
+        rpc_urls[ZETACHAIN_CHAIN_ID] = settings.ZETA_RPC_URL
+        tx_tracker = TxTracker(
+            rpc_urls,
+            settings.CROSSCHAIN_CONTRACT_ADDRESS,
+            settings.TX_TRACKER_DB_PATH,
+            request_timeout=settings.WEB3_TIMEOUT,
+            pending_timeout=settings.TX_TRACKER_TIMEOUT_SECONDS,
+            outbound_grace=settings.TX_TRACKER_OUTBOUND_GRACE_SECONDS,
+            retention=settings.TX_TRACKER_RETENTION_SECONDS
+        )
+        # 所有 worker 都能登记 / 查询，轮询只由持有文件锁的一个 worker 执行
+        if try_acquire_worker_lock(f"{settings.TX_TRACKER_DB_PATH}.lock"):
+            tracker_task = asyncio.create_task(tx_tracker.run(poll_seconds=settings.TX_TRACKER_POLL_SECONDS))
+
+    # 启动链头追踪（缓存失效 + 存款后重新调度提醒）
+    # 失效通过共享缓存对所有 worker 生效，只需一个 worker 运行；与调度器使用同一把锁，
+    # 保证 reschedule_on_deposit 所在的 worker 上 nudge_scheduler 不为 None
+    watcher_task = None
+    watch_lock = f"{settings.NUDGE_STATE_PATH}.lock"
+    if settings.CHAIN_WATCH_ENABLED and web3_service is not None and not try_acquire_worker_lock(watch_lock):
+        log_event(logger, logging.INFO, "chain_watch_skipped", reason="another worker runs the chain watcher")
+    elif settings.CHAIN_WATCH_ENABLED and web3_service is not None:
+        chain_watcher = ChainHeadWatcher(
+            web3_service,
+            ws_url=settings.ZETA_WS_URL or None,
+            poll_seconds=settings.CHAIN_WATCH_POLL_SECONDS,
+            cache=shared_cache
+        )
+        chain_watcher.add_listener(reschedule_on_deposit)
+        watcher_task = asyncio.create_task(chain_watcher.run())
+
     yield
 
     # 关闭时清理
+    for task in (scheduler_task, history_task, tracker_task, watcher_task):
+        if task is None:
+            continue
+        task.cancel()
+        try:
+            await task
+        except asyncio.CancelledError:
+            pass
+        except Exception as e:
+            # 后台任务异常退出时也要继续清理，保证日志队列被刷新
+            log_event(logger, logging.ERROR, "background_task_failed", task=task.get_name(), error=str(e))
+
     print("👋 关闭 Web3 服务...")
+    shutdown_logging()
 
 app = FastAPI(lifespan=lifespan)
 
+# 添加准入控制中间件（放在 CORS 内层，429 响应同样带 CORS 头）
+if settings.RATE_LIMIT_ENABLED:
+    app.add_middleware(AdmissionControlMiddleware, route_limits=default_route_limits(settings))
+
 # 添加 CORS 中间件
 app.add_middleware(
     CORSMiddleware,
@@ -57,8 +261,37 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Request-ID", "Retry-After", "Server-Timing", "X-Profile-Id"],
 )
 
+# 添加按需剖析中间件（在请求 ID 中间件内层，profile 文件以请求 ID 命名）
+if settings.PROFILE_TOKEN or settings.PROFILE_ALL_REQUESTS:
+    app.add_middleware(
+        ProfilingMiddleware,
+        token=settings.PROFILE_TOKEN,
+        profile_all=settings.PROFILE_ALL_REQUESTS,
+        sample_interval_ms=settings.PROFILE_SAMPLE_INTERVAL_MS,
+        profile_dir=settings.PROFILE_DIR,
+        max_files=settings.PROFILE_MAX_FILES
+    )
+
+@app.middleware("http")
+async def request_context_middleware(request: Request, call_next):
+    """
+    为每个请求分配请求 ID（客户端传入的 X-Request-ID 为十六进制 / UUID 形式时沿用，否则重新生成），
+    同一请求内的 Web3 / AI 日志都会带上该 ID
+    """
+    request_id = request.headers.get("X-Request-ID")
+    if not is_valid_request_id(request_id):
+        request_id = new_request_id()
+    token = request_id_var.set(request_id)
+    try:
+        response = await call_next(request)
+    finally:
+        request_id_var.reset(token)
+    response.headers["X-Request-ID"] = request_id
+    return response
+
 # --- 1. 定义数据模型 ---
 class SavingPlan(BaseModel):
     # plan_id 后端生成，所以这里可以不传，或者由AI传
@@ -77,6 +310,28 @@ class SavingPlan(BaseModel):
 # --- 2. 模拟数据库 (用一个全局列表代替) ---
 fake_db = []
 
+# 物化视图：钱包地址(小写) -> 最新计划，在 create_plan 时更新，避免每次倒序扫描 fake_db
+latest_plans: Dict[str, Dict[str, Any]] = {}
+# 钱包首次登记的顺序（只追加），作为批量接口游标的遍历顺序
+latest_plan_wallets: List[str] = []
+
+MAX_CONTRACT_DATA_BATCH = 5000
+
+class ContractDataBatchRequest(BaseModel):
+    addresses: List[str]    # 需要查询的钱包地址列表
+
+def _contract_action(user_plan: Optional[Dict[str, Any]]) -> Dict[str, Any]:
+    """由最新计划生成 keeper 使用的动作"""
+    if not user_plan or user_plan['status'] != 'ACTIVE':
+        return {"action": "NONE"}
+
+    return {
+        "action": "DEPOSIT",
+        "token": user_plan['token_address'],
+        "amount": user_plan['amount_per_cycle'],
+        "interval": user_plan['cycle_frequency_seconds']
+    }
+
 @app.post("/api/create-plan")
 async def create_plan(plan: SavingPlan):
     """
@@ -93,8 +348,29 @@ async def create_plan(plan: SavingPlan):
     new_record['status'] = 'ACTIVE'
     
     fake_db.append(new_record)
+
+    wallet_key = plan.user_wallet_address.lower()
+    if wallet_key not in latest_plans:
+        latest_plan_wallets.append(wallet_key)
+    latest_plans[wallet_key] = new_record
+
+    # 4. 登记存款提醒（以最新计划为准）；经共享队列转交运行调度器的 worker
+    if nudge_inbox is not None:
+        if plan.nudge_enabled:
+            await asyncio.to_thread(
+                nudge_inbox.put_schedule,
+                plan.user_wallet_address,
+                new_record['plan_id'],
+                plan.cycle_frequency_seconds,
+                plan.start_time_timestamp + plan.cycle_frequency_seconds
+            )
+        else:
+            await asyncio.to_thread(nudge_inbox.put_remove, plan.user_wallet_address)
     
-    print(f"✅ 收到新计划: {new_record}")
+    log_event(logger, logging.INFO, "plan_created",
+              plan_id=new_record['plan_id'],
+              user_wallet_address=new_record['user_wallet_address'],
+              savings_goal=new_record['savings_goal'])
     return {"status": "success", "plan_id": new_record['plan_id']}
 
 @app.get("/api/contract-data/{user_address}")
@@ -103,20 +379,68 @@ async def get_contract_data(user_address: str):
     给智能合约读取用的接口 (模拟)
     """
     # 查找该用户的最新计划
-    user_plan = next((p for p in reversed(fake_db) if p["user_wallet_address"] == user_address), None)
+    return _contract_action(latest_plans.get(user_address.lower()))
 
-    if not user_plan:
-        return {"action": "NONE"}
+@app.post("/api/contract-data/batch")
+async def get_contract_data_batch(req: ContractDataBatchRequest):
+    """
+    keeper 批量读取接口：一次返回多个地址的动作
+    """
+    if len(req.addresses) > MAX_CONTRACT_DATA_BATCH:
+        raise HTTPException(
+            status_code=400,
+            detail=f"单次最多查询 {MAX_CONTRACT_DATA_BATCH} 个地址"
+        )
 
     return {
-        "action": "DEPOSIT",
-        "token": user_plan['token_address'],
-        "amount": user_plan['amount_per_cycle'],
-        "interval": user_plan['cycle_frequency_seconds']
+        "results": {
+            address: _contract_action(latest_plans.get(address.lower()))
+            for address in req.addresses
+        }
+    }
+
+@app.get("/api/contract-data")
+async def list_contract_data(cursor: int = 0, limit: int = 1000):
+    """
+    keeper 遍历接口：按游标分页返回所有激活计划的动作
+    next_cursor 为 None 表示已遍历完
+    """
+    if cursor < 0 or not 0 < limit <= MAX_CONTRACT_DATA_BATCH:
+        raise HTTPException(
+            status_code=400,
+            detail=f"cursor 必须非负，limit 必须在 1 到 {MAX_CONTRACT_DATA_BATCH} 之间"
+        )
+
+    end = min(cursor + limit, len(latest_plan_wallets))
+    items = []
+    for wallet in latest_plan_wallets[cursor:end]:
+        user_plan = latest_plans[wallet]
+        if user_plan['status'] != 'ACTIVE':
+            continue
+        items.append({"user_address": user_plan['user_wallet_address'], **_contract_action(user_plan)})
+
+    return {
+        "items": items,
+        "next_cursor": end if end < len(latest_plan_wallets) else None
     }
 
 # --- 3. Web3 相关接口 ---
 
+def _load_user_nft_records(address: str) -> list:
+    """读取用户的 NFT 列表及每个 NFT 的元数据（阻塞，在线程池中调用）"""
+    # 1. 获取用户的 NFT ID 列表
+    nft_ids = web3_service.get_user_nfts(address)
+
+    # 2. 获取每个 NFT 的元数据（链上解码结果可信，跳过重复校验）
+    records = []
+    for nft_id in nft_ids:
+        try:
+            records.append(web3_service.get_nft_record(nft_id))
+        except Exception as e:
+            log_event(logger, logging.WARNING, "nft_metadata_failed", token_id=nft_id, error=str(e))
+            continue
+    return records
+
 @app.get("/api/user-nfts/{address}", response_model=UserNFTsResponse)
 async def get_user_nfts(address: str):
     """
@@ -130,25 +454,18 @@ async def get_user_nfts(address: str):
         )
 
     try:
-        # 1. 获取用户的 NFT ID 列表
-        nft_ids = web3_service.get_user_nfts(address)
-
-        # 2. 获取每个 NFT 的元数据
-        nfts_metadata = []
-        for nft_id in nft_ids:
-            try:
-                metadata = web3_service.get_nft_metadata(nft_id)
-                nfts_metadata.append(NFTMetadata(**metadata))
-            except Exception as e:
-                print(f"⚠️ 获取 NFT {nft_id} 元数据失败: {e}")
-                continue
-
-        # 3. 返回响应
-        return UserNFTsResponse(
-            user_address=address,
-            nft_count=len(nfts_metadata),
-            nfts=nfts_metadata
-        )
+        # RPC 调用放到线程池，事件循环只负责调度，准入控制的并发上限才真正生效
+        records = await asyncio.to_thread(_load_user_nft_records, address)
+
+        # 返回响应（快速路径直接输出，跳过 response_model 校验；否则走 FastAPI 原有校验流程）
+        content = {
+            "user_address": address,
+            "nft_count": len(records),
+            "nfts": [r.to_dict() for r in records]
+        }
+        if settings.FAST_SERIALIZATION:
+            return FastJSONResponse(content)
+        return content
 
     except InvalidAddressError as e:
         raise HTTPException(status_code=400, detail=f"无效的地址格式: {e}")
@@ -159,6 +476,58 @@ async def get_user_nfts(address: str):
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"服务器内部错误: {e}")
 
+def _immutable_response(request: Request, content: bytes, media_type: str, etag: str) -> Response:
+    """带长期缓存头和安全头的响应；If-None-Match 命中时返回 304"""
+    headers = {"Cache-Control": IMMUTABLE_CACHE_CONTROL, "ETag": f'"{etag}"', **BLOB_SECURITY_HEADERS}
+    if request.headers.get("if-none-match") == headers["ETag"]:
+        return Response(status_code=304, headers=headers)
+    return Response(content=content, media_type=media_type, headers=headers)
+
+def _nft_render_error(e: Exception) -> HTTPException:
+    if isinstance(e, NFTNotFoundError):
+        return HTTPException(status_code=404, detail=f"NFT 不存在: {e}")
+    if isinstance(e, Web3ConnectionError):
+        return HTTPException(status_code=500, detail=f"RPC 连接失败: {e}")
+    if isinstance(e, ContractCallError):
+        return HTTPException(status_code=500, detail=f"合约调用失败: {e}")
+    if isinstance(e, requests.RequestException):
+        return HTTPException(status_code=502, detail=f"IPFS 网关请求失败: {e}")
+    return HTTPException(status_code=502, detail=f"tokenURI 解析失败: {e}")
+
+@app.get("/api/nft/{token_id}/metadata")
+async def get_nft_render_metadata(token_id: int, request: Request):
+    """
+    获取 NFT 的 tokenURI 元数据 JSON（已解码，磁盘缓存，可长期缓存）
+    """
+    if nft_render_cache is None:
+        raise HTTPException(status_code=503, detail="Web3 服务未初始化")
+
+    try:
+        content, etag = await asyncio.to_thread(nft_render_cache.get_metadata, token_id)
+    except Exception as e:
+        raise _nft_render_error(e)
+    return _immutable_response(request, content, "application/json", etag)
+
+@app.get("/api/nft/{token_id}/image")
+async def get_nft_render_image(token_id: int, request: Request, size: Optional[int] = None):
+    """
+    获取 NFT 图片（SVG / PNG），可选 size 指定缩略图边长
+    """
+    if nft_render_cache is None:
+        raise HTTPException(status_code=503, detail="Web3 服务未初始化")
+    if size is not None and size not in THUMBNAIL_SIZES:
+        raise HTTPException(status_code=400, detail=f"size 只支持 {list(THUMBNAIL_SIZES)}")
+
+    try:
+        result = await asyncio.to_thread(nft_render_cache.get_image, token_id, size)
+    except Exception as e:
+        raise _nft_render_error(e)
+    if result is None:
+        raise HTTPException(status_code=404, detail="NFT 没有图片")
+
+    content, media_type, etag = result
+    return _immutable_response(request, content, media_type, etag)
+
 @app.get("/api/plan-progress/{address}/{plan_id}", response_model=UserPlanResponse)
 async def get_plan_progress(address: str, plan_id: int):
     """
@@ -177,8 +546,10 @@ async def get_plan_progress(address: str, plan_id: int):
         )
 
     try:
-        plan_data = web3_service.get_user_plan(address, plan_id)
-        return UserPlanResponse(**plan_data)
+        record = await asyncio.to_thread(web3_service.get_plan_record, address, plan_id)
+        if settings.FAST_SERIALIZATION:
+            return FastJSONResponse(record.to_dict())
+        return record.to_dict()
 
     except InvalidAddressError as e:
         raise HTTPException(status_code=400, detail=f"无效的地址格式: {e}")
@@ -191,6 +562,178 @@ async def get_plan_progress(address: str, plan_id: int):
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"服务器内部错误: {e}")
 
+# --- 计划预测接口 ---
+
+MAX_SIMULATIONS = 10000
+# 单次请求的计划数上限，以及计划数 × 模拟次数的上限（约 2 秒 CPU，在线程池中执行）
+MAX_PROJECTION_PLANS = 10000
+MAX_PROJECTION_CELLS = 10_000_000
+
+def _run_projection(plans: List[ProjectionInput], simulations: int, seed: Optional[int]) -> List[dict]:
+    """校验输入并一次性向量化计算所有计划的预测（CPU 密集，在线程池中调用）"""
+    if not 0 <= simulations <= MAX_SIMULATIONS:
+        raise HTTPException(status_code=400, detail=f"simulations 必须在 0 到 {MAX_SIMULATIONS} 之间")
+    if len(plans) > MAX_PROJECTION_PLANS:
+        raise HTTPException(status_code=400, detail=f"单次最多预测 {MAX_PROJECTION_PLANS} 个计划")
+    if len(plans) * simulations > MAX_PROJECTION_CELLS:
+        raise HTTPException(
+            status_code=400,
+            detail=f"计划数 × simulations 不能超过 {MAX_PROJECTION_CELLS}，请分批请求或减少模拟次数"
+        )
+
+    try:
+        target = [parse_amount(p.target_amount) for p in plans]
+        current = [parse_amount(p.current_amount) for p in plans]
+        per_cycle = [parse_amount(p.amount_per_cycle) for p in plans]
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=f"金额格式错误: {e}")
+
+    if any(a <= 0 for a in per_cycle):
+        raise HTTPException(status_code=400, detail="Amount must be positive")
+    if any(p.cycle_frequency_seconds <= 0 for p in plans):
+        raise HTTPException(status_code=400, detail="cycle_frequency_seconds 必须大于 0")
+
+    try:
+        result = project_plans(
+            target_amount=target,
+            current_amount=current,
+            amount_per_cycle=per_cycle,
+            cycle_frequency=[p.cycle_frequency_seconds for p in plans],
+            start_time=[p.start_time_timestamp for p in plans],
+            last_deposit_time=[p.last_deposit_time for p in plans],
+            risk_strategy=[p.risk_strategy for p in plans],
+            simulations=simulations,
+            seed=seed
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return to_response(result)
+
+@app.post("/api/projections", response_model=ProjectionResponse)
+async def create_projections(req: ProjectionRequest):
+    """
+    批量计算计划预测（完成时间、里程碑 ETA、是否落后、漏存情景）
+    """
+    if not req.plans:
+        raise HTTPException(status_code=400, detail="plans 不能为空")
+
+    projections = await asyncio.to_thread(_run_projection, req.plans, req.simulations, req.seed)
+    return {"count": len(projections), "projections": projections}
+
+@app.get("/api/plan-projection/{address}/{plan_id}", response_model=PlanProjection)
+async def get_plan_projection(address: str, plan_id: int, simulations: int = 1000):
+    """
+    读取链上计划并计算预测；风险策略取该钱包在后端登记的最新计划
+    """
+    if web3_service is None:
+        raise HTTPException(
+            status_code=503,
+            detail="Web3 服务未初始化"
+        )
+
+    if plan_id < 0:
+        raise HTTPException(
+            status_code=400,
+            detail="plan_id 必须是非负整数"
+        )
+
+    try:
+        record = await asyncio.to_thread(web3_service.get_plan_record, address, plan_id)
+    except InvalidAddressError as e:
+        raise HTTPException(status_code=400, detail=f"无效的地址格式: {e}")
+    except PlanNotFoundError as e:
+        raise HTTPException(status_code=404, detail=f"计划不存在: {e}")
+    except Web3ConnectionError as e:
+        raise HTTPException(status_code=500, detail=f"RPC 连接失败: {e}")
+    except ContractCallError as e:
+        raise HTTPException(status_code=500, detail=f"合约调用失败: {e}")
+
+    user_plan = latest_plans.get(address.lower())
+
+    plan_input = ProjectionInput(
+        target_amount=record.target_amount,
+        current_amount=record.current_amount,
+        amount_per_cycle=record.amount_per_cycle,
+        cycle_frequency_seconds=record.cycle_frequency,
+        start_time_timestamp=int(record.start_time),
+        last_deposit_time=int(record.last_deposit_time),
+        risk_strategy=user_plan["risk_strategy"] if user_plan else "conservative"
+    )
+    projections = await asyncio.to_thread(_run_projection, [plan_input], simulations, None)
+    return projections[0]
+
+# --- 存款历史曲线接口 ---
+
+@app.get("/api/history/{address}")
+async def get_deposit_history(address: str, plan_id: Optional[int] = None, points: int = 100,
+                              start: Optional[int] = None, end: Optional[int] = None):
+    """
+    获取累计存款曲线（不传 plan_id 时为钱包所有计划之和），降采样到 points 个点
+    """
+    if not 0 < points <= MAX_POINTS:
+        raise HTTPException(status_code=400, detail=f"points 必须在 1 到 {MAX_POINTS} 之间")
+    if plan_id is not None and plan_id < 0:
+        raise HTTPException(
+            status_code=400,
+            detail="plan_id 必须是非负整数"
+        )
+
+    series = deposit_history.query(address, plan_id=plan_id, points=points, start=start, end=end)
+    return {
+        "user_address": address,
+        "plan_id": plan_id,
+        "last_block": deposit_history.last_block,
+        **series
+    }
+
+# --- 跨链交易状态接口 ---
+
+MAX_TRACKED_PER_REQUEST = 100
+_TX_HASH_RE = re.compile(r"0x[a-fA-F0-9]{64}")
+
+class TxWatchItem(BaseModel):
+    tx_hash: str        # 交易哈希
+    chain_id: int       # 交易所在链（源链或 ZetaChain 7001）
+
+class TxWatchRequest(BaseModel):
+    transactions: List[TxWatchItem]
+
+@app.post("/api/tx-status/watch")
+async def watch_transactions(req: TxWatchRequest):
+    """
+    提交需要追踪的交易，由后端统一轮询，前端只需查询状态
+    """
+    if tx_tracker is None:
+        raise HTTPException(status_code=503, detail="交易追踪服务未启用")
+    if len(req.transactions) > MAX_TRACKED_PER_REQUEST:
+        raise HTTPException(status_code=400, detail=f"单次最多提交 {MAX_TRACKED_PER_REQUEST} 笔交易")
+
+    for item in req.transactions:
+        if not _TX_HASH_RE.fullmatch(item.tx_hash):
+            raise HTTPException(status_code=400, detail=f"无效的交易哈希: {item.tx_hash}")
+        if item.chain_id not in tx_tracker.rpc_urls:
+            raise HTTPException(status_code=400, detail=f"不支持的链: {item.chain_id}")
+
+    def watch_all() -> List[dict]:
+        return [tx_tracker.watch(item.tx_hash, item.chain_id).to_dict() for item in req.transactions]
+
+    return {"transactions": await asyncio.to_thread(watch_all)}
+
+@app.get("/api/tx-status")
+async def get_transaction_status(hashes: str):
+    """
+    批量查询交易状态，hashes 为逗号分隔的交易哈希
+    """
+    if tx_tracker is None:
+        raise HTTPException(status_code=503, detail="交易追踪服务未启用")
+
+    tx_hashes = [h.strip() for h in hashes.split(",") if h.strip()]
+    if len(tx_hashes) > MAX_TRACKED_PER_REQUEST:
+        raise HTTPException(status_code=400, detail=f"单次最多查询 {MAX_TRACKED_PER_REQUEST} 笔交易")
+
+    statuses = await asyncio.to_thread(tx_tracker.get_status, tx_hashes)
+    return {"transactions": dict(zip(tx_hashes, statuses))}
+
 # =======================================================
 #  [阶段一] Alfred 随机问候 (Random Greetings)
 # =======================================================
@@ -213,10 +756,21 @@ async def get_greeting(req: GreetingRequest):
     if req.target_amount > 0:
         progress = round((req.current_amount / req.target_amount) * 100, 1)
         
-    print(f"🎩 Alfred 正在思考问候语... (目标: {req.savings_goal}, 进度: {progress}%)")
-
-    # 调用 AI
-    greeting_text = generate_greeting(req.savings_goal, progress)
+    log_event(logger, logging.INFO, "greeting_request", savings_goal=req.savings_goal, progress=progress)
+
+    # 调用 AI（相同目标和进度的问候语在所有 worker 间共享一段时间，避免重复请求 LLM）
+    # LLM 调用和等待其他 worker 的缓存结果都是阻塞的，放到线程池执行
+    if shared_cache is not None:
+        greeting_text = await asyncio.to_thread(
+            shared_cache.get_or_compute,
+            f"greeting:{req.savings_goal}:{progress}",
+            lambda: generate_greeting(req.savings_goal, progress),
+            settings.GREETING_CACHE_TTL_SECONDS,
+            # 等到租约到期为止：其他 worker 正在调用 LLM 时不再重复调用
+            wait_seconds=shared_cache.lease_seconds
+        )
+    else:
+        greeting_text = await asyncio.to_thread(generate_greeting, req.savings_goal, progress)
     
     return {
         "status": "success",
@@ -255,28 +809,30 @@ async def chat_endpoint(req: ChatRequest):
     # 只有当地址不是默认值且 Web3 服务可用时才查询
     if req.wallet_address and req.wallet_address != "0xUnknown" and web3_service:
         try:
-            print(f"🔍 正在读取链上数据: {req.wallet_address}")
             # 1. 查余额 (需确保 Web3Service 已更新 get_native_balance 方法)
-            balance = web3_service.get_native_balance(req.wallet_address)
+            balance = await asyncio.to_thread(web3_service.get_native_balance, req.wallet_address)
             # 2. 查 NFT 数量
-            nft_ids = web3_service.get_user_nfts(req.wallet_address)
+            nft_ids = await asyncio.to_thread(web3_service.get_user_nfts, req.wallet_address)
             
             chain_data = {
                 "balance": balance,
                 "nft_count": len(nft_ids)
             }
-            print(f"📊 链上数据获取成功: {chain_data}")
+            log_event(logger, logging.DEBUG, "chain_data_loaded",
+                      wallet_address=req.wallet_address, **chain_data)
         except Exception as e:
-            print(f"⚠️ 读取链上数据失败 (不影响对话): {e}")
+            log_event(logger, logging.WARNING, "chain_data_failed",
+                      wallet_address=req.wallet_address, error=str(e))
     # -----------------------------
 
     # 转换 Pydantic 对象为 dict 列表给 agent 用
     history_dicts = [{"role": h.role, "content": h.content} for h in req.history]
     
-    print(f"🤖 收到 AI 请求: {req.message}")
+    log_event(logger, logging.INFO, "chat_request",
+              wallet_address=req.wallet_address, message=req.message, history_len=len(history_dicts))
 
-    # 调用 AI 核心逻辑 (传入 chain_data)
-    ai_response = chat_with_ai(req.message, history_dicts, chain_data=chain_data)
+    # 调用 AI 核心逻辑 (传入 chain_data)；LLM 调用是阻塞的，放到线程池执行
+    ai_response = await asyncio.to_thread(chat_with_ai, req.message, history_dicts, chain_data=chain_data)
     
     # 构造返回给前端的数据
     response_data = {
@@ -286,10 +842,23 @@ async def chat_endpoint(req: ChatRequest):
         "plan_data": ai_response.get("data", None)
     }
     
-    # 如果 AI 已经生成了 plan，我们顺便在后端打印一下日志
+    # 如果 AI 已经生成了 plan，我们顺便在后端记录一下日志
     if response_data["type"] == "plan" and response_data["plan_data"]:
-        print(f"✅ AI 完成了计划生成: {response_data['plan_data']}")
+        log_event(logger, logging.INFO, "chat_plan_generated", plan_data=response_data['plan_data'])
         
     return response_data
 
+@app.get("/api/ai/model-stats")
+async def get_model_stats():
+    """
+    模型分档路由的统计（按路由：调用数、超时切换、强模型重做、输出质量、各模型延迟）
+    """
+    from ai_module.agent import model_router
+
+    return {
+        "routing_enabled": model_router.enabled,
+        "tiers": {tier: {"model": model, "timeout": timeout} for tier, (model, timeout) in model_router.tiers.items()},
+        "routes": model_router.stats()
+    }
+
 # 启动命令: uvicorn main:app --reload
\ No newline at end of file
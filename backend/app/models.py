@@ -2,7 +2,7 @@
 # Pydantic 数据模型
 
 from pydantic import BaseModel
-from typing import List
+from typing import List, Optional
 
 class NFTMetadata(BaseModel):
     """NFT 元数据模型"""
@@ -33,3 +33,126 @@ class UserPlanResponse(BaseModel):
     milestone_100_claimed: bool     # 100% 里程碑是否领取
     savings_goal: str               # 储蓄目标描述
     progress_percent: str           # 进度百分比（字符串）
+
+class ProjectionInput(BaseModel):
+    """计划预测输入（金额单位 Wei，字符串）"""
+    target_amount: str              # 目标金额
+    current_amount: str = "0"       # 当前金额
+    amount_per_cycle: str           # 每周期金额
+    cycle_frequency_seconds: int    # 周期频率（秒）
+    start_time_timestamp: int       # 开始时间戳
+    last_deposit_time: int = 0      # 最后存款时间戳（0 表示还没存过）
+    risk_strategy: str = "conservative"
+
+class ProjectionRequest(BaseModel):
+    """批量预测请求"""
+    plans: List[ProjectionInput]    # 计划列表
+    simulations: int = 1000         # 蒙特卡洛模拟次数（0 表示不模拟）
+    seed: Optional[int] = None      # 随机种子（便于复现）
+
+class ProjectionScenarios(BaseModel):
+    """漏存情景模拟结果"""
+    miss_probability: float         # 每期漏存概率
+    p50_completion_timestamp: int   # 50% 情景下的完成时间
+    p90_completion_timestamp: int   # 90% 情景下的完成时间
+    expected_missed_deposits: float # 预计漏存期数
+
+class PlanProjection(BaseModel):
+    """单个计划的预测结果"""
+    status: str                     # completed / not_started / on_track / behind
+    cycles_remaining: int           # 剩余期数
+    completion_timestamp: int       # 预计完成时间
+    milestone_50_timestamp: int     # 预计达到 50% 的时间
+    milestone_100_timestamp: int    # 预计达到 100% 的时间
+    expected_amount_now: str        # 按计划到现在应存金额 Wei（字符串）
+    scenarios: Optional[ProjectionScenarios] = None
+
+class ProjectionResponse(BaseModel):
+    """批量预测响应"""
+    count: int
+    projections: List[PlanProjection]
+
+
+# --- 快速序列化：直接由 ABI 元组解码的紧凑记录 ---
+# 数据来自我们自己的解码器，字段类型已确定，不需要再走一遍 Pydantic 校验
+
+class NFTRecord:
+    """NFT 元数据紧凑记录（__slots__，无校验）"""
+    __slots__ = ("token_id", "milestone_percent", "achievement_date",
+                 "savings_amount", "token_address", "goal_description")
+
+    def __init__(self, token_id, milestone_percent, achievement_date,
+                 savings_amount, token_address, goal_description):
+        self.token_id = token_id
+        self.milestone_percent = milestone_percent
+        self.achievement_date = achievement_date
+        self.savings_amount = savings_amount
+        self.token_address = token_address
+        self.goal_description = goal_description
+
+    @classmethod
+    def from_abi(cls, token_id: int, result: tuple) -> "NFTRecord":
+        """由 getNFTMetadata 返回的元组构造（大整数转字符串，防止精度丢失）"""
+        milestone_percent, achievement_date, savings_amount, token_address, goal_description = result
+        return cls(token_id, str(milestone_percent), str(achievement_date),
+                   str(savings_amount), token_address, goal_description)
+
+    def to_dict(self) -> dict:
+        return {
+            "token_id": self.token_id,
+            "milestone_percent": self.milestone_percent,
+            "achievement_date": self.achievement_date,
+            "savings_amount": self.savings_amount,
+            "token_address": self.token_address,
+            "goal_description": self.goal_description
+        }
+
+
+class PlanRecord:
+    """储蓄计划紧凑记录（__slots__，无校验）"""
+    __slots__ = ("token_address", "target_amount", "current_amount", "amount_per_cycle",
+                 "cycle_frequency", "start_time", "last_deposit_time", "is_active",
+                 "milestone_50_claimed", "milestone_100_claimed", "savings_goal",
+                 "progress_percent")
+
+    def __init__(self, token_address, target_amount, current_amount, amount_per_cycle,
+                 cycle_frequency, start_time, last_deposit_time, is_active,
+                 milestone_50_claimed, milestone_100_claimed, savings_goal, progress_percent):
+        self.token_address = token_address
+        self.target_amount = target_amount
+        self.current_amount = current_amount
+        self.amount_per_cycle = amount_per_cycle
+        self.cycle_frequency = cycle_frequency
+        self.start_time = start_time
+        self.last_deposit_time = last_deposit_time
+        self.is_active = is_active
+        self.milestone_50_claimed = milestone_50_claimed
+        self.milestone_100_claimed = milestone_100_claimed
+        self.savings_goal = savings_goal
+        self.progress_percent = progress_percent
+
+    @classmethod
+    def from_abi(cls, result: tuple) -> "PlanRecord":
+        """由 getUserPlan 返回的 12 元组构造"""
+        (token_address, target_amount, current_amount, amount_per_cycle,
+         cycle_frequency, start_time, last_deposit_time, active,
+         milestone_50_claimed, milestone_100_claimed, savings_goal, progress_percent) = result
+        return cls(token_address, str(target_amount), str(current_amount), str(amount_per_cycle),
+                   cycle_frequency, str(start_time), str(last_deposit_time), active,
+                   milestone_50_claimed, milestone_100_claimed, savings_goal, str(progress_percent))
+
+    def to_dict(self) -> dict:
+        return {
+            "token_address": self.token_address,
+            "target_amount": self.target_amount,
+            "current_amount": self.current_amount,
+            "amount_per_cycle": self.amount_per_cycle,
+            "cycle_frequency": self.cycle_frequency,
+            "start_time": self.start_time,
+            "last_deposit_time": self.last_deposit_time,
+            "is_active": self.is_active,
+            "milestone_50_claimed": self.milestone_50_claimed,
+            "milestone_100_claimed": self.milestone_100_claimed,
+            "savings_goal": self.savings_goal,
+            "progress_percent": self.progress_percent
+        }
@@ -0,0 +1,318 @@
+# nft_render.py
+# NFT tokenURI 渲染缓存 - 每个 token 只解析一次 tokenURI，元数据 JSON 和图片按内容哈希存盘
+
+import base64
+import hashlib
+import io
+import json
+import logging
+import os
+import re
+import threading
+import urllib.parse
+from typing import Dict, Optional, Tuple
+
+import requests
+
+from app.logger import get_logger, log_event
+
+try:
+    from PIL import Image  # 可选依赖：位图缩略图
+except ImportError:
+    Image = None
+
+logger = get_logger("nft_render")
+
+# 允许的缩略图边长
+THUMBNAIL_SIZES = (64, 128, 256, 512)
+
+_SVG_TAG_RE = re.compile(rb"<svg\b[^>]*>", re.IGNORECASE)
+_SVG_ATTR_RE = {
+    name: re.compile(rb'\s' + name + rb'\s*=\s*"[^"]*"', re.IGNORECASE)
+    for name in (b"width", b"height")
+}
+_SVG_NUMBER_RE = re.compile(rb'\s(width|height)\s*=\s*"([\d.]+)(px)?"', re.IGNORECASE)
+
+
+def decode_data_uri(uri: str) -> Tuple[bytes, str]:
+    """
+    解码 data URI
+
+    Returns:
+        (内容, MIME 类型)
+
+    Raises:
+        ValueError: 不是 data URI
+    """
+    if not uri.startswith("data:") or "," not in uri:
+        raise ValueError("不是 data URI")
+    header, payload = uri[5:].split(",", 1)
+    parts = header.split(";")
+    mime = parts[0] or "text/plain"
+    if "base64" in parts[1:]:
+        return base64.b64decode(payload), mime
+    return urllib.parse.unquote_to_bytes(payload), mime
+
+
+def _reject_duplicate_keys(pairs):
+    """json.loads 的 object_pairs_hook：重复键（如拼进目标名称里的第二个 "image"）直接视为非法"""
+    result = {}
+    for key, value in pairs:
+        if key in result:
+            raise ValueError(f"元数据中有重复的键: {key}")
+        result[key] = value
+    return result
+
+
+def resize_svg(data: bytes, size: int) -> bytes:
+    """改写 SVG 根节点的 width/height（矢量图无需重新栅格化），没有 viewBox 时按原尺寸补上"""
+    match = _SVG_TAG_RE.search(data)
+    if match is None:
+        return data
+    tag = match.group(0)
+
+    if b"viewbox" not in tag.lower():
+        dims = {m.group(1).lower(): m.group(2) for m in _SVG_NUMBER_RE.finditer(tag)}
+        if b"width" in dims and b"height" in dims:
+            tag = tag[:-1] + b' viewBox="0 0 ' + dims[b"width"] + b" " + dims[b"height"] + b'">'
+
+    for name, pattern in _SVG_ATTR_RE.items():
+        tag = pattern.sub(b"", tag)
+    tag = tag[:4] + b' width="%d" height="%d"' % (size, size) + tag[4:]
+    return data[:match.start()] + tag + data[match.end():]
+
+
+class NFTRenderCache:
+    """
+    NFT 渲染缓存（磁盘，多进程共享）
+
+    目录结构:
+        tokens/{token_id}.json   token -> {"metadata": 哈希, "image_uri": 图片地址,
+                                           "image": 哈希, "image_type": MIME}
+        blobs/{哈希前两位}/{哈希}   内容（元数据 JSON、原图、缩略图）
+    链上元数据和 IPFS 图片都不可变，因此所有文件写入后永不过期。
+    元数据先落盘，图片在第一次请求图片时才下载，IPFS 网关不可用不影响元数据接口。
+    图片只接受 data:image/* 和经配置网关的 ipfs://，不访问元数据里的任意 URL。
+    """
+
+    def __init__(self, root_dir: str, web3_service, ipfs_gateway: str = "https://ipfs.io/ipfs/",
+                 fetch_timeout: int = 15, max_image_bytes: int = 5 * 1024 * 1024):
+        """
+        Args:
+            root_dir: 缓存目录
+            web3_service: Web3Service 实例
+            ipfs_gateway: IPFS 网关前缀
+            fetch_timeout: 下载图片超时（秒）
+            max_image_bytes: 图片大小上限（字节）
+        """
+        self.root_dir = root_dir
+        self.web3_service = web3_service
+        self.ipfs_gateway = ipfs_gateway
+        self.fetch_timeout = fetch_timeout
+        self.max_image_bytes = max_image_bytes
+        self._locks: Dict[int, threading.Lock] = {}
+        self._locks_guard = threading.Lock()
+
+        os.makedirs(os.path.join(root_dir, "tokens"), exist_ok=True)
+        os.makedirs(os.path.join(root_dir, "blobs"), exist_ok=True)
+
+    # --- 文件存储 ---
+
+    def _blob_path(self, digest: str) -> str:
+        return os.path.join(self.root_dir, "blobs", digest[:2], digest)
+
+    def _index_path(self, token_id: int) -> str:
+        return os.path.join(self.root_dir, "tokens", f"{token_id}.json")
+
+    @staticmethod
+    def _atomic_write(path: str, data: bytes):
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+
+    def _put_blob(self, data: bytes, key: Optional[str] = None) -> str:
+        """写入内容，返回键（默认为内容 sha256）"""
+        digest = key or hashlib.sha256(data).hexdigest()
+        path = self._blob_path(digest)
+        if not os.path.exists(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            self._atomic_write(path, data)
+        return digest
+
+    def _get_blob(self, digest: str) -> Optional[bytes]:
+        try:
+            with open(self._blob_path(digest), "rb") as f:
+                return f.read()
+        except FileNotFoundError:
+            return None
+
+    def _token_lock(self, token_id: int) -> threading.Lock:
+        with self._locks_guard:
+            return self._locks.setdefault(token_id, threading.Lock())
+
+    # --- 解析 ---
+
+    def _fetch_image(self, uri: str) -> Tuple[bytes, str]:
+        """
+        获取图片内容（data URI 直接解码，ipfs:// 经配置的网关下载，不跟随重定向）
+
+        Raises:
+            ValueError: 不支持的图片地址、非图片内容或超过大小上限
+            requests.RequestException: 网关请求失败
+        """
+        if uri.startswith("data:"):
+            data, mime = decode_data_uri(uri)
+        elif uri.startswith("ipfs://"):
+            path = uri[len("ipfs://"):]
+            if path.startswith("ipfs/"):
+                path = path[len("ipfs/"):]
+            if any(segment in ("", ".", "..") for segment in path.split("/")):
+                raise ValueError(f"不合法的 IPFS 路径: {path[:64]}")
+            url = self.ipfs_gateway + urllib.parse.quote(path, safe="/")
+            with requests.get(url, timeout=self.fetch_timeout, stream=True, allow_redirects=False) as response:
+                if response.is_redirect:
+                    raise ValueError(f"IPFS 网关返回重定向: {response.status_code}")
+                response.raise_for_status()
+                data = response.raw.read(self.max_image_bytes + 1, decode_content=True)
+                mime = response.headers.get("Content-Type", "").split(";")[0].strip()
+        else:
+            raise ValueError(f"不支持的图片地址: {uri[:64]}")
+
+        mime = mime.lower()
+        if not mime.startswith("image/"):
+            raise ValueError(f"不是图片内容: {mime or '未知类型'}")
+        if len(data) > self.max_image_bytes:
+            raise ValueError("图片超过大小上限")
+        return data, mime
+
+    def resolve(self, token_id: int) -> Dict[str, Optional[str]]:
+        """
+        获取 token 的缓存索引，没有则调用一次 tokenURI 并写入缓存
+
+        Returns:
+            Dict: {"metadata": 哈希, "image_uri": 图片地址或 None,
+                   "image": 哈希或 None（尚未下载）, "image_type": MIME 或 None}
+
+        Raises:
+            TokenNotFoundError: token 不存在
+            ContractCallError: 合约调用失败
+            ValueError: tokenURI 内容无法解析
+        """
+        index_path = self._index_path(token_id)
+        if os.path.exists(index_path):
+            with open(index_path, "r") as f:
+                return json.load(f)
+
+        with self._token_lock(token_id):
+            if os.path.exists(index_path):
+                with open(index_path, "r") as f:
+                    return json.load(f)
+
+            token_uri = self.web3_service.get_token_uri(token_id)
+            raw, _mime = decode_data_uri(token_uri)
+            metadata = json.loads(raw, object_pairs_hook=_reject_duplicate_keys)
+            if not isinstance(metadata, dict):
+                raise ValueError("元数据不是 JSON 对象")
+            image_uri = metadata.get("image")
+            if image_uri is not None and not isinstance(image_uri, str):
+                raise ValueError("image 字段不是字符串")
+
+            index = {"metadata": self._put_blob(raw), "image_uri": image_uri or None,
+                     "image": None, "image_type": None}
+            self._atomic_write(index_path, json.dumps(index).encode("utf-8"))
+            log_event(logger, logging.INFO, "nft_rendered", token_id=token_id)
+            return index
+
+    def _resolve_image(self, token_id: int) -> Dict[str, Optional[str]]:
+        """
+        确保图片已下载并写入索引（每个 token 只下载一次）
+
+        Raises:
+            同 resolve 和 _fetch_image
+        """
+        index = self.resolve(token_id)
+        if index["image"] is not None or not index.get("image_uri"):
+            return index
+
+        with self._token_lock(token_id):
+            index = self.resolve(token_id)
+            if index["image"] is not None:
+                return index
+            image, image_type = self._fetch_image(index["image_uri"])
+            index = dict(index, image=self._put_blob(image), image_type=image_type)
+            self._atomic_write(self._index_path(token_id), json.dumps(index).encode("utf-8"))
+            log_event(logger, logging.INFO, "nft_image_fetched", token_id=token_id, image_type=image_type)
+            return index
+
+    # --- 读取 ---
+
+    def _resolve_blob(self, token_id: int, field: str) -> Tuple[Dict[str, Optional[str]], Optional[bytes]]:
+        """
+        读取索引中 field 指向的内容；索引还在但内容文件已被清理时，删掉索引重新解析一次
+
+        Returns:
+            (索引, 内容；field 为空时内容为 None)
+
+        Raises:
+            同 resolve；重新解析后仍读不到内容时抛出 OSError
+        """
+        index = self._resolve_image(token_id) if field == "image" else self.resolve(token_id)
+        if index[field] is None:
+            return index, None
+        data = self._get_blob(index[field])
+        if data is not None:
+            return index, data
+
+        log_event(logger, logging.WARNING, "nft_blob_missing", token_id=token_id, field=field)
+        with self._token_lock(token_id):
+            try:
+                os.remove(self._index_path(token_id))
+            except FileNotFoundError:
+                pass
+        index = self._resolve_image(token_id) if field == "image" else self.resolve(token_id)
+        data = self._get_blob(index[field]) if index[field] is not None else None
+        if index[field] is not None and data is None:
+            raise OSError(f"NFT 缓存内容丢失: {index[field]}")
+        return index, data
+
+    def get_metadata(self, token_id: int) -> Tuple[bytes, str]:
+        """
+        Returns:
+            (元数据 JSON, ETag 用的内容哈希)
+        """
+        index, data = self._resolve_blob(token_id, "metadata")
+        return data, index["metadata"]
+
+    def get_image(self, token_id: int, size: Optional[int] = None) -> Optional[Tuple[bytes, str, str]]:
+        """
+        获取图片（可选缩略图）
+
+        Returns:
+            (图片内容, MIME, ETag) ；token 没有图片时返回 None
+        """
+        index = self._resolve_image(token_id)
+        digest, image_type = index["image"], index["image_type"]
+        if digest is None or not (image_type or "").startswith("image/"):
+            return None
+
+        if size is None or (image_type != "image/svg+xml" and Image is None):
+            # 未安装 Pillow 时位图直接返回原图
+            index, original = self._resolve_blob(token_id, "image")
+            return original, index["image_type"], index["image"]
+
+        thumb_key = f"{digest}-{size}"
+        thumb_type = image_type if image_type == "image/svg+xml" else "image/png"
+        data = self._get_blob(thumb_key)
+        if data is None:
+            _index, original = self._resolve_blob(token_id, "image")
+            if image_type == "image/svg+xml":
+                data = resize_svg(original, size)
+            else:
+                image = Image.open(io.BytesIO(original))
+                image.thumbnail((size, size))
+                buffer = io.BytesIO()
+                image.save(buffer, format="PNG", optimize=True)
+                data = buffer.getvalue()
+            self._put_blob(data, key=thumb_key)
+        return data, thumb_type, thumb_key
@@ -0,0 +1,357 @@
+# profiling.py
+# 按需请求剖析 - Web3 / LLM 调用的 span 计时 + 栈采样，
+# 结果写入 Server-Timing 响应头和滚动的 profile 目录
+
+import asyncio
+import functools
+import hmac
+import json
+import logging
+import os
+import sys
+import threading
+import time
+from collections import Counter
+from contextvars import ContextVar
+from typing import Any, Dict, List, Optional
+
+from app.logger import get_logger, get_request_id, is_valid_request_id, log_event, new_request_id
+
+logger = get_logger("profiling")
+
+PROFILE_HEADER = "x-profile-token"
+
+# 采样栈按文件路径归类，从栈顶往下第一个命中的类别生效
+SAMPLE_CATEGORIES = (
+    ("pydantic", ("/pydantic/", "/pydantic_core/")),
+    ("llm", ("/openai/", "/httpx/", "/ai_module/")),
+    ("rpc", ("/web3/", "/eth_abi/", "/urllib3/", "/requests/")),
+    ("serialization", ("/json/", "/app/serialization.py")),
+)
+
+# 单个请求最多保留的采样数（按 5ms 间隔约 50 秒）
+MAX_SAMPLES = 10000
+
+# 采样栈的最大深度
+MAX_STACK_DEPTH = 64
+
+_profile_var: ContextVar[Optional["RequestProfile"]] = ContextVar("request_profile", default=None)
+_depth_var: ContextVar[int] = ContextVar("profile_depth", default=0)
+
+
+class _NoopSpan:
+    """未开启剖析时的 span（共享单例，进入 / 退出均为空操作）"""
+
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+_NOOP_SPAN = _NoopSpan()
+
+
+class _Span:
+    __slots__ = ("profile", "name", "attrs", "start", "depth", "thread_id", "_token")
+
+    def __init__(self, profile: "RequestProfile", name: str, attrs: Dict[str, Any]):
+        self.profile = profile
+        self.name = name
+        self.attrs = attrs
+
+    def __enter__(self):
+        self.depth = _depth_var.get()
+        self._token = _depth_var.set(self.depth + 1)
+        self.thread_id = threading.get_ident()
+        self.profile.enter_thread(self.thread_id)
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        end = time.perf_counter()
+        _depth_var.reset(self._token)
+        self.profile.exit_thread(self.thread_id)
+        if exc_type is not None:
+            self.attrs["error"] = exc_type.__name__
+        self.profile.add_span(self.name, self.start, end, self.depth, self.attrs)
+        return False
+
+
+def span(name: str, **attrs):
+    """
+    计时一段代码（当前请求未开启剖析时几乎无开销）
+
+    用法:
+        with span("web3.rpc", method="getUserNFTs"):
+            ...
+    """
+    profile = _profile_var.get()
+    if profile is None:
+        return _NOOP_SPAN
+    return _Span(profile, name, attrs)
+
+
+def profiled(prefix: str):
+    """
+    装饰器：把函数调用记为名为 "{prefix}.{函数名}" 的 span
+
+    Args:
+        prefix: span 名前缀，例如 "web3"、"agent"
+    """
+    def decorator(func):
+        name = f"{prefix}.{func.__name__}"
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            profile = _profile_var.get()
+            if profile is None:
+                return func(*args, **kwargs)
+            with _Span(profile, name, {}):
+                return func(*args, **kwargs)
+
+        return wrapper
+
+    return decorator
+
+
+class _StackSampler(threading.Thread):
+    """定时读取请求相关线程的 Python 栈，统计折叠栈（flamegraph 格式）"""
+
+    def __init__(self, profile: "RequestProfile", interval: float):
+        super().__init__(name="request-profiler", daemon=True)
+        self.profile = profile
+        self.interval = interval
+        self.stacks: Counter = Counter()
+        self.samples = 0
+        self._stop_event = threading.Event()
+
+    @staticmethod
+    def _collapse(frame) -> str:
+        names = []
+        while frame is not None and len(names) < MAX_STACK_DEPTH:
+            code = frame.f_code
+            names.append(f"{code.co_filename}:{code.co_name}")
+            frame = frame.f_back
+        return ";".join(reversed(names))
+
+    def run(self):
+        while not self._stop_event.wait(self.interval):
+            if self.samples >= MAX_SAMPLES:
+                break
+            frames = sys._current_frames()
+            for thread_id in self.profile.sampled_threads():
+                frame = frames.get(thread_id)
+                if frame is not None:
+                    self.stacks[self._collapse(frame)] += 1
+                    self.samples += 1
+
+    def stop(self):
+        self._stop_event.set()
+        self.join()
+
+
+def _categorize(stack: str) -> str:
+    for frame in reversed(stack.split(";")):
+        for category, markers in SAMPLE_CATEGORIES:
+            if any(marker in frame for marker in markers):
+                return category
+    return "other"
+
+
+class RequestProfile:
+    """
+    单个请求的剖析结果
+
+    - span：Web3Service 方法、RPC 调用、重试等待、LLM 调用等的起止时间和嵌套深度
+    - 采样（可选）：请求所在的事件循环线程，以及 span 执行期间的线程池线程；
+      事件循环线程上并发请求的栈也会被采到，仅适合低并发下排查单个慢请求
+    """
+
+    def __init__(self, method: str, path: str, sample_interval: float = 0.0):
+        """
+        Args:
+            method: HTTP 方法
+            path: 请求路径
+            sample_interval: 采样间隔（秒），0 表示不采样
+        """
+        self.method = method
+        self.path = path
+        self.request_id = get_request_id()
+        # 请求 ID 可能来自客户端的 X-Request-ID，只有十六进制 / UUID 形式才用作文件名，否则另生成
+        self.profile_id = self.request_id if is_valid_request_id(self.request_id) else new_request_id()
+        self.wall_start = time.time()
+        self.start = time.perf_counter()
+        self.total: Optional[float] = None
+        self.spans: List[tuple] = []
+        self._loop_thread = threading.get_ident()
+        self._active: Dict[int, int] = {}
+        self._lock = threading.Lock()
+        self._sampler = _StackSampler(self, sample_interval) if sample_interval > 0 else None
+
+    def enter_thread(self, thread_id: int):
+        with self._lock:
+            self._active[thread_id] = self._active.get(thread_id, 0) + 1
+
+    def exit_thread(self, thread_id: int):
+        with self._lock:
+            count = self._active.get(thread_id, 0) - 1
+            if count > 0:
+                self._active[thread_id] = count
+            else:
+                self._active.pop(thread_id, None)
+
+    def sampled_threads(self) -> List[int]:
+        with self._lock:
+            return [self._loop_thread, *(t for t in self._active if t != self._loop_thread)]
+
+    def add_span(self, name: str, start: float, end: float, depth: int, attrs: Dict[str, Any]):
+        with self._lock:
+            self.spans.append((name, start - self.start, end - start, depth, attrs))
+
+    def begin(self):
+        if self._sampler is not None:
+            self._sampler.start()
+
+    def finish(self):
+        """结束计时并停止采样（可重复调用）"""
+        if self.total is not None:
+            return
+        self.total = time.perf_counter() - self.start
+        if self._sampler is not None:
+            self._sampler.stop()
+
+    def breakdown(self) -> Dict[str, Dict[str, float]]:
+        """按 span 名汇总: {名称: {"count", "ms"}}"""
+        result: Dict[str, Dict[str, float]] = {}
+        with self._lock:
+            for name, _offset, duration, _depth, _attrs in self.spans:
+                entry = result.setdefault(name, {"count": 0, "ms": 0.0})
+                entry["count"] += 1
+                entry["ms"] += duration * 1000
+        for entry in result.values():
+            entry["ms"] = round(entry["ms"], 2)
+        return result
+
+    def server_timing(self) -> str:
+        """Server-Timing 头（浏览器开发者工具可直接展示）"""
+        parts = [f'{name};dur={entry["ms"]};desc="x{entry["count"]}"'
+                 for name, entry in self.breakdown().items()]
+        parts.append(f"total;dur={round((self.total or 0) * 1000, 2)}")
+        return ", ".join(parts)
+
+    def to_dict(self) -> Dict[str, Any]:
+        result = {
+            "request_id": self.request_id,
+            "profile_id": self.profile_id,
+            "method": self.method,
+            "path": self.path,
+            "timestamp": self.wall_start,
+            "total_ms": round((self.total or 0) * 1000, 2),
+            "breakdown": self.breakdown(),
+            "spans": [
+                {"name": name, "offset_ms": round(offset * 1000, 2), "duration_ms": round(duration * 1000, 2),
+                 "depth": depth, **attrs}
+                for name, offset, duration, depth, attrs in sorted(self.spans, key=lambda s: s[1])
+            ],
+        }
+        if self._sampler is not None:
+            stacks = self._sampler.stacks
+            categories: Counter = Counter()
+            for stack, count in stacks.items():
+                categories[_categorize(stack)] += count
+            result["samples"] = {
+                "interval_ms": self._sampler.interval * 1000,
+                "count": self._sampler.samples,
+                "categories": dict(categories),
+                "stacks": dict(stacks.most_common(200)),
+            }
+        return result
+
+
+def write_profile(profile: RequestProfile, profile_dir: str, max_files: int):
+    """写入 profile 文件，并删除超出 max_files 的最旧文件"""
+    os.makedirs(profile_dir, exist_ok=True)
+    filename = f"{int(profile.wall_start * 1000)}-{profile.profile_id}.json"
+    path = os.path.join(profile_dir, filename)
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(profile.to_dict(), f, separators=(",", ":"), default=str)
+    os.replace(tmp_path, path)
+
+    files = sorted(name for name in os.listdir(profile_dir) if name.endswith(".json"))
+    for name in files[:-max_files] if max_files > 0 else []:
+        try:
+            os.remove(os.path.join(profile_dir, name))
+        except OSError:
+            pass
+
+
+class ProfilingMiddleware:
+    """
+    ASGI 中间件：对带特权头（X-Profile-Token）或全局开启时的请求进行剖析
+
+    剖析的请求在响应头中返回 Server-Timing 和 X-Profile-Id，完整结果写入 profile_dir。
+    未配置令牌且未全局开启时不应挂载本中间件。
+    """
+
+    def __init__(self, app, token: str = "", profile_all: bool = False, sample_interval_ms: float = 5.0,
+                 profile_dir: Optional[str] = None, max_files: int = 200):
+        """
+        Args:
+            app: 下游 ASGI 应用
+            token: 特权头的值（空字符串表示不接受按请求开启）
+            profile_all: 是否剖析所有请求
+            sample_interval_ms: 栈采样间隔（毫秒），0 表示只记录 span
+            profile_dir: profile 文件目录（None 表示不落盘，只返回响应头）
+            max_files: 目录中最多保留的文件数
+        """
+        self.app = app
+        self.token = token.encode("utf-8")
+        self.profile_all = profile_all
+        self.sample_interval = sample_interval_ms / 1000
+        self.profile_dir = profile_dir
+        self.max_files = max_files
+
+    def _requested(self, scope) -> bool:
+        if self.profile_all:
+            return True
+        if not self.token:
+            return False
+        for name, value in scope.get("headers", ()):
+            if name == PROFILE_HEADER.encode("latin-1"):
+                return hmac.compare_digest(value, self.token)
+        return False
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not self._requested(scope):
+            return await self.app(scope, receive, send)
+
+        profile = RequestProfile(scope["method"], scope["path"], self.sample_interval)
+        context_token = _profile_var.set(profile)
+
+        async def send_with_timing(message):
+            if message["type"] == "http.response.start":
+                # 响应头发出前路由已执行完，此时结束计时
+                profile.finish()
+                headers = list(message.get("headers", []))
+                headers.append((b"server-timing", profile.server_timing().encode("latin-1")))
+                headers.append((b"x-profile-id", profile.profile_id.encode("ascii")))
+                message = {**message, "headers": headers}
+            await send(message)
+
+        profile.begin()
+        try:
+            await self.app(scope, receive, send_with_timing)
+        finally:
+            _profile_var.reset(context_token)
+            profile.finish()
+            log_event(logger, logging.INFO, "request_profiled", path=profile.path,
+                      total_ms=round(profile.total * 1000, 2))
+            if self.profile_dir:
+                try:
+                    await asyncio.to_thread(write_profile, profile, self.profile_dir, self.max_files)
+                except OSError as e:
+                    log_event(logger, logging.WARNING, "profile_write_failed", error=str(e))
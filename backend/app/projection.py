@@ -0,0 +1,202 @@
+# projection.py
+# 储蓄计划预测 - 用 NumPy 对单个计划或整批计划一次性向量化计算完成时间、里程碑和情景模拟
+
+import time
+from decimal import Decimal, InvalidOperation
+from typing import Dict, List, Optional
+
+import numpy as np
+
+# 各风险策略下每期漏存的概率（蒙特卡洛情景模拟用）
+MISS_PROBABILITY = {
+    "conservative": 0.05,
+    "aggressive": 0.15,
+}
+DEFAULT_MISS_PROBABILITY = 0.10
+
+# 单次模拟矩阵的最大元素数（计划数 × 模拟次数），超过则分块计算以控制内存
+MAX_SIMULATION_CELLS = 2_000_000
+
+# 剩余期数上限（周存约 1900 年）；超过视为输入异常，也避免负二项分布参数溢出
+MAX_CYCLES = 100_000
+
+STATUS_COMPLETED = "completed"
+STATUS_NOT_STARTED = "not_started"
+STATUS_ON_TRACK = "on_track"
+STATUS_BEHIND = "behind"
+
+
+def parse_amount(value: str) -> int:
+    """
+    解析 Wei 金额字符串（允许 "1e18" 这类写法，小数部分截断）
+
+    Raises:
+        ValueError: 非数字、非有限值或负数
+    """
+    try:
+        amount = Decimal(value)
+    except InvalidOperation:
+        raise ValueError(f"无效的金额: {value!r}")
+    if not amount.is_finite() or amount < 0:
+        raise ValueError(f"金额必须是非负有限数: {value!r}")
+    return int(amount)
+
+
+def _exact(values) -> np.ndarray:
+    """Wei 金额转为 object 数组：元素保持 Python 整数，逐元素运算在 NumPy 内完成且不丢精度"""
+    array = np.empty(len(values), dtype=object)
+    array[:] = [int(v) for v in values]
+    return array
+
+
+def _eta(needed: np.ndarray, amount_per_cycle: np.ndarray, next_due: np.ndarray,
+         frequency: np.ndarray, now: float) -> np.ndarray:
+    """
+    按每期固定金额，计算还需 needed 金额时的达成时间戳
+
+    已达成（needed <= 0）的返回 now
+    """
+    cycles = np.ceil(np.maximum(needed, 0) / amount_per_cycle)
+    eta = next_due + np.maximum(cycles - 1, 0) * frequency
+    return np.where(cycles > 0, eta, now)
+
+
+def project_plans(target_amount: np.ndarray, current_amount: np.ndarray, amount_per_cycle: np.ndarray,
+                  cycle_frequency: np.ndarray, start_time: np.ndarray, last_deposit_time: np.ndarray,
+                  risk_strategy: List[str], now: Optional[float] = None, simulations: int = 1000,
+                  seed: Optional[int] = None) -> Dict[str, np.ndarray]:
+    """
+    向量化计算一批计划的预测结果（所有输入为等长序列，金额单位 Wei）
+
+    时间相关的计算用 float64 数组；金额相关的计算（剩余期数、应存金额、是否落后）用 object 数组，
+    同样是整批数组运算，但元素为 Python 整数，超过 int64 / float64 精度的 Wei 金额也精确。
+
+    Args:
+        target_amount: 目标金额（整数）
+        current_amount: 当前金额（整数）
+        amount_per_cycle: 每期金额（整数，必须 > 0）
+        cycle_frequency: 周期（秒，必须 > 0）
+        start_time: 开始时间戳
+        last_deposit_time: 最后存款时间戳（0 表示还没存过）
+        risk_strategy: 风险策略
+        now: 当前时间戳（默认系统时间）
+        simulations: 蒙特卡洛模拟次数（0 表示不模拟）
+        seed: 随机种子
+
+    Returns:
+        Dict[str, np.ndarray]: 各字段的结果数组
+
+    Raises:
+        ValueError: 有计划的剩余期数超过 MAX_CYCLES
+    """
+    now = float(time.time() if now is None else now)
+    target_exact = _exact(target_amount)
+    current_exact = _exact(current_amount)
+    per_cycle_exact = _exact(amount_per_cycle)
+
+    target = np.asarray(target_amount, dtype=np.float64)
+    current = np.asarray(current_amount, dtype=np.float64)
+    per_cycle = np.asarray(amount_per_cycle, dtype=np.float64)
+    frequency = np.asarray(cycle_frequency, dtype=np.float64)
+    start = np.asarray(start_time, dtype=np.float64)
+    last_deposit = np.asarray(last_deposit_time, dtype=np.float64)
+
+    # 下一次应存款时间：存过则为上次存款 + 周期，否则为开始时间；不早于现在
+    next_due = np.where(last_deposit > 0, last_deposit + frequency, start)
+    next_due = np.maximum(next_due, now)
+
+    remaining = np.maximum(target - current, 0)
+    # 剩余期数 = ceil(剩余金额 / 每期金额)，整数运算
+    cycles_exact = -(-np.maximum(target_exact - current_exact, 0) // per_cycle_exact)
+    if len(cycles_exact) and cycles_exact.max() > MAX_CYCLES:
+        raise ValueError(f"剩余期数超过上限 {MAX_CYCLES}，请检查目标金额和每期金额")
+    cycles_remaining = cycles_exact.astype(np.float64)
+
+    completion = _eta(remaining, per_cycle, next_due, frequency, now)
+    milestone_50 = _eta(0.5 * target - current, per_cycle, next_due, frequency, now)
+
+    # 按计划到现在应存金额：只计已经过完的周期，刚开始、还没存第一笔的计划不算落后
+    elapsed_cycles = np.where(now >= start, np.floor((now - start) / frequency), 0).astype(np.int64)
+    expected_now = np.minimum(target_exact, elapsed_cycles.astype(object) * per_cycle_exact)
+    on_track = (current_exact >= expected_now).astype(bool)
+
+    status = np.where(
+        cycles_remaining <= 0, STATUS_COMPLETED,
+        np.where(now < start, STATUS_NOT_STARTED,
+                 np.where(on_track, STATUS_ON_TRACK, STATUS_BEHIND))
+    )
+
+    result = {
+        "status": status,
+        "cycles_remaining": cycles_remaining,
+        "completion_timestamp": completion,
+        "milestone_50_timestamp": milestone_50,
+        "milestone_100_timestamp": completion,
+        "expected_amount_now": expected_now,
+    }
+
+    if simulations > 0:
+        miss_p = np.array([MISS_PROBABILITY.get(s, DEFAULT_MISS_PROBABILITY) for s in risk_strategy])
+        result.update(_simulate(cycles_remaining, miss_p, next_due, frequency, now, simulations, seed))
+
+    return result
+
+
+def _simulate(cycles_remaining: np.ndarray, miss_p: np.ndarray, next_due: np.ndarray,
+              frequency: np.ndarray, now: float, simulations: int, seed: Optional[int]) -> Dict[str, np.ndarray]:
+    """
+    漏存情景模拟：每期以 miss_p 概率漏存，完成需要的总期数 = 剩余期数 + 负二项分布的漏存次数
+    """
+    rng = np.random.default_rng(seed)
+    count = len(cycles_remaining)
+    p50 = np.empty(count)
+    p90 = np.empty(count)
+    mean_missed = np.empty(count)
+
+    chunk = max(1, MAX_SIMULATION_CELLS // simulations)
+    for lo in range(0, count, chunk):
+        hi = min(lo + chunk, count)
+        n = cycles_remaining[lo:hi, None]
+        # negative_binomial 要求 n > 0，已完成的计划单独置 0
+        missed = rng.negative_binomial(np.maximum(n, 1), 1 - miss_p[lo:hi, None],
+                                       size=(hi - lo, simulations))
+        missed = np.where(n > 0, missed, 0)
+        total_cycles = n + missed
+        finish = next_due[lo:hi, None] + np.maximum(total_cycles - 1, 0) * frequency[lo:hi, None]
+        finish = np.where(n > 0, finish, now)
+
+        p50[lo:hi], p90[lo:hi] = np.percentile(finish, [50, 90], axis=1)
+        mean_missed[lo:hi] = missed.mean(axis=1)
+
+    return {
+        "miss_probability": miss_p,
+        "p50_completion_timestamp": p50,
+        "p90_completion_timestamp": p90,
+        "expected_missed_deposits": mean_missed,
+    }
+
+
+def to_response(result: Dict[str, np.ndarray]) -> List[dict]:
+    """把向量化结果转换为每个计划一个 dict（时间戳取整，金额转字符串）"""
+    count = len(result["status"])
+    simulated = "p50_completion_timestamp" in result
+    items = []
+    for i in range(count):
+        item = {
+            "status": str(result["status"][i]),
+            "cycles_remaining": int(result["cycles_remaining"][i]),
+            "completion_timestamp": int(result["completion_timestamp"][i]),
+            "milestone_50_timestamp": int(result["milestone_50_timestamp"][i]),
+            "milestone_100_timestamp": int(result["milestone_100_timestamp"][i]),
+            "expected_amount_now": str(result["expected_amount_now"][i]),
+            "scenarios": None,
+        }
+        if simulated:
+            item["scenarios"] = {
+                "miss_probability": float(result["miss_probability"][i]),
+                "p50_completion_timestamp": int(result["p50_completion_timestamp"][i]),
+                "p90_completion_timestamp": int(result["p90_completion_timestamp"][i]),
+                "expected_missed_deposits": round(float(result["expected_missed_deposits"][i]), 2),
+            }
+        items.append(item)
+    return items
@@ -0,0 +1,256 @@
+# rate_limit.py
+# 准入控制 - 按钱包 / IP 令牌桶限流 + 按路由类别的并发上限、排队超时和过载丢弃
+
+import asyncio
+import json
+import logging
+import math
+import re
+import time
+from dataclasses import dataclass
+from typing import Dict, Optional, Tuple
+
+from app.logger import get_logger, log_event
+
+logger = get_logger("admission")
+
+_ADDRESS_RE = re.compile(r"0x[a-fA-F0-9]{40}")
+
+
+@dataclass
+class RouteLimits:
+    """一类路由的准入参数"""
+    prefixes: Tuple[str, ...]       # 匹配的路径前缀
+    wallet_per_min: float           # 每个钱包每分钟请求数
+    ip_per_min: float               # 每个 IP 每分钟请求数
+    concurrency: int                # 同时处理的请求上限
+    queue_timeout: float            # 排队等待上限（秒），即延迟目标
+    wallet_from_body: bool = False  # 是否从 JSON body 的 wallet_address 读取钱包地址
+
+
+class TokenBucket:
+    """令牌桶：容量 capacity，每秒补充 rate 个"""
+
+    __slots__ = ("rate", "capacity", "tokens", "updated")
+
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+
+    def take(self, now: float) -> float:
+        """
+        取一个令牌
+
+        Returns:
+            float: 0 表示成功；否则为需要等待的秒数
+        """
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return 0.0
+        return (1 - self.tokens) / self.rate
+
+
+class RouteAdmission:
+    """单个路由类别的并发控制状态"""
+
+    def __init__(self, limits: RouteLimits):
+        self.limits = limits
+        self.semaphore = asyncio.Semaphore(limits.concurrency)
+        self.waiting = 0
+        # 服务耗时的指数移动平均（秒），用于估算排队时间
+        self.avg_service_time = 0.0
+
+    def estimated_wait(self) -> float:
+        """按当前排队人数估算新请求需要等待的时间"""
+        if not self.semaphore.locked():
+            return 0.0
+        return (self.waiting + 1) * self.avg_service_time / self.limits.concurrency
+
+    def record(self, elapsed: float):
+        if self.avg_service_time == 0.0:
+            self.avg_service_time = elapsed
+        else:
+            self.avg_service_time = 0.8 * self.avg_service_time + 0.2 * elapsed
+
+
+class AdmissionControlMiddleware:
+    """
+    ASGI 准入控制中间件
+
+    - 令牌桶：同一路由类别下每个钱包、每个 IP 各一个桶，桶空返回 429 + Retry-After
+    - 并发上限：每个路由类别一个信号量，超出的请求排队
+    - 过载丢弃：预计排队时间超过 queue_timeout，或排队等待超时，直接返回 429
+    状态保存在进程内，多 worker 部署时每个 worker 各自限流。
+    """
+
+    # 每处理多少个请求清理一次空闲的令牌桶
+    PRUNE_EVERY = 1000
+    BUCKET_IDLE_SECONDS = 600
+
+    def __init__(self, app, route_limits: Dict[str, RouteLimits]):
+        self.app = app
+        self.route_limits = route_limits
+        self._routes: Dict[str, RouteAdmission] = {}
+        self._buckets: Dict[Tuple[str, str, str], TokenBucket] = {}
+        self._requests = 0
+
+    def _match(self, path: str) -> Optional[str]:
+        for name, limits in self.route_limits.items():
+            if path.startswith(limits.prefixes):
+                return name
+        return None
+
+    def _route(self, name: str) -> RouteAdmission:
+        # 信号量需要在事件循环内创建，这里延迟初始化
+        route = self._routes.get(name)
+        if route is None:
+            route = self._routes[name] = RouteAdmission(self.route_limits[name])
+        return route
+
+    def _take(self, route_name: str, kind: str, key: str, per_min: float, now: float) -> float:
+        bucket_key = (route_name, kind, key)
+        bucket = self._buckets.get(bucket_key)
+        if bucket is None:
+            rate = per_min / 60.0
+            # 允许约 10 秒的突发量
+            bucket = self._buckets[bucket_key] = TokenBucket(rate, max(1.0, rate * 10))
+        return bucket.take(now)
+
+    def _prune(self, now: float):
+        idle = [k for k, b in self._buckets.items() if now - b.updated > self.BUCKET_IDLE_SECONDS]
+        for k in idle:
+            del self._buckets[k]
+
+    async def _read_body(self, receive) -> bytes:
+        chunks = []
+        while True:
+            message = await receive()
+            if message["type"] != "http.request":
+                break
+            chunks.append(message.get("body", b""))
+            if not message.get("more_body", False):
+                break
+        return b"".join(chunks)
+
+    @staticmethod
+    def _wallet_from_body(body: bytes) -> Optional[str]:
+        try:
+            data = json.loads(body)
+        except ValueError:
+            return None
+        wallet = data.get("wallet_address") if isinstance(data, dict) else None
+        if isinstance(wallet, str) and _ADDRESS_RE.fullmatch(wallet):
+            return wallet.lower()
+        return None
+
+    async def _reject(self, send, retry_after: float, reason: str):
+        body = json.dumps({"detail": "请求过于频繁，请稍后再试", "reason": reason}, ensure_ascii=False).encode("utf-8")
+        await send({
+            "type": "http.response.start",
+            "status": 429,
+            "headers": [
+                (b"content-type", b"application/json"),
+                (b"content-length", str(len(body)).encode()),
+                (b"retry-after", str(max(1, math.ceil(retry_after))).encode()),
+            ],
+        })
+        await send({"type": "http.response.body", "body": body})
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["method"] == "OPTIONS":
+            return await self.app(scope, receive, send)
+
+        route_name = self._match(scope["path"])
+        if route_name is None:
+            return await self.app(scope, receive, send)
+
+        limits = self.route_limits[route_name]
+        now = time.monotonic()
+
+        self._requests += 1
+        if self._requests % self.PRUNE_EVERY == 0:
+            self._prune(now)
+
+        # 1. 钱包地址：路径中的地址，或 JSON body 中的 wallet_address
+        wallet = None
+        match = _ADDRESS_RE.search(scope["path"])
+        if match:
+            wallet = match.group(0).lower()
+        elif limits.wallet_from_body and scope["method"] == "POST":
+            body = await self._read_body(receive)
+            wallet = self._wallet_from_body(body)
+            replayed = False
+
+            async def replay_receive():
+                nonlocal replayed
+                if not replayed:
+                    replayed = True
+                    return {"type": "http.request", "body": body, "more_body": False}
+                return await receive()
+
+            receive = replay_receive
+
+        # 2. 令牌桶限流
+        client = scope.get("client")
+        ip = client[0] if client else "unknown"
+        wait = self._take(route_name, "ip", ip, limits.ip_per_min, now)
+        if wait == 0.0 and wallet is not None:
+            wait = self._take(route_name, "wallet", wallet, limits.wallet_per_min, now)
+        if wait > 0:
+            log_event(logger, logging.INFO, "rate_limited", route=route_name, ip=ip, wallet_address=wallet)
+            return await self._reject(send, wait, "rate_limit")
+
+        # 3. 并发上限 + 过载丢弃
+        route = self._route(route_name)
+        estimated = route.estimated_wait()
+        if estimated > limits.queue_timeout:
+            log_event(logger, logging.WARNING, "load_shed", route=route_name,
+                      waiting=route.waiting, estimated_wait=round(estimated, 3))
+            return await self._reject(send, estimated, "overloaded")
+
+        route.waiting += 1
+        try:
+            await asyncio.wait_for(route.semaphore.acquire(), timeout=limits.queue_timeout)
+        except asyncio.TimeoutError:
+            log_event(logger, logging.WARNING, "queue_timeout", route=route_name, waiting=route.waiting)
+            return await self._reject(send, limits.queue_timeout, "queue_timeout")
+        finally:
+            route.waiting -= 1
+
+        started = time.monotonic()
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            route.semaphore.release()
+            route.record(time.monotonic() - started)
+
+
+def default_route_limits(settings) -> Dict[str, RouteLimits]:
+    """
+    根据 Settings 构造默认的路由类别（LLM 路由 / RPC 路由，后者也包括 CPU 密集的批量预测）
+
+    被限流的路由都把阻塞的 LLM / RPC 调用和计算放到线程池执行，
+    事件循环可以同时接收多个请求，并发上限、排队超时和过载丢弃才会生效
+    """
+    return {
+        "llm": RouteLimits(
+            prefixes=("/api/ai/chat", "/api/ai/greeting"),
+            wallet_per_min=settings.RATE_LIMIT_LLM_WALLET_PER_MIN,
+            ip_per_min=settings.RATE_LIMIT_LLM_IP_PER_MIN,
+            concurrency=settings.RATE_LIMIT_LLM_CONCURRENCY,
+            queue_timeout=settings.RATE_LIMIT_LLM_QUEUE_TIMEOUT,
+            wallet_from_body=True,
+        ),
+        "rpc": RouteLimits(
+            prefixes=("/api/user-nfts/", "/api/plan-progress/", "/api/plan-projection/", "/api/nft/",
+                      "/api/projections"),
+            wallet_per_min=settings.RATE_LIMIT_RPC_WALLET_PER_MIN,
+            ip_per_min=settings.RATE_LIMIT_RPC_IP_PER_MIN,
+            concurrency=settings.RATE_LIMIT_RPC_CONCURRENCY,
+            queue_timeout=settings.RATE_LIMIT_RPC_QUEUE_TIMEOUT,
+        ),
+    }
@@ -0,0 +1,337 @@
+# scheduler.py
+# 存款提醒调度器 - 按下次应存款时间组织的最小堆，批量触发 nudge / keeper 回调
+
+import asyncio
+import heapq
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from typing import Callable, Dict, List, Optional
+
+from app.logger import get_logger, log_event
+
+logger = get_logger("scheduler")
+
+# 回调参数: [{"wallet": ..., "plan_id": ..., "due_time": ...}, ...]
+NudgeCallback = Callable[[List[dict]], None]
+
+# 单次从登记队列取出的最大条数
+INBOX_BATCH_SIZE = 1000
+
+
+class NudgeInbox:
+    """
+    提醒登记队列（SQLite，同机所有 worker 共用一个文件）
+
+    任意 worker 收到 create-plan 时写入登记 / 取消；
+    运行调度器的 worker 按写入顺序取出并应用，因此登记不会因为落在其他 worker 上而丢失。
+    """
+
+    def __init__(self, path: str):
+        """
+        Args:
+            path: SQLite 文件路径
+        """
+        self.path = path
+        self._local = threading.local()
+
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+        conn = self._conn()
+        with conn:
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS registrations ("
+                " id INTEGER PRIMARY KEY AUTOINCREMENT, wallet TEXT NOT NULL, plan_id TEXT,"
+                " frequency INTEGER, next_due REAL)"
+            )
+
+    def _conn(self) -> sqlite3.Connection:
+        """每个线程一个连接"""
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=10, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def put_schedule(self, wallet: str, plan_id: str, frequency: int, next_due: float):
+        """登记（或替换）一个钱包的计划"""
+        if frequency <= 0:
+            raise ValueError("frequency must be positive")
+        self._conn().execute(
+            "INSERT INTO registrations (wallet, plan_id, frequency, next_due) VALUES (?, ?, ?, ?)",
+            (wallet.lower(), plan_id, frequency, next_due)
+        )
+
+    def put_remove(self, wallet: str):
+        """取消一个钱包的提醒"""
+        self._conn().execute(
+            "INSERT INTO registrations (wallet, plan_id, frequency, next_due) VALUES (?, NULL, NULL, NULL)",
+            (wallet.lower(),)
+        )
+
+    def take(self, limit: int = INBOX_BATCH_SIZE) -> List[tuple]:
+        """
+        按写入顺序取出并删除最多 limit 条登记
+
+        Returns:
+            List[tuple]: [(wallet, plan_id, frequency, next_due), ...]；plan_id 为 None 表示取消
+        """
+        conn = self._conn()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            rows = conn.execute(
+                "SELECT id, wallet, plan_id, frequency, next_due FROM registrations ORDER BY id LIMIT ?",
+                (limit,)
+            ).fetchall()
+            if rows:
+                conn.execute("DELETE FROM registrations WHERE id <= ?", (rows[-1][0],))
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        return [row[1:] for row in rows]
+
+
+class NudgeScheduler:
+    """
+    最小堆调度器（键为钱包地址，一个钱包对应其最新的 nudge_enabled 计划）
+
+    - 堆元素 (next_due, version, wallet)；重新调度时压入新元素并递增 version，
+      旧元素在弹出时按 version 判定为过期并丢弃（惰性删除），因此调度 / 重新调度均为 O(log n)
+    - 到期的计划按批弹出并调用回调，然后顺延一个周期（直到收到存款再按存款时间重新计算）
+    - 状态可保存为 JSON 文件，重启后 O(n) 重建堆
+    - 所有状态读写都在 self._lock 内：tick / save 在线程池执行，schedule 等由事件循环或链头追踪线程调用
+    - 多 worker 部署时只有一个 worker 运行调度器，其他 worker 的登记经 NudgeInbox 转交，每次 tick 前应用
+    """
+
+    def __init__(self, state_path: Optional[str] = None, batch_size: int = 1000,
+                 inbox: Optional[NudgeInbox] = None):
+        """
+        初始化调度器
+
+        Args:
+            state_path: 状态文件路径（None 表示不持久化）
+            batch_size: 单批回调最多包含的计划数
+            inbox: 共享登记队列（None 表示只接受本进程直接调用 schedule / remove）
+        """
+        self.state_path = state_path
+        self.batch_size = batch_size
+        self.inbox = inbox
+        self.callbacks: List[NudgeCallback] = []
+
+        self._heap: List[tuple] = []
+        # wallet -> [next_due, frequency, version, plan_id]
+        self._entries: Dict[str, list] = {}
+        self._version = 0
+        self._dirty = False
+        self._lock = threading.RLock()
+
+    def __len__(self) -> int:
+        with self._lock:
+            return len(self._entries)
+
+    def add_callback(self, callback: NudgeCallback):
+        """注册批量回调（nudge 推送、keeper 触发等）"""
+        self.callbacks.append(callback)
+
+    def _push(self, wallet: str, next_due: float):
+        self._version += 1
+        entry = self._entries[wallet]
+        entry[0] = next_due
+        entry[2] = self._version
+        heapq.heappush(self._heap, (next_due, self._version, wallet))
+        self._dirty = True
+
+        # 过期元素太多时重建堆，防止无限增长
+        if len(self._heap) > 2 * len(self._entries) + 1024:
+            self._compact()
+
+    def _compact(self):
+        self._heap = [(e[0], e[2], w) for w, e in self._entries.items()]
+        heapq.heapify(self._heap)
+
+    def schedule(self, wallet: str, plan_id: str, frequency: int, next_due: float):
+        """
+        登记（或替换）一个钱包的计划
+
+        Args:
+            wallet: 钱包地址
+            plan_id: 计划 ID
+            frequency: 存款周期（秒）
+            next_due: 下次应存款时间戳
+        """
+        if frequency <= 0:
+            raise ValueError("frequency must be positive")
+        wallet = wallet.lower()
+        with self._lock:
+            self._entries[wallet] = [next_due, frequency, 0, plan_id]
+            self._push(wallet, next_due)
+
+    def record_deposit(self, wallet: str, deposit_time: float) -> bool:
+        """
+        收到存款后按存款时间重新调度
+
+        Returns:
+            bool: 该钱包是否在调度中
+        """
+        with self._lock:
+            entry = self._entries.get(wallet.lower())
+            if entry is None:
+                return False
+            self._push(wallet.lower(), deposit_time + entry[1])
+            return True
+
+    def remove(self, wallet: str):
+        """移除钱包（堆中残留元素在弹出时丢弃）"""
+        with self._lock:
+            if self._entries.pop(wallet.lower(), None) is not None:
+                self._dirty = True
+
+    def apply_inbox(self) -> int:
+        """
+        应用共享登记队列中的所有登记 / 取消
+
+        Returns:
+            int: 应用的条数
+        """
+        if self.inbox is None:
+            return 0
+        applied = 0
+        while True:
+            rows = self.inbox.take()
+            for wallet, plan_id, frequency, next_due in rows:
+                if plan_id is None:
+                    self.remove(wallet)
+                else:
+                    self.schedule(wallet, plan_id, frequency, next_due)
+            applied += len(rows)
+            if len(rows) < INBOX_BATCH_SIZE:
+                return applied
+
+    def next_due(self) -> Optional[float]:
+        """最早的下次应存款时间"""
+        with self._lock:
+            while self._heap:
+                due, version, wallet = self._heap[0]
+                entry = self._entries.get(wallet)
+                if entry is not None and entry[2] == version:
+                    return due
+                heapq.heappop(self._heap)
+            return None
+
+    def pop_due(self, now: float, limit: Optional[int] = None) -> List[dict]:
+        """
+        弹出所有到期计划（最多 limit 个），并把它们顺延一个周期
+
+        Returns:
+            List[dict]: 到期计划
+        """
+        limit = limit or self.batch_size
+        due_items = []
+        with self._lock:
+            while self._heap and len(due_items) < limit and self._heap[0][0] <= now:
+                due, version, wallet = heapq.heappop(self._heap)
+                entry = self._entries.get(wallet)
+                if entry is None or entry[2] != version:
+                    continue
+                due_items.append({"wallet": wallet, "plan_id": entry[3], "due_time": int(due)})
+
+                # 顺延到 now 之后的第一个周期点
+                frequency = entry[1]
+                missed = int((now - due) // frequency) + 1
+                self._push(wallet, due + missed * frequency)
+        return due_items
+
+    def tick(self, now: Optional[float] = None) -> int:
+        """
+        处理所有到期计划，按批调用回调
+
+        Returns:
+            int: 本次触发的计划数
+        """
+        now = time.time() if now is None else now
+        fired = 0
+        while True:
+            batch = self.pop_due(now)
+            if not batch:
+                break
+            fired += len(batch)
+            for callback in self.callbacks:
+                try:
+                    callback(batch)
+                except Exception as e:
+                    log_event(logger, logging.ERROR, "nudge_callback_failed", batch_size=len(batch), error=str(e))
+        return fired
+
+    def save(self):
+        """保存状态（锁内取快照，锁外写临时文件再原子替换）"""
+        if not self.state_path:
+            return
+        with self._lock:
+            if not self._dirty:
+                return
+            state = {w: [e[0], e[1], e[3]] for w, e in self._entries.items()}
+            self._dirty = False
+
+        tmp_path = f"{self.state_path}.{os.getpid()}.tmp"
+        try:
+            with open(tmp_path, "w") as f:
+                json.dump(state, f, separators=(",", ":"))
+            os.replace(tmp_path, self.state_path)
+        except Exception:
+            with self._lock:
+                self._dirty = True
+            raise
+
+    def load(self):
+        """从状态文件恢复"""
+        if not self.state_path or not os.path.exists(self.state_path):
+            return
+        try:
+            with open(self.state_path, "r") as f:
+                state = json.load(f)
+        except (OSError, json.JSONDecodeError) as e:
+            log_event(logger, logging.WARNING, "scheduler_load_failed", path=self.state_path, error=str(e))
+            return
+
+        with self._lock:
+            self._entries = {}
+            for wallet, (next_due, frequency, plan_id) in state.items():
+                self._version += 1
+                self._entries[wallet] = [next_due, frequency, self._version, plan_id]
+            self._compact()
+            self._dirty = False
+        log_event(logger, logging.INFO, "scheduler_loaded", plans=len(state))
+
+    def _save_logged(self):
+        try:
+            self.save()
+        except Exception as e:
+            log_event(logger, logging.ERROR, "scheduler_save_failed", path=self.state_path, error=str(e))
+
+    async def run(self, tick_seconds: float = 5.0, persist_seconds: float = 60.0):
+        """后台循环：在线程池中定期应用登记队列并 tick、定期持久化（失败只记录日志）；任务取消时保存状态"""
+        last_persist = time.monotonic()
+        try:
+            while True:
+                try:
+                    await asyncio.to_thread(self.apply_inbox)
+                except Exception as e:
+                    log_event(logger, logging.ERROR, "scheduler_inbox_failed", error=str(e))
+                try:
+                    await asyncio.to_thread(self.tick)
+                except Exception as e:
+                    log_event(logger, logging.ERROR, "scheduler_tick_failed", error=str(e))
+                if time.monotonic() - last_persist >= persist_seconds:
+                    await asyncio.to_thread(self._save_logged)
+                    last_persist = time.monotonic()
+                await asyncio.sleep(tick_seconds)
+        finally:
+            self._save_logged()
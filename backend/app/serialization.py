@@ -0,0 +1,26 @@
+# serialization.py
+# 快速 JSON 响应 - 优先使用 orjson，未安装时回退到标准库 json
+
+import json
+from typing import Any
+
+from fastapi.responses import JSONResponse
+
+try:
+    import orjson
+except ImportError:  # orjson 为可选依赖
+    orjson = None
+
+
+class FastJSONResponse(JSONResponse):
+    """
+    跳过 FastAPI 默认编码器的 JSON 响应
+
+    只用于内容已经是 dict/list/str/int/bool 的可信数据（例如链上解码结果），
+    不做 jsonable_encoder 转换。
+    """
+
+    def render(self, content: Any) -> bytes:
+        if orjson is not None:
+            return orjson.dumps(content)
+        return json.dumps(content, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
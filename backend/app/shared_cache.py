@@ -0,0 +1,332 @@
+# shared_cache.py
+# 跨进程共享缓存 - 基于 SQLite (WAL + mmap)，多个 uvicorn worker 共用同一份缓存
+
+import logging
+import json
+import os
+import sqlite3
+import stat
+import threading
+import time
+import uuid
+from typing import Any, Callable, Optional, Tuple
+
+from app.logger import get_logger, log_event
+
+logger = get_logger("cache")
+
+_MISSING = object()
+
+
+def ensure_private_path(path: str):
+    """
+    创建缓存文件所在目录（0700），并确认目录和已有文件都属于当前用户、其他用户不可写
+
+    Raises:
+        PermissionError: 目录或文件属于其他用户，或可被其他用户写入
+    """
+    directory = os.path.dirname(path) or "."
+    os.makedirs(directory, mode=0o700, exist_ok=True)
+    if not hasattr(os, "getuid"):  # Windows 没有 uid / 权限位
+        return
+
+    for target in (directory, path):
+        try:
+            st = os.stat(target)
+        except FileNotFoundError:
+            continue
+        if st.st_uid != os.getuid():
+            raise PermissionError(f"缓存路径属于其他用户: {target}")
+        if st.st_mode & (stat.S_IWGRP | stat.S_IWOTH):
+            raise PermissionError(f"缓存路径可被其他用户写入: {target}")
+
+
+class SharedCache:
+    """
+    本机多进程共享的键值缓存
+
+    - get_or_compute: 跨进程原子的「读取或计算」，同一个 key 同时只有一个进程在计算，
+      其余进程等待结果（通过 leases 表加租约实现，租约超时后可被接管）
+    - 容量上限: 超过 max_entries 时按最近访问时间淘汰
+    - 值用 JSON 序列化（只支持 dict / list / str / int / float / bool / None，tuple 读回为 list），
+      读取缓存文件不会执行代码；无法解析的旧条目按未命中处理并删除
+    - 缓存目录必须属于当前用户且不允许其他用户写入，防止他人预先放置缓存文件篡改数据
+    - get_or_compute 先无锁读，只有未命中时才进入写事务抢租约；
+      等待其他进程计算的时间默认不超过 wait_seconds，超时后自己计算；
+      计算很慢（如 LLM）的调用方可以传入更长的等待时间，最长为租约时长
+    - 版本号 (guard): 失效方先 bump(guard) 再删除键；compute 期间 guard 被 bump 过的结果不写入，
+      避免失效之前开始的计算把旧数据写回缓存
+    """
+
+    # 读命中后，距离上次记录访问时间超过该秒数才回写 last_access，避免每次读都变成写
+    TOUCH_INTERVAL = 5.0
+    # 每写入多少次做一次淘汰检查
+    EVICT_EVERY = 64
+
+    def __init__(self, path: str, max_entries: int = 100000, lease_seconds: float = 30.0,
+                 poll_interval: float = 0.05, wait_seconds: float = 2.0, mmap_size: int = 64 * 1024 * 1024):
+        """
+        初始化共享缓存
+
+        Args:
+            path: SQLite 文件路径（同一台机器上的所有 worker 指向同一个文件）
+            max_entries: 最大条目数
+            lease_seconds: 计算租约有效期（秒），持有者崩溃后其他进程可接管
+            poll_interval: 等待其他进程计算结果时的轮询间隔（秒）
+            wait_seconds: 等待其他进程计算结果的上限（秒）
+            mmap_size: SQLite mmap 大小（字节）
+        """
+        self.path = path
+        self.max_entries = max_entries
+        self.lease_seconds = lease_seconds
+        self.poll_interval = poll_interval
+        self.wait_seconds = wait_seconds
+        self.mmap_size = mmap_size
+        self.owner = f"{os.getpid()}-{uuid.uuid4().hex[:8]}"
+
+        self._local = threading.local()
+        self._writes = 0
+
+        ensure_private_path(path)
+
+        conn = self._conn()
+        with conn:
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS cache ("
+                " key TEXT PRIMARY KEY, value BLOB NOT NULL,"
+                " expires_at REAL, last_access REAL NOT NULL)"
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_cache_last_access ON cache(last_access)")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS leases ("
+                " key TEXT PRIMARY KEY, owner TEXT NOT NULL, expires_at REAL NOT NULL)"
+            )
+            # 版本号不参与容量淘汰
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS generations ("
+                " key TEXT PRIMARY KEY, value INTEGER NOT NULL)"
+            )
+
+    def _conn(self) -> sqlite3.Connection:
+        """每个线程一个连接"""
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=10, isolation_level=None, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute(f"PRAGMA mmap_size={int(self.mmap_size)}")
+            self._local.conn = conn
+        return conn
+
+    def _owner(self) -> str:
+        """租约持有者标识（进程 + 线程）"""
+        return f"{self.owner}-{threading.get_ident()}"
+
+    def _read(self, conn: sqlite3.Connection, key: str, now: float) -> Any:
+        row = conn.execute(
+            "SELECT value, expires_at, last_access FROM cache WHERE key = ?", (key,)
+        ).fetchone()
+        if row is None:
+            return _MISSING
+        value, expires_at, last_access = row
+        if expires_at is not None and expires_at <= now:
+            return _MISSING
+        try:
+            result = json.loads(value)
+        except (ValueError, TypeError) as e:
+            # 旧版本写入（例如 pickle 格式）、当前代码无法解析的条目按未命中处理
+            log_event(logger, logging.WARNING, "cache_decode_failed", key=key, error=str(e))
+            conn.execute("DELETE FROM cache WHERE key = ?", (key,))
+            return _MISSING
+        if now - last_access > self.TOUCH_INTERVAL:
+            conn.execute("UPDATE cache SET last_access = ? WHERE key = ?", (now, key))
+        return result
+
+    def get(self, key: str) -> Tuple[bool, Any]:
+        """
+        读取缓存
+
+        Returns:
+            (是否命中, 值)
+        """
+        value = self._read(self._conn(), key, time.time())
+        if value is _MISSING:
+            return False, None
+        return True, value
+
+    def set(self, key: str, value: Any, ttl: Optional[float] = None,
+            guard: Optional[str] = None, generation: Optional[int] = None) -> bool:
+        """
+        写入缓存
+
+        Args:
+            key: 键
+            value: 值（可 JSON 序列化）
+            ttl: 过期秒数，None 表示永不过期（只会被淘汰或主动失效）
+            guard: 版本号键（None 表示无条件写入）
+            generation: 计算开始前读到的 guard 版本号，当前版本号不同则放弃写入
+
+        Returns:
+            bool: 是否写入
+        """
+        now = time.time()
+        expires_at = now + ttl if ttl is not None else None
+        blob = json.dumps(value, separators=(",", ":"))
+
+        conn = self._conn()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            written = guard is None or self._generation(conn, guard) == generation
+            if written:
+                conn.execute(
+                    "INSERT OR REPLACE INTO cache (key, value, expires_at, last_access) VALUES (?, ?, ?, ?)",
+                    (key, blob, expires_at, now)
+                )
+            conn.execute("DELETE FROM leases WHERE key = ? AND owner = ?", (key, self._owner()))
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+
+        if not written:
+            log_event(logger, logging.DEBUG, "cache_write_stale", key=key, guard=guard)
+            return False
+
+        self._writes += 1
+        if self._writes % self.EVICT_EVERY == 0:
+            self.evict()
+        return True
+
+    @staticmethod
+    def _generation(conn: sqlite3.Connection, guard: str) -> int:
+        row = conn.execute("SELECT value FROM generations WHERE key = ?", (guard,)).fetchone()
+        return row[0] if row else 0
+
+    def generation(self, guard: str) -> int:
+        """读取版本号（从未 bump 过为 0）"""
+        return self._generation(self._conn(), guard)
+
+    def bump(self, guard: str):
+        """版本号加一，使此前开始的 compute 结果不再写入"""
+        conn = self._conn()
+        with conn:
+            conn.execute(
+                "INSERT INTO generations (key, value) VALUES (?, 1)"
+                " ON CONFLICT(key) DO UPDATE SET value = value + 1",
+                (guard,)
+            )
+
+    def delete(self, key: str):
+        """删除单个键"""
+        conn = self._conn()
+        with conn:
+            conn.execute("DELETE FROM cache WHERE key = ?", (key,))
+
+    def delete_prefix(self, prefix: str):
+        """删除所有以 prefix 开头的键"""
+        conn = self._conn()
+        with conn:
+            conn.execute("DELETE FROM cache WHERE key >= ? AND key < ?", (prefix, prefix + "\uffff"))
+
+    def evict(self):
+        """清理过期条目，并按最近访问时间淘汰超出容量的条目"""
+        now = time.time()
+        conn = self._conn()
+        with conn:
+            conn.execute("DELETE FROM cache WHERE expires_at IS NOT NULL AND expires_at <= ?", (now,))
+            conn.execute("DELETE FROM leases WHERE expires_at <= ?", (now,))
+            conn.execute(
+                "DELETE FROM cache WHERE key IN ("
+                " SELECT key FROM cache ORDER BY last_access DESC LIMIT -1 OFFSET ?)",
+                (self.max_entries,)
+            )
+
+    def _try_acquire(self, key: str) -> Tuple[Any, bool]:
+        """
+        在一个写事务内：命中则返回值；未命中则尝试拿计算租约
+
+        Returns:
+            (值或 _MISSING, 是否拿到租约)
+        """
+        now = time.time()
+        conn = self._conn()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            value = self._read(conn, key, now)
+            if value is not _MISSING:
+                conn.execute("COMMIT")
+                return value, False
+
+            lease = conn.execute("SELECT owner, expires_at FROM leases WHERE key = ?", (key,)).fetchone()
+            acquired = lease is None or lease[1] <= now or lease[0] == self._owner()
+            if acquired:
+                conn.execute(
+                    "INSERT OR REPLACE INTO leases (key, owner, expires_at) VALUES (?, ?, ?)",
+                    (key, self._owner(), now + self.lease_seconds)
+                )
+            conn.execute("COMMIT")
+            return _MISSING, acquired
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+
+    def _release(self, key: str):
+        conn = self._conn()
+        with conn:
+            conn.execute("DELETE FROM leases WHERE key = ? AND owner = ?", (key, self._owner()))
+
+    def get_or_compute(self, key: str, compute: Callable[[], Any], ttl: Optional[float] = None,
+                       guard: Optional[str] = None, wait_seconds: Optional[float] = None) -> Any:
+        """
+        读取缓存，未命中时计算并写入；跨进程保证同一时刻只有一个进程执行 compute
+
+        缓存本身出错（文件损坏、锁超时等）时直接调用 compute，不影响请求。
+        compute 抛出的异常不会被缓存。
+
+        Args:
+            key: 键
+            compute: 计算函数
+            ttl: 过期秒数，None 表示永不过期
+            guard: 版本号键，compute 期间被 bump 过则结果只返回、不写入
+            wait_seconds: 等待其他进程计算结果的上限（默认 self.wait_seconds，不超过 lease_seconds）
+
+        Returns:
+            缓存值或计算结果
+        """
+        wait = self.wait_seconds if wait_seconds is None else min(wait_seconds, self.lease_seconds)
+        deadline = time.monotonic() + wait
+        try:
+            # 命中路径只读，不占用 SQLite 写锁
+            value = self._read(self._conn(), key, time.time())
+            if value is not _MISSING:
+                return value
+
+            while True:
+                value, acquired = self._try_acquire(key)
+                if value is not _MISSING:
+                    return value
+                if acquired:
+                    break
+                if time.monotonic() >= deadline:
+                    # 其他进程迟迟没有写入结果，自己算但不抢租约
+                    return compute()
+                time.sleep(self.poll_interval)
+            generation = self.generation(guard) if guard is not None else None
+        except sqlite3.Error as e:
+            log_event(logger, logging.WARNING, "cache_error", key=key, error=str(e))
+            return compute()
+
+        try:
+            value = compute()
+        except Exception:
+            try:
+                self._release(key)
+            except sqlite3.Error:
+                pass
+            raise
+
+        try:
+            self.set(key, value, ttl, guard=guard, generation=generation)
+        except sqlite3.Error as e:
+            log_event(logger, logging.WARNING, "cache_error", key=key, error=str(e))
+        return value
@@ -0,0 +1,530 @@
+# tx_tracker.py
+# 跨链交易状态追踪 - 所有待确认交易共用一个轮询循环，按链批量查询回执 (JSON-RPC batch)，
+# 再从 ZetaChain 合约日志匹配跨链结果；交易状态存于 SQLite，多个 worker 共享
+
+import asyncio
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from dataclasses import asdict, dataclass, field
+from typing import Dict, List, Optional, Tuple
+
+import requests
+from eth_abi import decode
+from eth_utils import keccak
+
+from app.logger import get_logger, log_event
+
+logger = get_logger("tx_tracker")
+
+ZETACHAIN_CHAIN_ID = 7001
+
+# 交易状态
+STATUS_PENDING = "pending"                      # 还没有回执
+STATUS_FAILED = "failed"                        # 回执 status = 0
+STATUS_INBOUND_CONFIRMED = "inbound_confirmed"  # 源链交易已上链，等待 ZetaChain 执行 onCall
+STATUS_OUTBOUND_PENDING = "outbound_pending"    # ZetaChain 上的跨链取款已发出，等待目标链结果
+STATUS_COMPLETED = "completed"
+STATUS_REVERTED = "reverted"
+STATUS_ABORTED = "aborted"
+STATUS_TIMEOUT = "timeout"
+
+FINAL_STATUSES = {STATUS_FAILED, STATUS_COMPLETED, STATUS_REVERTED, STATUS_ABORTED, STATUS_TIMEOUT}
+
+
+def _topic(signature: str) -> str:
+    return "0x" + keccak(text=signature).hex()
+
+
+# ZetaSaveCrossChain 合约事件
+TOPIC_CROSS_CHAIN_DEPOSIT = _topic("CrossChainDeposit(address,address,uint256,uint256)")
+TOPIC_CROSS_CHAIN_WITHDRAW = _topic("CrossChainWithdraw(address,address,uint256,bytes)")
+TOPIC_REVERT_RECEIVED = _topic("RevertReceived(address,uint256,uint256)")
+TOPIC_ABORT_RECEIVED = _topic("AbortReceived(address,uint256,bytes)")
+
+# 单个 JSON-RPC batch 最多包含的请求数
+RPC_BATCH_SIZE = 100
+# 单轮最多扫描的 ZetaChain 区块数
+MAX_LOG_RANGE = 5000
+# 源链区块时间换算到 ZetaChain 区块时向前多留的区块数（两条链时钟有偏差）
+ZETA_BLOCK_MARGIN = 20
+# TxStore 中保存 ZetaChain 日志扫描进度的键
+SCAN_POSITION_KEY = "zeta_scan_block"
+
+
+def parse_rpc_urls(spec: str) -> Dict[int, str]:
+    """解析 "11155111=https://...,84532=https://..." 格式的链 RPC 配置"""
+    urls = {}
+    for item in spec.split(","):
+        if "=" not in item:
+            continue
+        chain_id, url = item.split("=", 1)
+        try:
+            urls[int(chain_id.strip())] = url.strip()
+        except ValueError:
+            continue
+    return urls
+
+
+def _topic_address(topic: str) -> str:
+    return "0x" + topic[-40:].lower()
+
+
+@dataclass
+class TrackedTx:
+    """被追踪的交易"""
+    tx_hash: str
+    chain_id: int
+    status: str = STATUS_PENDING
+    created_at: float = field(default_factory=time.time)
+    updated_at: float = field(default_factory=time.time)
+    sender: Optional[str] = None
+    block_number: Optional[int] = None
+    block_time: Optional[int] = None          # 回执所在区块的时间戳
+    zeta_from_block: Optional[int] = None     # 跨链结果最早可能出现的 ZetaChain 区块
+    zeta_tx_hash: Optional[str] = None
+    events: List[str] = field(default_factory=list)
+
+    def set_status(self, status: str):
+        self.status = status
+        self.updated_at = time.time()
+
+    def to_dict(self) -> dict:
+        return {
+            "tx_hash": self.tx_hash,
+            "chain_id": self.chain_id,
+            "status": self.status,
+            "sender": self.sender,
+            "block_number": self.block_number,
+            "zeta_tx_hash": self.zeta_tx_hash,
+            "events": self.events,
+            "created_at": int(self.created_at),
+            "updated_at": int(self.updated_at),
+        }
+
+
+class TxStore:
+    """
+    被追踪交易的共享存储（SQLite WAL，同机所有 worker 指向同一个文件）
+
+    任意 worker 都可以登记和查询交易；只有运行轮询的 worker 更新状态。
+    登记只插入新行，轮询只更新已有行，两者不会互相覆盖。
+    """
+
+    def __init__(self, path: str):
+        """
+        Args:
+            path: SQLite 文件路径
+        """
+        self.path = path
+        self._local = threading.local()
+
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+        conn = self._conn()
+        with conn:
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS txs ("
+                " tx_hash TEXT PRIMARY KEY, status TEXT NOT NULL,"
+                " updated_at REAL NOT NULL, data TEXT NOT NULL)"
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_txs_status ON txs(status)")
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_txs_zeta_hash ON txs(json_extract(data, '$.zeta_tx_hash'))")
+            conn.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value INTEGER NOT NULL)")
+
+    def _conn(self) -> sqlite3.Connection:
+        """每个线程一个连接"""
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=10, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    @staticmethod
+    def _decode(data: str) -> TrackedTx:
+        return TrackedTx(**json.loads(data))
+
+    def add(self, tx: TrackedTx) -> TrackedTx:
+        """插入新交易；已存在时返回已有记录"""
+        conn = self._conn()
+        conn.execute(
+            "INSERT OR IGNORE INTO txs (tx_hash, status, updated_at, data) VALUES (?, ?, ?, ?)",
+            (tx.tx_hash, tx.status, tx.updated_at, json.dumps(asdict(tx)))
+        )
+        row = conn.execute("SELECT data FROM txs WHERE tx_hash = ?", (tx.tx_hash,)).fetchone()
+        return self._decode(row[0])
+
+    def get_many(self, tx_hashes: List[str]) -> Dict[str, TrackedTx]:
+        if not tx_hashes:
+            return {}
+        placeholders = ",".join("?" * len(tx_hashes))
+        rows = self._conn().execute(
+            f"SELECT tx_hash, data FROM txs WHERE tx_hash IN ({placeholders})", tx_hashes
+        ).fetchall()
+        return {tx_hash: self._decode(data) for tx_hash, data in rows}
+
+    def load_active(self) -> Dict[str, TrackedTx]:
+        """读取所有未到最终状态的交易"""
+        placeholders = ",".join("?" * len(FINAL_STATUSES))
+        rows = self._conn().execute(
+            f"SELECT tx_hash, data FROM txs WHERE status NOT IN ({placeholders})", sorted(FINAL_STATUSES)
+        ).fetchall()
+        return {tx_hash: self._decode(data) for tx_hash, data in rows}
+
+    def has_active(self) -> bool:
+        placeholders = ",".join("?" * len(FINAL_STATUSES))
+        row = self._conn().execute(
+            f"SELECT 1 FROM txs WHERE status NOT IN ({placeholders}) LIMIT 1", sorted(FINAL_STATUSES)
+        ).fetchone()
+        return row is not None
+
+    def update(self, txs: List[TrackedTx]):
+        """写回轮询结果（只更新已有行）"""
+        conn = self._conn()
+        with conn:
+            conn.execute("BEGIN")
+            conn.executemany(
+                "UPDATE txs SET status = ?, updated_at = ?, data = ? WHERE tx_hash = ?",
+                [(tx.status, tx.updated_at, json.dumps(asdict(tx)), tx.tx_hash) for tx in txs]
+            )
+
+    def get_meta(self, key: str) -> Optional[int]:
+        row = self._conn().execute("SELECT value FROM meta WHERE key = ?", (key,)).fetchone()
+        return row[0] if row else None
+
+    def set_meta(self, key: str, value: int):
+        self._conn().execute("INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)", (key, value))
+
+    def is_matched(self, zeta_tx_hash: str) -> bool:
+        """该 ZetaChain 交易是否已经匹配给某笔被追踪的交易"""
+        row = self._conn().execute(
+            "SELECT 1 FROM txs WHERE json_extract(data, '$.zeta_tx_hash') = ? LIMIT 1", (zeta_tx_hash,)
+        ).fetchone()
+        return row is not None
+
+    def purge(self, before: float):
+        """删除早于 before 进入最终状态的交易"""
+        placeholders = ",".join("?" * len(FINAL_STATUSES))
+        self._conn().execute(
+            f"DELETE FROM txs WHERE status IN ({placeholders}) AND updated_at < ?",
+            (*sorted(FINAL_STATUSES), before)
+        )
+
+
+class TxTracker:
+    """
+    跨链交易追踪器
+
+    - 源链交易 (ETH Sepolia / Base Sepolia 上的 depositAndCall)：
+      回执成功后进入 inbound_confirmed，在 ZetaChain 上看到同一用户、同一源链的
+      CrossChainDeposit 事件即为 completed
+    - ZetaChain 交易 (7001)：回执中有 CrossChainWithdraw 则进入 outbound_pending，
+      之后收到该用户的 RevertReceived / AbortReceived 即 reverted / aborted，
+      超过 outbound_grace 秒没有回滚视为 completed；否则直接 completed
+    onCall 本身失败时 ZetaChain 会把资金退回源链，合约上没有事件，这类交易最终为 timeout。
+
+    交易状态保存在 TxStore 中：每个 worker 都可以 watch / get_status，
+    轮询循环 run() 只需要在一个 worker 上运行（由调用方用文件锁保证）。
+    ZetaChain 日志的扫描进度也存在 TxStore 中；源链交易按回执区块时间换算出 ZetaChain 上的起始区块，
+    晚登记或轮询重启时回退扫描位置，不会漏掉已经发生的 CrossChainDeposit。
+    """
+
+    def __init__(self, rpc_urls: Dict[int, str], contract_address: str, store_path: str,
+                 request_timeout: int = 10, pending_timeout: float = 1800,
+                 outbound_grace: float = 600, retention: float = 3600):
+        """
+        Args:
+            rpc_urls: 链 ID -> RPC URL（必须包含 ZetaChain 7001）
+            contract_address: ZetaChain 上的 ZetaSaveCrossChain 合约地址
+            store_path: 共享状态 SQLite 文件路径
+            request_timeout: 单次 RPC 请求超时（秒）
+            pending_timeout: 未得到最终结果的超时（秒）
+            outbound_grace: 跨链取款无回滚即视为成功的等待时间（秒）
+            retention: 最终状态保留多久后清理（秒）
+        """
+        self.rpc_urls = rpc_urls
+        self.contract_address = contract_address.lower()
+        self.request_timeout = request_timeout
+        self.pending_timeout = pending_timeout
+        self.outbound_grace = outbound_grace
+        self.retention = retention
+
+        self.store = TxStore(store_path)
+        # 当前一轮轮询的工作集（未到最终状态的交易），每轮开始时从 store 重新读取
+        self._txs: Dict[str, TrackedTx] = {}
+        self._lock = threading.Lock()
+        self._session = requests.Session()
+
+    # --- 对外接口 ---
+
+    def watch(self, tx_hash: str, chain_id: int) -> TrackedTx:
+        """
+        开始追踪一笔交易（重复提交返回已有记录）
+
+        Raises:
+            ValueError: 不支持的链
+        """
+        if chain_id not in self.rpc_urls:
+            raise ValueError(f"不支持的链: {chain_id}")
+        return self.store.add(TrackedTx(tx_hash=tx_hash.lower(), chain_id=chain_id))
+
+    def get_status(self, tx_hashes: List[str]) -> List[dict]:
+        """批量查询状态（未追踪的交易返回 None）"""
+        found = self.store.get_many([h.lower() for h in tx_hashes])
+        return [found[h.lower()].to_dict() if h.lower() in found else None for h in tx_hashes]
+
+    def has_pending(self) -> bool:
+        return self.store.has_active()
+
+    # --- JSON-RPC ---
+
+    def _rpc_batch(self, url: str, calls: List[Tuple[str, list]]) -> List:
+        """
+        发送 JSON-RPC batch，按请求顺序返回 result（出错的请求为 None）
+        """
+        results = []
+        for offset in range(0, len(calls), RPC_BATCH_SIZE):
+            chunk = calls[offset:offset + RPC_BATCH_SIZE]
+            payload = [
+                {"jsonrpc": "2.0", "id": i, "method": method, "params": params}
+                for i, (method, params) in enumerate(chunk)
+            ]
+            response = self._session.post(url, json=payload, timeout=self.request_timeout)
+            response.raise_for_status()
+            body = response.json()
+            if not isinstance(body, list):
+                raise ValueError(f"RPC 不支持 batch 请求: {body}")
+            by_id = {item.get("id"): item.get("result") for item in body}
+            results.extend(by_id.get(i) for i in range(len(chunk)))
+        return results
+
+    # --- 轮询 ---
+
+    def poll_once(self):
+        """执行一轮：批量查回执 -> 扫描 ZetaChain 合约日志 -> 处理超时 -> 写回共享存储"""
+        active = self.store.load_active()
+        with self._lock:
+            self._txs = active
+            need_receipt: Dict[int, List[TrackedTx]] = {}
+            for tx in self._txs.values():
+                if tx.status == STATUS_PENDING:
+                    need_receipt.setdefault(tx.chain_id, []).append(tx)
+
+        for chain_id, txs in need_receipt.items():
+            try:
+                receipts = self._rpc_batch(
+                    self.rpc_urls[chain_id],
+                    [("eth_getTransactionReceipt", [tx.tx_hash]) for tx in txs]
+                )
+            except Exception as e:
+                log_event(logger, logging.WARNING, "receipt_poll_failed", chain_id=chain_id, error=str(e))
+                continue
+            with self._lock:
+                for tx, receipt in zip(txs, receipts):
+                    if receipt:
+                        self._apply_receipt(tx, receipt)
+
+        # 源链交易需要回执区块时间来换算 ZetaChain 上的扫描起点（失败的下一轮重试）
+        with self._lock:
+            need_time: Dict[int, List[TrackedTx]] = {}
+            for tx in self._txs.values():
+                if tx.status == STATUS_INBOUND_CONFIRMED and tx.block_time is None:
+                    need_time.setdefault(tx.chain_id, []).append(tx)
+        for chain_id, txs in need_time.items():
+            try:
+                self._fill_block_times(chain_id, txs)
+            except Exception as e:
+                log_event(logger, logging.WARNING, "block_time_fetch_failed", chain_id=chain_id, error=str(e))
+
+        with self._lock:
+            waiting = [tx for tx in self._txs.values()
+                       if tx.status in (STATUS_INBOUND_CONFIRMED, STATUS_OUTBOUND_PENDING)]
+        if waiting:
+            try:
+                self._scan_zeta_logs(waiting)
+            except Exception as e:
+                log_event(logger, logging.WARNING, "zeta_log_scan_failed", error=str(e))
+
+        self._expire()
+        with self._lock:
+            self.store.update(list(self._txs.values()))
+
+    def _apply_receipt(self, tx: TrackedTx, receipt: dict):
+        tx.sender = (receipt.get("from") or "").lower() or None
+        tx.block_number = int(receipt["blockNumber"], 16)
+
+        if int(receipt.get("status", "0x0"), 16) != 1:
+            tx.set_status(STATUS_FAILED)
+            return
+
+        if tx.chain_id != ZETACHAIN_CHAIN_ID:
+            tx.set_status(STATUS_INBOUND_CONFIRMED)
+            return
+
+        topics = [
+            log["topics"][0] for log in receipt.get("logs", [])
+            if log.get("address", "").lower() == self.contract_address and log.get("topics")
+        ]
+        if TOPIC_CROSS_CHAIN_WITHDRAW in topics:
+            tx.events.append("CrossChainWithdraw")
+            tx.set_status(STATUS_OUTBOUND_PENDING)
+        else:
+            tx.set_status(STATUS_COMPLETED)
+
+    def _fill_block_times(self, chain_id: int, txs: List[TrackedTx]):
+        """批量读取回执所在区块的时间戳"""
+        missing = sorted({tx.block_number for tx in txs if tx.block_time is None})
+        if not missing:
+            return
+        blocks = self._rpc_batch(
+            self.rpc_urls[chain_id],
+            [("eth_getBlockByNumber", [hex(n), False]) for n in missing]
+        )
+        times = {n: int(b["timestamp"], 16) for n, b in zip(missing, blocks) if b}
+        with self._lock:
+            for tx in txs:
+                if tx.block_time is None and tx.block_number in times:
+                    tx.block_time = times[tx.block_number]
+
+    def _zeta_block_at(self, timestamp: int, latest: int) -> int:
+        """二分查找时间戳不早于 timestamp 的第一个 ZetaChain 区块（每笔源链交易只查一次）"""
+        zeta_url = self.rpc_urls[ZETACHAIN_CHAIN_ID]
+        low, high = 0, latest
+        while low < high:
+            mid = (low + high) // 2
+            block = self._rpc_batch(zeta_url, [("eth_getBlockByNumber", [hex(mid), False])])[0]
+            if block and int(block["timestamp"], 16) >= timestamp:
+                high = mid
+            else:
+                low = mid + 1
+        return low
+
+    def _scan_zeta_logs(self, waiting: List[TrackedTx]):
+        zeta_url = self.rpc_urls[ZETACHAIN_CHAIN_ID]
+        latest = int(self._rpc_batch(zeta_url, [("eth_blockNumber", [])])[0], 16)
+        scanned = self.store.get_meta(SCAN_POSITION_KEY)
+
+        # 新进入等待状态的交易：确定跨链结果最早可能出现的区块，必要时回退扫描位置
+        new_starts = []
+        has_old = any(tx.zeta_from_block is not None for tx in waiting)
+        for tx in waiting:
+            if tx.zeta_from_block is not None:
+                continue
+            if tx.chain_id == ZETACHAIN_CHAIN_ID:
+                start = tx.block_number
+            elif tx.block_time is not None:
+                start = max(self._zeta_block_at(tx.block_time, latest) - ZETA_BLOCK_MARGIN, 0)
+            else:
+                continue  # 区块时间还没取到，下一轮再处理
+            with self._lock:
+                tx.zeta_from_block = start
+            new_starts.append(start)
+
+        if new_starts:
+            earliest = min(new_starts) - 1
+            if scanned is None or earliest < scanned or not has_old:
+                # 回退（或在没有旧等待交易时跳到新交易附近）
+                scanned = earliest
+                log_event(logger, logging.INFO, "zeta_scan_rewound", from_block=scanned + 1)
+        if scanned is None:
+            return
+
+        from_block = scanned + 1
+        if from_block > latest:
+            self.store.set_meta(SCAN_POSITION_KEY, scanned)
+            return
+        to_block = min(from_block + MAX_LOG_RANGE - 1, latest)
+
+        logs = self._rpc_batch(zeta_url, [("eth_getLogs", [{
+            "address": self.contract_address,
+            "fromBlock": hex(from_block),
+            "toBlock": hex(to_block),
+            "topics": [[TOPIC_CROSS_CHAIN_DEPOSIT, TOPIC_REVERT_RECEIVED, TOPIC_ABORT_RECEIVED]]
+        }])])[0] or []
+
+        with self._lock:
+            for log in logs:
+                # 回退扫描时可能再次读到已匹配过的日志
+                if not self.store.is_matched(log["transactionHash"]):
+                    self._apply_zeta_log(log)
+        self.store.set_meta(SCAN_POSITION_KEY, to_block)
+
+    def _oldest(self, status: str, sender: str, block: int,
+                chain_id: Optional[int] = None) -> Optional[TrackedTx]:
+        """
+        找到最早进入该状态的匹配交易（同一用户多笔交易按先后顺序匹配）；
+        只匹配起始区块不晚于日志区块的交易，避免把更早的跨链结果算到新交易上
+        """
+        candidates = [
+            tx for tx in self._txs.values()
+            if tx.status == status and tx.sender == sender
+            and tx.zeta_from_block is not None and tx.zeta_from_block <= block
+            and (chain_id is None or tx.chain_id == chain_id)
+        ]
+        return min(candidates, key=lambda tx: (tx.zeta_from_block, tx.updated_at), default=None)
+
+    def _apply_zeta_log(self, log: dict):
+        topic0 = log["topics"][0]
+        data = bytes.fromhex(log["data"][2:])
+        block = int(log["blockNumber"], 16)
+
+        if topic0 == TOPIC_CROSS_CHAIN_DEPOSIT:
+            user = _topic_address(log["topics"][1])
+            _amount, source_chain_id = decode(["uint256", "uint256"], data)
+            tx = self._oldest(STATUS_INBOUND_CONFIRMED, user, block, source_chain_id)
+            if tx is not None:
+                tx.zeta_tx_hash = log["transactionHash"]
+                tx.events.append("CrossChainDeposit")
+                tx.set_status(STATUS_COMPLETED)
+
+        elif topic0 == TOPIC_REVERT_RECEIVED:
+            user = _topic_address(log["topics"][1])
+            tx = self._oldest(STATUS_OUTBOUND_PENDING, user, block)
+            if tx is not None:
+                tx.zeta_tx_hash = log["transactionHash"]
+                tx.events.append("RevertReceived")
+                tx.set_status(STATUS_REVERTED)
+
+        elif topic0 == TOPIC_ABORT_RECEIVED:
+            # revertMessage 为 abi.encode(user, planId, amount) 时才能定位用户
+            _amount, revert_message = decode(["uint256", "bytes"], data)
+            try:
+                user, _plan_id, _value = decode(["address", "uint256", "uint256"], revert_message)
+            except Exception:
+                return
+            tx = self._oldest(STATUS_OUTBOUND_PENDING, user.lower(), block)
+            if tx is not None:
+                tx.zeta_tx_hash = log["transactionHash"]
+                tx.events.append("AbortReceived")
+                tx.set_status(STATUS_ABORTED)
+
+    def _expire(self):
+        now = time.time()
+        self.store.purge(now - self.retention)
+        with self._lock:
+            for tx in self._txs.values():
+                if tx.status in FINAL_STATUSES:
+                    continue
+                if tx.status == STATUS_OUTBOUND_PENDING and now - tx.updated_at > self.outbound_grace:
+                    tx.set_status(STATUS_COMPLETED)
+                elif now - tx.created_at > self.pending_timeout:
+                    tx.set_status(STATUS_TIMEOUT)
+
+    async def run(self, poll_seconds: float = 5.0):
+        """后台循环：有待确认交易时在线程池中轮询（多 worker 部署时只在一个 worker 上运行）"""
+        while True:
+            try:
+                if await asyncio.to_thread(self.has_pending):
+                    await asyncio.to_thread(self.poll_once)
+                else:
+                    await asyncio.to_thread(self.store.purge, time.time() - self.retention)
+            except Exception as e:
+                log_event(logger, logging.WARNING, "tx_poll_failed", error=str(e))
+            await asyncio.sleep(poll_seconds)
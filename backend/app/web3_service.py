@@ -2,12 +2,20 @@
 # Web3 服务层 - 处理与智能合约的所有交互
 
 import json
+import logging
 import time
-from typing import List, Dict, Any
+from typing import List, Dict, Any, Callable, Optional
 from web3 import Web3
 from web3.exceptions import ContractLogicError
 from eth_utils import is_address, to_checksum_address
 
+from app.logger import get_logger, log_event
+from app.profiling import profiled, span
+from app.models import NFTRecord, PlanRecord
+from app.shared_cache import SharedCache
+
+logger = get_logger("web3")
+
 class Web3Error(Exception):
     """Web3 基础异常"""
     pass
@@ -28,10 +36,19 @@ class PlanNotFoundError(Web3Error):
     """计划不存在错误"""
     pass
 
+class NFTNotFoundError(Web3Error):
+    """NFT 不存在错误"""
+    pass
+
 class Web3Service:
     """Web3 服务类 - 封装所有区块链交互"""
 
-    def __init__(self, rpc_url: str, contract_address: str, abi_path: str, timeout: int = 30, max_retries: int = 3):
+    # 缓存键前缀；缓存值的结构变化时递增版本，旧条目自然失效
+    CACHE_KEY_PREFIX = "web3:v2:"
+
+    def __init__(self, rpc_url: str, contract_address: str, abi_path: str, timeout: int = 30, max_retries: int = 3,
+                 cache: Optional[SharedCache] = None, cache_ttl: int = 15,
+                 state_cache_ttl: Optional[int] = None):
         """
         初始化 Web3 服务
 
@@ -41,10 +58,17 @@ class Web3Service:
             abi_path: ABI 文件路径
             timeout: 请求超时时间（秒）
             max_retries: 最大重试次数
+            cache: 跨进程共享缓存（None 表示不缓存）
+            cache_ttl: 可变链上数据的缓存时间（秒）
+            state_cache_ttl: 计划 / NFT 列表的缓存时间（秒）；有链头追踪负责失效时可以设得很长，
+                默认与 cache_ttl 相同
         """
         self.rpc_url = rpc_url
         self.timeout = timeout
         self.max_retries = max_retries
+        self.cache = cache
+        self.cache_ttl = cache_ttl
+        self.state_cache_ttl = state_cache_ttl if state_cache_ttl is not None else cache_ttl
 
         # 初始化 Web3 连接
         self.w3 = Web3(Web3.HTTPProvider(rpc_url, request_kwargs={'timeout': timeout}))
@@ -140,20 +164,224 @@ class Web3Service:
 
         for attempt in range(self.max_retries):
             try:
-                return func_call()
+                with span("web3.rpc", attempt=attempt + 1):
+                    return func_call()
+            except ContractLogicError:
+                # 合约 revert 是确定性的，重试没有意义
+                raise
             except Exception as e:
                 last_error = e
                 if attempt < self.max_retries - 1:
                     # 指数退避
                     wait_time = 2 ** attempt
-                    print(f"⚠️ 合约调用失败，{wait_time}秒后重试... (尝试 {attempt + 1}/{self.max_retries})")
-                    time.sleep(wait_time)
+                    log_event(logger, logging.WARNING, "contract_retry",
+                              attempt=attempt + 1, max_retries=self.max_retries,
+                              wait_seconds=wait_time, error=str(e))
+                    with span("web3.retry_sleep", seconds=wait_time):
+                        time.sleep(wait_time)
                 else:
-                    print(f"❌ 合约调用失败，已达最大重试次数")
+                    log_event(logger, logging.ERROR, "contract_retry_exhausted",
+                              max_retries=self.max_retries, error=str(e))
 
         raise Web3ConnectionError(f"合约调用失败: {last_error}")
 
+    def _cached(self, key: str, compute: Callable[[], Any], ttl: Optional[float],
+                wallet: Optional[str] = None) -> Any:
+        """
+        通过共享缓存读取（未配置缓存时直接计算）
+
+        Args:
+            key: 缓存键
+            compute: 未命中时的计算函数
+            ttl: 过期秒数，None 表示永不过期
+            wallet: 数据所属钱包（checksum）；计算期间该钱包被 invalidate_wallet 过则结果不写入
+        """
+        if self.cache is None:
+            return compute()
+        guard = self._wallet_guard(wallet) if wallet is not None else None
+        return self.cache.get_or_compute(self.CACHE_KEY_PREFIX + key, compute, ttl, guard=guard)
+
+    def _wallet_guard(self, checksum_addr: str) -> str:
+        return f"{self.CACHE_KEY_PREFIX}gen:{checksum_addr}"
+
+    def _event_topic(self, event_name: str) -> str:
+        """根据 ABI 计算事件签名哈希（topic0）"""
+        for item in self.abi:
+            if item.get("type") == "event" and item.get("name") == event_name:
+                signature = f"{event_name}({','.join(i['type'] for i in item['inputs'])})"
+                return Web3.to_hex(Web3.keccak(text=signature))
+        raise ValueError(f"ABI 中没有事件: {event_name}")
+
+    @profiled("web3")
+    def get_block_number(self) -> int:
+        """获取最新区块号"""
+        return self._call_contract_with_retry(lambda: self.w3.eth.block_number)
+
+    @profiled("web3")
+    def find_deployment_block(self) -> int:
+        """
+        二分查找合约部署所在区块（按 eth_getCode 在历史区块上是否有代码判断，约 log2(链高) 次调用）
+
+        Returns:
+            int: 部署区块号
+
+        Raises:
+            ContractCallError: 当前区块没有合约代码，或 RPC 不支持查询历史状态（非归档节点）
+        """
+        def has_code(block: int) -> bool:
+            code = self._call_contract_with_retry(
+                lambda: self.w3.eth.get_code(self.contract_address, block_identifier=block)
+            )
+            return len(code) > 0
+
+        try:
+            high = self.get_block_number()
+            if not has_code(high):
+                raise ContractCallError(f"合约地址上没有代码: {self.contract_address}")
+            low = 0
+            while low < high:
+                mid = (low + high) // 2
+                if has_code(mid):
+                    high = mid
+                else:
+                    low = mid + 1
+            return low
+        except ContractCallError:
+            raise
+        except Exception as e:
+            raise ContractCallError(f"查找合约部署区块失败: {e}")
+
+    @profiled("web3")
+    def get_balance_events(self, from_block: int, to_block: int) -> List[Dict[str, Any]]:
+        """
+        获取区块范围内改变计划余额的事件（DepositMade / WithdrawalMade，按链上顺序）
+
+        Args:
+            from_block: 起始区块（含）
+            to_block: 结束区块（含）
+
+        Returns:
+            List[Dict]: [{"event", "user", "plan_id", "amount", "new_total", "block_number", "timestamp"}, ...]
+                WithdrawalMade 没有 new_total（为 None），由调用方按 amount 扣减
+
+        Raises:
+            ContractCallError: 日志读取失败
+        """
+        decoders = {
+            self._event_topic("DepositMade"): self.contract.events.DepositMade(),
+            self._event_topic("WithdrawalMade"): self.contract.events.WithdrawalMade(),
+        }
+        try:
+            logs = self._call_contract_with_retry(lambda: self.w3.eth.get_logs({
+                "address": self.contract_address,
+                "fromBlock": from_block,
+                "toBlock": to_block,
+                "topics": [list(decoders)]
+            }))
+
+            timestamps: Dict[int, int] = {}
+            events = []
+            for log in sorted(logs, key=lambda l: (l["blockNumber"], l["logIndex"])):
+                decoded = decoders[Web3.to_hex(log["topics"][0])].process_log(log)
+                block_number = decoded["blockNumber"]
+                if block_number not in timestamps:
+                    timestamps[block_number] = self._call_contract_with_retry(
+                        lambda: self.w3.eth.get_block(block_number)["timestamp"]
+                    )
+                args = decoded["args"]
+                events.append({
+                    "event": decoded["event"],
+                    "user": args["user"],
+                    "plan_id": args["planId"],
+                    "amount": args["amount"],
+                    "new_total": args.get("newTotal"),
+                    "block_number": block_number,
+                    "timestamp": timestamps[block_number]
+                })
+            return events
+        except Exception as e:
+            raise ContractCallError(f"获取存取款日志失败: {e}")
+
+    # 事件中表示钱包地址的 indexed 参数位置（topic 下标），未列出的事件为第一个 indexed 参数
+    WALLET_TOPICS = {"Transfer": (1, 2)}
+    ZERO_ADDRESS = "0x0000000000000000000000000000000000000000"
+
+    @profiled("web3")
+    def get_wallet_events(self, from_block: int, to_block: int, event_names) -> List[Dict[str, Any]]:
+        """
+        获取区块范围内指定事件涉及的钱包（按链上顺序）
+
+        Transfer 的 from / to 各产生一条记录（铸造 / 销毁时的零地址除外）。
+
+        Args:
+            from_block: 起始区块（含）
+            to_block: 结束区块（含）
+            event_names: 事件名列表
+
+        Returns:
+            List[Dict]: [{"event", "user", "block_number", "timestamp"}, ...]
+
+        Raises:
+            ContractCallError: 日志读取失败
+        """
+        topics = {self._event_topic(name): name for name in event_names}
+        try:
+            logs = self._call_contract_with_retry(lambda: self.w3.eth.get_logs({
+                "address": self.contract_address,
+                "fromBlock": from_block,
+                "toBlock": to_block,
+                "topics": [list(topics)]
+            }))
+        except Exception as e:
+            raise ContractCallError(f"获取合约日志失败: {e}")
+
+        timestamps: Dict[int, int] = {}
+        events = []
+        for log in sorted(logs, key=lambda l: (l["blockNumber"], l["logIndex"])):
+            log_topics = [Web3.to_hex(t) for t in log["topics"]]
+            if not log_topics or log_topics[0] not in topics:
+                continue
+            name = topics[log_topics[0]]
+            block_number = log["blockNumber"]
+            for index in self.WALLET_TOPICS.get(name, (1,)):
+                if index >= len(log_topics):
+                    continue
+                wallet = to_checksum_address("0x" + log_topics[index][-40:])
+                if wallet == self.ZERO_ADDRESS:
+                    continue
+                if block_number not in timestamps:
+                    timestamps[block_number] = self._call_contract_with_retry(
+                        lambda: self.w3.eth.get_block(block_number)["timestamp"]
+                    )
+                events.append({
+                    "event": name,
+                    "user": wallet,
+                    "block_number": block_number,
+                    "timestamp": timestamps[block_number]
+                })
+        return events
+
+    @profiled("web3")
+    def invalidate_wallet(self, address: str):
+        """清除某个钱包的计划、NFT 列表和余额缓存（NFT 元数据不可变，不清除）"""
+        if self.cache is None:
+            return
+        checksum_addr = to_checksum_address(address)
+        # 先升版本号再删除：正在进行的旧计算不会在删除之后写回
+        self.cache.bump(self._wallet_guard(checksum_addr))
+        self.cache.delete(f"{self.CACHE_KEY_PREFIX}nfts:{checksum_addr}")
+        self.cache.delete(f"{self.CACHE_KEY_PREFIX}balance:{checksum_addr}")
+        self.cache.delete_prefix(f"{self.CACHE_KEY_PREFIX}plan:{checksum_addr}:")
+
+    def invalidate_all_wallets(self):
+        """清除所有钱包的计划、NFT 列表和余额缓存（无法确定哪些钱包受影响时使用）"""
+        if self.cache is None:
+            return
+        for kind in ("nfts:", "balance:", "plan:"):
+            self.cache.delete_prefix(self.CACHE_KEY_PREFIX + kind)
+
     # --- 新增功能：获取原生代币余额 ---
+    @profiled("web3")
     def get_native_balance(self, address: str) -> float:
         """
         获取用户 ZETA 原生代币余额
@@ -167,16 +395,21 @@ class Web3Service:
         try:
             # 确保地址格式正确
             checksum_addr = to_checksum_address(address)
-            # 获取 Wei 单位的余额
-            balance_wei = self.w3.eth.get_balance(checksum_addr)
-            # 转换为 Ether (ZETA) 单位
-            balance_zeta = self.w3.from_wei(balance_wei, 'ether')
-            # 保留4位小数
-            return round(float(balance_zeta), 4)
+
+            def fetch_balance() -> float:
+                # 获取 Wei 单位的余额
+                balance_wei = self.w3.eth.get_balance(checksum_addr)
+                # 转换为 Ether (ZETA) 单位
+                balance_zeta = self.w3.from_wei(balance_wei, 'ether')
+                # 保留4位小数
+                return round(float(balance_zeta), 4)
+
+            return self._cached(f"balance:{checksum_addr}", fetch_balance, self.cache_ttl, wallet=checksum_addr)
         except Exception as e:
-            print(f"❌ 获取余额失败: {e}")
+            log_event(logger, logging.WARNING, "balance_failed", address=address, error=str(e))
             return 0.0
 
+    @profiled("web3")
     def get_user_nfts(self, user_address: str) -> List[int]:
         """
         获取用户的 NFT 列表
@@ -196,57 +429,96 @@ class Web3Service:
 
         # 调用合约
         try:
-            nft_ids = self._call_contract_with_retry(
-                lambda: self.contract.functions.getUserNFTs(validated_address).call()
+            return self._cached(
+                f"nfts:{validated_address}",
+                lambda: list(self._call_contract_with_retry(
+                    lambda: self.contract.functions.getUserNFTs(validated_address).call()
+                )),
+                self.state_cache_ttl,
+                wallet=validated_address
             )
-            return list(nft_ids)
         except Exception as e:
             raise ContractCallError(f"获取用户 NFT 失败: {e}")
 
-    def get_nft_metadata(self, token_id: int) -> Dict[str, Any]:
+    @profiled("web3")
+    def get_nft_record(self, token_id: int) -> NFTRecord:
         """
-        获取 NFT 元数据
+        获取 NFT 元数据（紧凑记录，直接由 ABI 元组解码）
 
         Args:
             token_id: NFT Token ID
 
         Returns:
-            Dict: NFT 元数据
+            NFTRecord: NFT 元数据记录
 
         Raises:
             ContractCallError: 合约调用失败
         """
         try:
-            result = self._call_contract_with_retry(
-                lambda: self.contract.functions.getNFTMetadata(token_id).call()
+            # NFT 元数据铸造后不可变，永久缓存（缓存原始元组，不缓存 NFTRecord 对象）
+            result = self._cached(
+                f"nft:{token_id}",
+                lambda: tuple(self._call_contract_with_retry(
+                    lambda: self.contract.functions.getNFTMetadata(token_id).call()
+                )),
+                None
             )
-
-            # 解构返回值
-            milestone_percent, achievement_date, savings_amount, token_address, goal_description = result
-
-            return {
-                "token_id": token_id,
-                "milestone_percent": self._wei_to_string(milestone_percent),
-                "achievement_date": self._wei_to_string(achievement_date),
-                "savings_amount": self._wei_to_string(savings_amount),
-                "token_address": token_address,
-                "goal_description": goal_description
-            }
+            return NFTRecord.from_abi(token_id, result)
         except ContractLogicError as e:
             raise ContractCallError(f"NFT 不存在或合约调用失败: {e}")
         except Exception as e:
             raise ContractCallError(f"获取 NFT 元数据失败: {e}")
 
-    def get_user_plan(self, user_address: str, plan_id: int) -> Dict[str, Any]:
+    @profiled("web3")
+    def get_token_uri(self, token_id: int) -> str:
         """
-        获取用户的储蓄计划
+        获取 NFT 的 tokenURI（链上 Base64 data URI，不经过共享缓存，由 NFTRenderCache 落盘）
+
+        Args:
+            token_id: NFT Token ID
+
+        Returns:
+            str: tokenURI
+
+        Raises:
+            NFTNotFoundError: NFT 不存在
+            ContractCallError: 合约调用失败
+        """
+        try:
+            return self._call_contract_with_retry(
+                lambda: self.contract.functions.tokenURI(token_id).call()
+            )
+        except ContractLogicError as e:
+            raise NFTNotFoundError(f"NFT 不存在: token_id={token_id}, {e}")
+        except Exception as e:
+            raise ContractCallError(f"获取 tokenURI 失败: {e}")
+
+    def get_nft_metadata(self, token_id: int) -> Dict[str, Any]:
+        """
+        获取 NFT 元数据
+
+        Args:
+            token_id: NFT Token ID
+
+        Returns:
+            Dict: NFT 元数据
+
+        Raises:
+            ContractCallError: 合约调用失败
+        """
+        return self.get_nft_record(token_id).to_dict()
+
+    @profiled("web3")
+    def get_plan_record(self, user_address: str, plan_id: int) -> PlanRecord:
+        """
+        获取用户的储蓄计划（紧凑记录，直接由 ABI 元组解码）
 
         Args:
             user_address: 用户地址
             plan_id: 计划 ID
 
         Returns:
-            Dict: 计划详情
+            PlanRecord: 计划记录
 
         Raises:
             InvalidAddressError: 地址格式无效
@@ -257,37 +529,42 @@ class Web3Service:
         validated_address = self._validate_address(user_address)
 
         try:
-            result = self._call_contract_with_retry(
-                lambda: self.contract.functions.getUserPlan(validated_address, plan_id).call()
+            result = self._cached(
+                f"plan:{validated_address}:{plan_id}",
+                lambda: tuple(self._call_contract_with_retry(
+                    lambda: self.contract.functions.getUserPlan(validated_address, plan_id).call()
+                )),
+                self.state_cache_ttl,
+                wallet=validated_address
             )
 
-            # 解构返回值 (12 个字段)
-            (token_address, target_amount, current_amount, amount_per_cycle,
-             cycle_frequency, start_time, last_deposit_time, active,
-             milestone_50_claimed, milestone_100_claimed, savings_goal, progress_percent) = result
-
             # 检查计划是否存在（根据 active 状态或其他标志）
             # 如果 target_amount 为 0，可能表示计划不存在
-            if target_amount == 0 and current_amount == 0:
+            if result[1] == 0 and result[2] == 0:
                 raise PlanNotFoundError(f"计划不存在: address={user_address}, plan_id={plan_id}")
 
-            return {
-                "token_address": token_address,
-                "target_amount": self._wei_to_string(target_amount),
-                "current_amount": self._wei_to_string(current_amount),
-                "amount_per_cycle": self._wei_to_string(amount_per_cycle),
-                "cycle_frequency": cycle_frequency,
-                "start_time": self._wei_to_string(start_time),
-                "last_deposit_time": self._wei_to_string(last_deposit_time),
-                "is_active": active,
-                "milestone_50_claimed": milestone_50_claimed,
-                "milestone_100_claimed": milestone_100_claimed,
-                "savings_goal": savings_goal,
-                "progress_percent": self._wei_to_string(progress_percent)
-            }
+            return PlanRecord.from_abi(result)
         except PlanNotFoundError:
             raise
         except ContractLogicError as e:
             raise PlanNotFoundError(f"计划不存在或合约调用失败: {e}")
         except Exception as e:
-            raise ContractCallError(f"获取用户计划失败: {e}")
\ No newline at end of file
+            raise ContractCallError(f"获取用户计划失败: {e}")
+
+    def get_user_plan(self, user_address: str, plan_id: int) -> Dict[str, Any]:
+        """
+        获取用户的储蓄计划
+
+        Args:
+            user_address: 用户地址
+            plan_id: 计划 ID
+
+        Returns:
+            Dict: 计划详情
+
+        Raises:
+            InvalidAddressError: 地址格式无效
+            PlanNotFoundError: 计划不存在
+            ContractCallError: 合约调用失败
+        """
+        return self.get_plan_record(user_address, plan_id).to_dict()
\ No newline at end of file
@@ -0,0 +1,39 @@
+# worker_lock.py
+# 单 worker 锁 - 多个 uvicorn worker 中只让一个运行后台任务（调度器、日志导入等）
+
+import os
+from typing import Dict
+
+try:
+    import fcntl
+except ImportError:  # Windows 开发环境：只有一个进程，直接视为持有锁
+    fcntl = None
+
+# 路径 -> 已打开的锁文件描述符（进程退出时由操作系统释放锁）
+_held: Dict[str, int] = {}
+
+
+def try_acquire(lock_path: str) -> bool:
+    """
+    非阻塞地获取进程级文件锁
+
+    Args:
+        lock_path: 锁文件路径（所有 worker 使用同一路径）
+
+    Returns:
+        bool: 当前进程是否持有锁
+    """
+    if lock_path in _held:
+        return True
+    if fcntl is None:
+        _held[lock_path] = -1
+        return True
+
+    fd = os.open(lock_path, os.O_RDWR | os.O_CREAT, 0o644)
+    try:
+        fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except OSError:
+        os.close(fd)
+        return False
+    _held[lock_path] = fd
+    return True
@@ -0,0 +1,71 @@
+# backend/benchmarks/bench_serialization.py
+# NFT 列表序列化微基准：旧路径 (dict -> Pydantic 校验 -> FastAPI 编码) vs 快速路径 (slotted 记录 -> orjson)
+# 运行: cd backend && python -m benchmarks.bench_serialization [NFT数量]
+
+import json
+import sys
+import timeit
+
+from fastapi.encoders import jsonable_encoder
+
+from app.models import NFTMetadata, NFTRecord, UserNFTsResponse
+from app.serialization import FastJSONResponse
+
+ADDRESS = "0x05BA149A7bd6dC1F937fA9046A9e05C05f3b18b0"
+
+
+def make_abi_results(n: int) -> list:
+    """构造模拟的 getNFTMetadata 返回元组"""
+    return [
+        (50 if i % 2 else 100, 1700000000 + i, 10 ** 18 * (i + 1), ADDRESS, f"Goal #{i}")
+        for i in range(n)
+    ]
+
+
+def legacy_path(results: list) -> bytes:
+    """原实现：_wei_to_string 转 dict，NFTMetadata(**) 校验，response_model 再编码"""
+    nfts = []
+    for token_id, (milestone, date, amount, token, goal) in enumerate(results):
+        metadata = {
+            "token_id": token_id,
+            "milestone_percent": str(milestone),
+            "achievement_date": str(date),
+            "savings_amount": str(amount),
+            "token_address": token,
+            "goal_description": goal
+        }
+        nfts.append(NFTMetadata(**metadata))
+    response = UserNFTsResponse(user_address=ADDRESS, nft_count=len(nfts), nfts=nfts)
+    # FastAPI 对 response_model 的处理：再校验一次，再 jsonable_encoder，再 json.dumps
+    validated = UserNFTsResponse.model_validate(response.model_dump())
+    return json.dumps(jsonable_encoder(validated), ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+
+def fast_path(results: list) -> bytes:
+    """快速路径：slotted 记录直接由元组解码，跳过校验，orjson 输出"""
+    records = [NFTRecord.from_abi(token_id, result) for token_id, result in enumerate(results)]
+    return FastJSONResponse({
+        "user_address": ADDRESS,
+        "nft_count": len(records),
+        "nfts": [r.to_dict() for r in records]
+    }).body
+
+
+def main():
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 1000
+    results = make_abi_results(n)
+
+    assert json.loads(legacy_path(results)) == json.loads(fast_path(results)), "两种路径输出不一致"
+
+    rounds = 20
+    legacy = min(timeit.repeat(lambda: legacy_path(results), number=1, repeat=rounds))
+    fast = min(timeit.repeat(lambda: fast_path(results), number=1, repeat=rounds))
+
+    print(f"NFT 数量: {n}")
+    print(f"旧路径:   {legacy * 1e6 / n:8.2f} µs/条  ({legacy * 1e3:.2f} ms)")
+    print(f"快速路径: {fast * 1e6 / n:8.2f} µs/条  ({fast * 1e3:.2f} ms)")
+    print(f"加速比:   {legacy / fast:.1f}x")
+
+
+if __name__ == "__main__":
+    main()
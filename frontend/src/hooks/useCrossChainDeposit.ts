@@ -1,14 +1,17 @@
 // Hook for depositing to an existing savings plan via Gateway (cross-chain)
 // Users call this from Base Sepolia or ETH Sepolia - NOT directly on ZetaChain
+// Status is tracked by the backend (see useTrackedTransaction)
 
-import { useWriteContract, useWaitForTransactionReceipt, useAccount } from 'wagmi'
+import { useWriteContract, useAccount } from 'wagmi'
 import { encodeAbiParameters, parseAbiParameters } from 'viem'
 import { ZETASAVE_CONTRACT, GATEWAY_ABI, getGatewayForChain, isSourceChain, type RevertOptions } from '@/config/contracts'
+import { useTrackedTransaction } from '@/hooks/useTrackedTransaction'
 
 export function useCrossChainDeposit() {
-  const { writeContract, data: hash, isPending, error, reset } = useWriteContract()
-  const { isLoading: isConfirming, isSuccess } = useWaitForTransactionReceipt({ hash })
+  const { writeContract, data: hash, variables, isPending, error, reset } = useWriteContract()
   const { chain } = useAccount()
+  const { crossChainStatus, isConfirming, isSuccess, crossChainError } =
+    useTrackedTransaction(hash, variables?.chainId ?? chain?.id)
 
   /**
    * Deposit to an existing savings plan via cross-chain message
@@ -45,6 +48,7 @@ export function useCrossChainDeposit() {
     writeContract({
       address: gateway,
       abi: GATEWAY_ABI,
+      chainId: chain.id, // Recorded in variables so status tracking uses the source chain
       functionName: 'depositAndCall',
       args: [ZETASAVE_CONTRACT.address, message, revertOptions],
       value: amount, // Send ETH with the transaction
@@ -58,7 +62,8 @@ export function useCrossChainDeposit() {
     isConfirming,
     isSuccess,
     hash,
-    error,
+    crossChainStatus,
+    error: error ?? crossChainError,
     reset,
     // Helper to check if user is on a valid source chain
     isOnSourceChain: isSourceChain(chain?.id),
@@ -0,0 +1,70 @@
+// Hook for following a cross-chain transaction through the backend tracker (/api/tx-status)
+// The backend polls every pending transaction in one shared loop, so tabs only read its status.
+// The wallet receipt watcher is used as a fallback when the tracker is disabled.
+
+import { useWaitForTransactionReceipt } from 'wagmi'
+import { useQuery } from '@tanstack/react-query'
+
+const API_BASE = 'http://127.0.0.1:8000'
+const TX_STATUS_POLL_MS = 5000
+const FINAL_STATUSES = ['failed', 'completed', 'reverted', 'aborted', 'timeout']
+
+export type CrossChainStatus =
+  | 'pending'
+  | 'failed'
+  | 'inbound_confirmed'
+  | 'outbound_pending'
+  | 'completed'
+  | 'reverted'
+  | 'aborted'
+  | 'timeout'
+
+async function registerTx(hash: string, chainId: number): Promise<CrossChainStatus> {
+  const response = await fetch(`${API_BASE}/api/tx-status/watch`, {
+    method: 'POST',
+    headers: { 'Content-Type': 'application/json' },
+    body: JSON.stringify({ transactions: [{ tx_hash: hash, chain_id: chainId }] }),
+  })
+  if (!response.ok) {
+    throw new Error(`Transaction tracker unavailable (${response.status})`)
+  }
+  const data = await response.json()
+  return data.transactions[0].status
+}
+
+async function fetchTxStatus(hash: string, chainId: number): Promise<CrossChainStatus> {
+  const response = await fetch(`${API_BASE}/api/tx-status?hashes=${hash}`)
+  if (!response.ok) {
+    throw new Error(`Transaction tracker unavailable (${response.status})`)
+  }
+  const data = await response.json()
+  const tx = data.transactions[hash]
+  // Not tracked yet (first poll) or already expired on the backend: register it once
+  return tx ? tx.status : registerTx(hash, chainId)
+}
+
+export function useTrackedTransaction(hash: `0x${string}` | undefined, chainId: number | undefined) {
+  const tracked = useQuery({
+    queryKey: ['tx-status', hash, chainId],
+    queryFn: () => fetchTxStatus(hash!, chainId!),
+    enabled: !!hash && !!chainId,
+    retry: 1,
+    refetchInterval: (query) =>
+      query.state.data && FINAL_STATUSES.includes(query.state.data) ? false : TX_STATUS_POLL_MS,
+  })
+
+  // Fall back to watching the receipt from the wallet RPC only if the backend tracker is unavailable
+  const trackerUnavailable = !!hash && tracked.isError
+  const receipt = useWaitForTransactionReceipt({ hash, query: { enabled: trackerUnavailable } })
+
+  const crossChainStatus = tracked.data
+  const isFinal = !!crossChainStatus && FINAL_STATUSES.includes(crossChainStatus)
+  const isConfirming = trackerUnavailable ? receipt.isLoading : !!hash && !isFinal
+  const isSuccess = trackerUnavailable ? receipt.isSuccess : crossChainStatus === 'completed'
+  const crossChainError =
+    isFinal && crossChainStatus !== 'completed'
+      ? new Error(`Cross-chain transaction ${crossChainStatus}`)
+      : null
+
+  return { crossChainStatus, isConfirming, isSuccess, crossChainError }
+}